@@ -0,0 +1,6 @@
+"""
+Benchmarks for timekeeper.
+
+Each module is runnable from the repository root, e.g.
+`python -m benchmarks.last_attendance --help`.
+"""
@@ -0,0 +1,176 @@
+"""
+Drives the message handlers with fake Slack messages on SQLite and reports
+their latency, the number of queries and the throughput.
+
+    python -m benchmarks.handlers --users 50 --history 1000 --requests 200
+
+It works offline. Pass limits to use it as a regression gate, e.g.
+
+    python -m benchmarks.handlers --max-p95 show_timesheet=20 \\
+        --max-queries on_finish_working=4
+
+which exits with status 1 if any of them is exceeded. The queries of
+clocking in and out are limited to their mean at the default of four
+requests per user unless --max-queries is given.
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.utils import (FakeMessage, QueryCounter, percentile,
+                              print_table, use_temporary_database)
+
+use_temporary_database()
+
+from slackbot import settings  # noqa
+
+settings.TIMEKEEPER_FIGURE_CACHE_DIR = tempfile.mkdtemp(
+    prefix='timekeeper-benchmark-figures-')
+settings.TIMEKEEPER_WRITE_BEHIND = False
+
+import timekeeper.plugins as plugins  # noqa
+from timekeeper.database import get_db, setup_db  # noqa
+from timekeeper.models import DailyAttendance  # noqa
+
+HANDLERS = ['on_start_working', 'on_finish_working', 'show_timesheet',
+            'show_daily_timesheet', 'show_contributions',
+            'show_contributions_uncached']
+# Clocking in costs an insert and one or two updates, and clocking out a
+# read, two updates and a refresh of the daily summary, or a read and an
+# insert if the user has not clocked in.
+DEFAULT_MAX_QUERIES = ['on_start_working=4', 'on_finish_working=4']
+
+
+def populate(db, users, history):
+    """
+    Creates trackable users with `history` closed attendances each,
+    bypassing the ORM, and their daily summaries.
+    """
+    user_ids = ['U{:08d}'.format(i) for i in range(users)]
+    now = datetime.utcnow()
+    origin = now - timedelta(hours=10 * history)
+    with db.atomic():
+        conn = db.get_conn()
+        conn.executemany(
+            'insert into user (id, name, timezone_id, trackable, created_at) '
+            'values (?, ?, ?, ?, ?)',
+            [(user_id, user_id, 'Asia/Tokyo', True, now)
+             for user_id in user_ids])
+        conn.executemany(
+            'insert into attendance (created_at, started_at, finished_at, '
+            'user_id) values (?, ?, ?, ?)',
+            ((now, started_at, started_at + timedelta(hours=8), user_id)
+             for user_id in user_ids
+             for started_at in (origin + timedelta(hours=10 * i)
+                                for i in range(history))))
+    DailyAttendance.rebuild()
+    return user_ids
+
+
+def call(name, user_id):
+    if name == 'show_contributions_uncached':
+        plugins.figure_cache.invalidate('contributions-{}'.format(user_id))
+        name = 'show_contributions'
+    message = FakeMessage(user_id, channel_id='C00000000')
+    getattr(plugins, name)(message)
+    return message
+
+
+def run_handler(db, name, user_ids, requests):
+    latencies = []
+    query_counts = []
+    started_at = time.perf_counter()
+    for i in range(requests):
+        user_id = user_ids[i % len(user_ids)]
+        with QueryCounter(db) as counter:
+            request_started_at = time.perf_counter()
+            call(name, user_id)
+            latencies.append(time.perf_counter() - request_started_at)
+        query_counts.append(counter.count)
+    elapsed = time.perf_counter() - started_at
+    return latencies, query_counts, requests / elapsed
+
+
+def parse_limits(values):
+    limits = {}
+    for value in values:
+        name, _, limit = value.partition('=')
+        if name not in HANDLERS:
+            raise argparse.ArgumentTypeError(
+                'Unknown handler: {}'.format(name))
+        limits[name] = float(limit)
+    return limits
+
+
+def run(users, history, requests, handlers, max_p95, max_queries):
+    setup_db()
+    db = get_db()
+    user_ids = populate(db, users, history)
+    # Load the analytics stack and start render workers before measuring.
+    plugins.warm_up_analytics()
+    call('show_contributions_uncached', user_ids[0])
+    rows = []
+    failures = []
+    for name in handlers:
+        # Cycle clock events so that every start has a matching finish.
+        if name == 'on_finish_working' and 'on_start_working' not in handlers:
+            run_handler(db, 'on_start_working', user_ids, len(user_ids))
+        # Measure cache hits only; cache misses are measured separately.
+        if name == 'show_contributions':
+            run_handler(db, name, user_ids, len(user_ids))
+        latencies, query_counts, throughput = run_handler(db, name, user_ids,
+                                                          requests)
+        p95 = percentile(latencies, 95) * 1000
+        queries = sum(query_counts) / len(query_counts)
+        rows.append((name, requests,
+                     percentile(latencies, 50) * 1000, p95,
+                     percentile(latencies, 99) * 1000,
+                     queries, throughput))
+        if name in max_p95 and p95 > max_p95[name]:
+            failures.append('{} p95 {:.3f} ms > {:.3f} ms'.format(
+                name, p95, max_p95[name]))
+        if name in max_queries and queries > max_queries[name]:
+            failures.append('{} {:.1f} queries > {:.1f}'.format(
+                name, queries, max_queries[name]))
+    plugins.render_pool.shutdown()
+    shutil.rmtree(settings.TIMEKEEPER_FIGURE_CACHE_DIR)
+    print_table(rows, headers=['handler', 'requests', 'p50 (ms)', 'p95 (ms)',
+                               'p99 (ms)', 'queries', 'throughput (req/s)'])
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--history', type=int, default=1000,
+                        help='attendances per user')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per handler')
+    parser.add_argument('--handlers', nargs='+', choices=HANDLERS,
+                        default=HANDLERS)
+    parser.add_argument('--max-p95', nargs='+', default=[],
+                        metavar='HANDLER=MS')
+    parser.add_argument('--max-queries', nargs='+',
+                        default=DEFAULT_MAX_QUERIES, metavar='HANDLER=N')
+    args = parser.parse_args()
+    try:
+        max_p95 = parse_limits(args.max_p95)
+        max_queries = parse_limits(args.max_queries)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    failures = run(args.users, args.history, args.requests, args.handlers,
+                   max_p95, max_queries)
+    for failure in failures:
+        print('FAILED: ' + failure, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Measures the latency of User.last_attendance() with and without the
+composite indexes on the attendance table.
+
+    python -m benchmarks.last_attendance --sizes 10000 100000 1000000
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import os
+import shutil
+import tempfile
+
+from benchmarks.utils import (bind_models, create_sqlite_database, measure,
+                              median, percentile, print_table,
+                              use_temporary_database)
+
+use_temporary_database()
+
+from timekeeper.database import migrate_indexes  # noqa
+from timekeeper.models import Attendance, DailyAttendance, User  # noqa
+
+MODELS = [User, Attendance, DailyAttendance]
+
+
+def populate(db, user, size, batch_size=10000):
+    """
+    Inserts `size` closed attendances for the user and a few for another
+    user, bypassing the ORM to keep the setup fast.
+    """
+    db.execute_sql('insert into user (id, name, timezone_id, trackable, '
+                   'created_at) values (?, ?, ?, ?, ?)',
+                   (user, user, 'Asia/Tokyo', True, datetime.utcnow()))
+    db.execute_sql('insert into user (id, name, timezone_id, trackable, '
+                   'created_at) values (?, ?, ?, ?, ?)',
+                   ('other', 'other', 'Asia/Tokyo', True, datetime.utcnow()))
+    statement = ('insert into attendance (created_at, started_at, '
+                 'finished_at, user_id) values (?, ?, ?, ?)')
+    origin = datetime(2000, 1, 1)
+    conn = db.get_conn()
+    with db.atomic():
+        for offset in range(0, size, batch_size):
+            rows = []
+            for i in range(offset, min(size, offset + batch_size)):
+                started_at = origin + timedelta(hours=i)
+                finished_at = started_at + timedelta(minutes=30)
+                rows.append((started_at, started_at, finished_at, user))
+                if i % 100 == 0:
+                    rows.append((started_at, started_at, finished_at, 'other'))
+            conn.executemany(statement, rows)
+
+
+def drop_composite_indexes(db, table):
+    for index in db.get_indexes(table):
+        if len(index.columns) > 1:
+            db.execute_sql('drop index "{}"'.format(index.name))
+
+
+def run(sizes, repeat):
+    rows = []
+    directory = tempfile.mkdtemp(prefix='timekeeper-benchmark-')
+    for size in sizes:
+        db = create_sqlite_database(os.path.join(directory, 'db.sqlite3'))
+        bind_models(db, MODELS)
+        db.create_tables(MODELS)
+        drop_composite_indexes(db, Attendance._meta.db_table)
+        populate(db, 'user', size)
+        db.execute_sql('analyze')
+        user = User.get(User.id == 'user')
+        before = measure(user.last_attendance, repeat)
+        migrate_indexes([Attendance])
+        db.execute_sql('analyze')
+        after = measure(user.last_attendance, repeat)
+        rows.append((size,
+                     median(before) * 1000, percentile(before, 95) * 1000,
+                     median(after) * 1000, percentile(after, 95) * 1000,
+                     median(before) / median(after)))
+        db.close()
+    shutil.rmtree(directory)
+    print_table(rows, headers=['rows', 'before p50 (ms)', 'before p95 (ms)',
+                               'after p50 (ms)', 'after p95 (ms)', 'speedup'])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    run(args.sizes, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Measures messages per second matched against the patterns of the plugins
+by slackbot and by the router, on generated channel traffic.
+
+    python -m benchmarks.router --messages 100000 --commands 0.02
+
+Most messages in channels are chatter which no pattern matches, and a few
+are clock-ins and clock-outs.
+"""
+
+import argparse
+import random
+import time
+
+from benchmarks.utils import median, print_table, use_temporary_database
+
+use_temporary_database()
+
+from slackbot.manager import PluginsManager  # noqa
+
+import timekeeper.plugins  # noqa: registers handlers
+from timekeeper.plugins.router import Router  # noqa
+
+WORDS = ('the', 'a', 'to', 'is', 'it', 'this', 'that', 'we', 'I', 'you',
+         'deploy', 'review', 'PR', 'merged', 'lunch', 'meeting', 'build',
+         'test', 'tomorrow', 'please', 'check', 'thanks', 'LGTM', 'issue',
+         'release', 'staging', 'fixed', 'broken', 'works', 'working on',
+         'looks good', 'can someone help', 'https://example.com/pull/123',
+         '了解です', '確認します', 'お疲れ様です', 'よろしくお願いします',
+         'レビューお願いします', 'デプロイしました', '作業中です')
+
+COMMANDS = ('started working', 'Started working!', 'resume working',
+            'continue working', 'finished working', 'stop working',
+            'Finished working for today', '作業を開始します', '作業を再開します',
+            '作業を終了します', '中断します',
+            'finished working, started working again',
+            'resumed working, I mean started working')
+
+
+def generate_traffic(count, command_ratio, seed=0):
+    rnd = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        if rnd.random() < command_ratio:
+            messages.append(rnd.choice(COMMANDS))
+        else:
+            messages.append(' '.join(rnd.choice(WORDS)
+                                     for _ in range(rnd.randint(1, 30))))
+    return messages
+
+
+def slackbot_matcher(manager, category):
+    get_plugins = PluginsManager.get_plugins
+    # The router replaces get_plugins when the plugins are loaded.
+    get_plugins = getattr(get_plugins, '__wrapped__', get_plugins)
+    return lambda text: [func for func, _
+                         in get_plugins(manager, category, text) if func]
+
+
+def router_matcher(manager, category):
+    router = Router(manager.commands[category])
+    return lambda text: router.match(text)[0]
+
+
+def throughput(match, messages, repeat):
+    rates = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        for text in messages:
+            match(text)
+        rates.append(len(messages) / (time.perf_counter() - started_at))
+    return median(rates)
+
+
+def count_handlers(match, messages):
+    counts = [0, 0, 0]
+    for text in messages:
+        handlers = match(text)
+        if not isinstance(handlers, list):
+            handlers = [handlers] if handlers else []
+        counts[min(len(handlers), 2)] += 1
+    return counts
+
+
+def run(count, command_ratio, repeat):
+    manager = PluginsManager()
+    messages = generate_traffic(count, command_ratio)
+    rows = []
+    for category in ('listen_to', 'respond_to'):
+        baseline = None
+        for name, factory in (('slackbot', slackbot_matcher),
+                              ('router', router_matcher)):
+            match = factory(manager, category)
+            rate = throughput(match, messages, repeat)
+            if baseline is None:
+                baseline = rate
+            _, one, several = count_handlers(match, messages)
+            rows.append((category, name, rate, rate / baseline, one, several))
+    print_table(rows, headers=['category', 'matcher', 'messages/s', 'speedup',
+                               'one handler', 'several handlers'])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--commands', type=float, default=0.02,
+                        help='the ratio of clock-ins and clock-outs')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.messages, args.commands, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Compares clock event throughput on SQLite with stock settings and with
+TIMEKEEPER_SQLITE_PRAGMAS while a reader renders daily timesheets.
+
+    python -m benchmarks.sqlite_writes --users 50 --events 200 --writers 4
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import os
+import shutil
+import tempfile
+from threading import Event, Thread
+import time
+
+from peewee import OperationalError
+
+from benchmarks.utils import (bind_models, create_sqlite_database, print_table,
+                              use_temporary_database)
+
+use_temporary_database()
+
+from slackbot import settings  # noqa
+from timekeeper.database import connection  # noqa
+from timekeeper.models import Attendance, DailyAttendance, User  # noqa
+
+MODELS = [User, Attendance, DailyAttendance]
+
+
+def write_events(db, user_ids, events, counters):
+    origin = datetime(2017, 1, 1)
+    with connection(db):
+        users = [User.get(User.id == user_id) for user_id in user_ids]
+        for i in range(events):
+            user = users[i % len(users)]
+            timestamp = origin + timedelta(minutes=i)
+            try:
+                if i // len(users) % 2 == 0:
+                    user.start_working(timestamp)
+                else:
+                    user.finish_working(timestamp)
+            except OperationalError:
+                counters['write_errors'] += 1
+            else:
+                counters['writes'] += 1
+
+
+def read_timesheets(db, user_ids, stopped, counters):
+    with connection(db):
+        while not stopped.is_set():
+            for user_id in user_ids:
+                try:
+                    list(DailyAttendance.select()
+                         .where(DailyAttendance.user == user_id)
+                         .order_by(DailyAttendance.date.desc())
+                         .limit(30))
+                    list(Attendance.select()
+                         .where(Attendance.user == user_id)
+                         .order_by(Attendance.started_at.desc())
+                         .limit(30))
+                except OperationalError:
+                    counters['read_errors'] += 1
+                else:
+                    counters['reads'] += 1
+
+
+def run_profile(path, pragmas, users, events, writers):
+    db = create_sqlite_database(path, pragmas=pragmas)
+    bind_models(db, MODELS)
+    db.create_tables(MODELS)
+    user_ids = ['U{}'.format(i) for i in range(users)]
+    with db.atomic():
+        for user_id in user_ids:
+            User.create(id=user_id, name=user_id, trackable=True)
+    db.close()
+
+    counters = {'writes': 0, 'write_errors': 0, 'reads': 0, 'read_errors': 0}
+    stopped = Event()
+    reader = Thread(target=read_timesheets,
+                    args=(db, user_ids, stopped, counters))
+    threads = [Thread(target=write_events,
+                      args=(db, user_ids[i::writers], events, counters))
+               for i in range(writers)]
+    reader.start()
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started_at
+    stopped.set()
+    reader.join()
+    return (counters['writes'] / elapsed, counters['write_errors'],
+            counters['reads'] / elapsed, counters['read_errors'])
+
+
+def run(users, events, writers):
+    directory = tempfile.mkdtemp(prefix='timekeeper-benchmark-')
+    profiles = [
+        ('stock', []),
+        ('tuned', list(settings.TIMEKEEPER_SQLITE_PRAGMAS)),
+    ]
+    rows = []
+    for name, pragmas in profiles:
+        path = os.path.join(directory, name + '.sqlite3')
+        rows.append((name,) + run_profile(path, pragmas, users, events,
+                                          writers))
+    shutil.rmtree(directory)
+    print_table(rows, headers=['profile', 'writes/s', 'write errors',
+                               'reads/s', 'read errors'])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--events', type=int, default=200,
+                        help='clock events per writer thread')
+    parser.add_argument('--writers', type=int, default=4)
+    args = parser.parse_args()
+    run(args.users, args.events, args.writers)
+
+
+if __name__ == '__main__':
+    main()
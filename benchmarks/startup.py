@@ -0,0 +1,72 @@
+"""
+Records the time and memory to start bot.py up to loading its plugins,
+with the analytics stack loaded lazily or eagerly.
+
+    python -m benchmarks.startup --repeat 5
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from textwrap import dedent
+
+from benchmarks.utils import median, print_table, use_temporary_database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD_SCRIPT = dedent("""\
+    import json
+    import resource
+    import sys
+    import time
+
+    started_at = time.perf_counter()
+    import bot  # noqa
+    from slackbot.manager import PluginsManager
+    PluginsManager().init_plugins()
+    if sys.argv[1] == 'eager':
+        from timekeeper.charts import warm_up
+        import pandas  # noqa
+        warm_up()
+    elapsed = time.perf_counter() - started_at
+    print(json.dumps({
+        'seconds': elapsed,
+        'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'modules': [name for name in ('pandas', 'matplotlib', 'calmap')
+                    if name in sys.modules],
+    }))
+""")
+
+
+def measure_startup(mode):
+    output = subprocess.check_output(
+        [sys.executable, '-c', CHILD_SCRIPT, mode], cwd=ROOT, env=os.environ)
+    return json.loads(output.decode('utf-8').splitlines()[-1])
+
+
+def run(repeat):
+    rows = []
+    for mode in ('lazy', 'eager'):
+        results = [measure_startup(mode) for _ in range(repeat)]
+        rows.append((mode,
+                     median([result['seconds'] for result in results]),
+                     max(result['max_rss'] for result in results) / 1024,
+                     ', '.join(results[-1]['modules']) or '-'))
+    print_table(rows, headers=['mode', 'startup (s)', 'max RSS (MiB)',
+                               'heavy modules loaded'])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    use_temporary_database()
+    run(args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Compares building the contribution series with pandas.read_sql_query
+against streaming rows into NumPy arrays.
+
+    python -m benchmarks.stats --sizes 365 3650 36500
+"""
+
+import argparse
+from datetime import date, datetime, timedelta
+import os
+import shutil
+import tempfile
+
+from benchmarks.utils import (bind_models, create_sqlite_database, measure,
+                              median, percentile, print_table,
+                              use_temporary_database)
+
+use_temporary_database()
+
+from timekeeper.models import Attendance, DailyAttendance, User  # noqa
+from timekeeper.stats import working_time_ratio_series  # noqa
+
+MODELS = [User, Attendance, DailyAttendance]
+
+
+def populate(db, user, size):
+    """
+    Inserts `size` daily summaries for the user, bypassing the ORM.
+    """
+    db.execute_sql('insert into user (id, name, timezone_id, trackable, '
+                   'created_at) values (?, ?, ?, ?, ?)',
+                   (user, user, 'Asia/Tokyo', True, datetime.utcnow()))
+    origin = date(2000, 1, 1)
+    created_at = datetime.utcnow()
+    rows = [(user, origin + timedelta(days=i), i % 3, 3600 + i % 28800,
+             False, created_at)
+            for i in range(size)]
+    with db.atomic():
+        db.get_conn().executemany(
+            'insert into daily_attendance (user_id, date, break_count, '
+            'working_time_seconds, archived, created_at) '
+            'values (?, ?, ?, ?, ?, ?)', rows)
+
+
+def pandas_series(db, user):
+    """
+    The former implementation which reads a DataFrame of all summaries.
+    """
+    import pandas as pd
+
+    statement = """select `date`, working_time_seconds
+                    from daily_attendance
+                    where user_id = ?
+                    order by `date`"""
+    df = pd.read_sql_query(statement, db.get_conn(), index_col='date',
+                           parse_dates=['date'], params=[user.id])
+    return df.working_time_seconds / df.working_time_seconds.std()
+
+
+def run(sizes, repeat):
+    rows = []
+    directory = tempfile.mkdtemp(prefix='timekeeper-benchmark-')
+    for size in sizes:
+        db = create_sqlite_database(os.path.join(directory, 'db.sqlite3'))
+        bind_models(db, MODELS)
+        db.create_tables(MODELS)
+        populate(db, 'user', size)
+        user = User.get(User.id == 'user')
+        last_year = (date(2000, 1, 1) + timedelta(days=size - 1)).year
+        before = measure(lambda: pandas_series(db, user), repeat)
+        after = measure(lambda: working_time_ratio_series(user), repeat)
+        year = measure(lambda: working_time_ratio_series(
+            user, date(last_year, 1, 1), date(last_year + 1, 1, 1)), repeat)
+        rows.append((size,
+                     median(before) * 1000, percentile(before, 95) * 1000,
+                     median(after) * 1000, percentile(after, 95) * 1000,
+                     median(year) * 1000,
+                     median(before) / median(year)))
+        db.close()
+        os.remove(os.path.join(directory, 'db.sqlite3'))
+    shutil.rmtree(directory)
+    print_table(rows, headers=['rows', 'pandas p50 (ms)', 'pandas p95 (ms)',
+                               'numpy p50 (ms)', 'numpy p95 (ms)',
+                               'numpy 1 year p50 (ms)', 'speedup'])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[365, 3650, 36500])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    run(args.sizes, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
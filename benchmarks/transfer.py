@@ -0,0 +1,70 @@
+"""
+Measures the throughput of exporting and importing attendances on SQLite.
+
+    python -m benchmarks.transfer --sizes 100000 1000000
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.last_attendance import populate
+from benchmarks.utils import (bind_models, create_sqlite_database, print_table,
+                              use_temporary_database)
+
+use_temporary_database()
+
+from slackbot import settings  # noqa
+from timekeeper.models import Attendance, DailyAttendance, User  # noqa
+from timekeeper.transfer import export_data, import_data  # noqa
+
+MODELS = [User, Attendance, DailyAttendance]
+
+
+def run(sizes):
+    rows = []
+    directory = tempfile.mkdtemp(prefix='timekeeper-benchmark-')
+    path = os.path.join(directory, 'attendances.jsonl')
+    pragmas = list(settings.TIMEKEEPER_SQLITE_PRAGMAS)
+    for size in sizes:
+        source = create_sqlite_database(
+            os.path.join(directory, 'source.sqlite3'))
+        bind_models(source, MODELS)
+        source.create_tables(MODELS)
+        populate(source, 'user', size)
+        started_at = time.perf_counter()
+        with open(path, 'w') as f:
+            count = export_data(f)
+        export_time = time.perf_counter() - started_at
+        source.close()
+
+        destination = create_sqlite_database(
+            os.path.join(directory, 'destination.sqlite3'), pragmas=pragmas)
+        bind_models(destination, MODELS)
+        destination.create_tables(MODELS)
+        started_at = time.perf_counter()
+        with open(path) as f:
+            import_data(f)
+        import_time = time.perf_counter() - started_at
+        destination.close()
+        rows.append((count, os.path.getsize(path) / 2 ** 20,
+                     count / export_time * 60, count / import_time * 60))
+    shutil.rmtree(directory)
+    print_table(rows, headers=['rows', 'file (MiB)', 'export (rows/min)',
+                               'import (rows/min)'])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[100000, 1000000])
+    args = parser.parse_args()
+    run(args.sizes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import atexit
+import os
+import statistics
+import tempfile
+import time
+
+from peewee import SqliteDatabase
+from tabulate import tabulate
+
+
+def use_temporary_database():
+    """
+    Points TIMEKEEPER_DATABASE_URI at a throwaway SQLite file.
+
+    It must be called before importing any timekeeper module because
+    the settings are read on import.
+
+    :return: the path of the database file
+    """
+    fd, path = tempfile.mkstemp(prefix='timekeeper-benchmark-',
+                                suffix='.sqlite3')
+    os.close(fd)
+    atexit.register(os.unlink, path)
+    os.environ['TIMEKEEPER_DATABASE_URI'] = 'sqlite:///' + path
+    return path
+
+
+def bind_models(db, models):
+    """
+    Makes models use the given database instead of the configured one.
+    """
+    for model in models:
+        model._meta.database = db
+
+
+def create_sqlite_database(path, **kwargs):
+    if os.path.exists(path):
+        os.unlink(path)
+    db = SqliteDatabase(path, **kwargs)
+    db.connect()
+    return db
+
+
+def measure(func, repeat):
+    """
+    Calls func repeatedly and returns elapsed seconds of each call.
+    """
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started_at)
+    return timings
+
+
+def percentile(values, q):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def median(values):
+    return statistics.median(values)
+
+
+def print_table(rows, headers):
+    print(tabulate(rows, headers=headers, floatfmt='.3f'))
+
+
+class FakeChannel:
+    def __init__(self, message):
+        self.message = message
+
+    def upload_file(self, filename, path, comment):
+        # The file is removed after the handler returns.
+        self.message.uploads.append((filename, os.path.getsize(path), comment))
+
+
+class FakeMessage:
+    """
+    Stands in for slackbot.dispatcher.Message without connecting to Slack.
+
+    Replies, reactions and uploads are recorded on the object.
+    """
+
+    def __init__(self, user_id, text='', channel_id='C00000000'):
+        self.body = {'user': user_id, 'channel': channel_id, 'text': text,
+                     'ts': '{:.6f}'.format(time.time())}
+        self.channel = FakeChannel(self)
+        self._client = None
+        self.replies = []
+        self.reactions = []
+        self.uploads = []
+
+    def reply(self, text):
+        self.replies.append(text)
+
+    def react(self, emojiname):
+        self.reactions.append(emojiname)
+
+
+class QueryCounter:
+    """
+    Counts SQL statements executed on the database while it is active.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.count = 0
+
+    def __enter__(self):
+        execute_sql = self.db.execute_sql
+        # Wrappers such as timekeeper.metrics.instrument_database are set
+        # on the instance, and restored on exit.
+        self._instance_execute_sql = vars(self.db).get('execute_sql')
+
+        def counting_execute_sql(*args, **kwargs):
+            self.count += 1
+            return execute_sql(*args, **kwargs)
+
+        self.db.execute_sql = counting_execute_sql
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._instance_execute_sql is None:
+            del self.db.execute_sql
+        else:
+            self.db.execute_sql = self._instance_execute_sql
@@ -3,6 +3,7 @@ import logging
 import os
 import socket
 
+from slackbot import settings
 from slackbot.bot import Bot
 
 _lock_socket = None
@@ -61,7 +62,13 @@ def remove_lock_file(path):
 
 
 def run_bot():
-    bot = Bot()
+    import timekeeper.plugins
+    timekeeper.plugins.start()
+    if settings.TIMEKEEPER_RUNTIME == 'asyncio':
+        from timekeeper.runtime import AsyncBot
+        bot = AsyncBot()
+    else:
+        bot = Bot()
     bot.run()
 
 
@@ -100,8 +107,44 @@ def run_bot_with_lock_file():
     return should_exit
 
 
+def run_bot_with_lease():
+    """
+    Runs job workers, and the bot while holding the lease of the Slack
+    connection in the database, so that processes on any host can take
+    over when the bot dies.
+    """
+    from timekeeper.cluster import (LeaseKeeper, SLACK_CONNECTION_LEASE,
+                                    start_job_workers, worker_id)
+    from timekeeper.database import setup_db
+    setup_db()
+    start_job_workers(settings.TIMEKEEPER_CLUSTER_JOB_WORKERS)
+    keeper = LeaseKeeper(SLACK_CONNECTION_LEASE, worker_id(),
+                         settings.TIMEKEEPER_CLUSTER_LEASE_TTL,
+                         on_lost=exit_on_lost_lease)
+    logging.info('Waiting for lease %r.', keeper.name)
+    keeper.wait()
+    logging.info('Acquired lease.')
+    run_bot()
+
+
+def exit_on_lost_lease():
+    # Exit soon so that two processes never listen to Slack at the same
+    # time; a supervisor is expected to restart it as a standby. os._exit
+    # skips atexit, so queued clock events and replies are flushed first.
+    import timekeeper.plugins
+    logging.error('Exiting because another process may take over.')
+    try:
+        timekeeper.plugins.stop(
+            timeout=settings.TIMEKEEPER_CLUSTER_LEASE_TTL / 3)
+    finally:
+        os._exit(1)
+
+
 def main():
-    run_bot_with_lock_socket() or run_bot_with_lock_file()
+    if settings.TIMEKEEPER_CLUSTER:
+        run_bot_with_lease()
+    else:
+        run_bot_with_lock_socket() or run_bot_with_lock_file()
 
 
 if __name__ == '__main__':
@@ -13,7 +13,7 @@ setup(
     long_description=open('README.rst').read(),
     version=__version__,
     py_modules=['bot', 'slackbot_settings'],
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     include_package_data=True,
     zip_safe=False,
     install_requires=open('requirements.txt').read(),
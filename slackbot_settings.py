@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 BASE_PATH = os.path.abspath(os.path.dirname(__file__))
 API_TOKEN = os.getenv('SLACK_API_TOKEN')
@@ -6,6 +7,56 @@ DEFAULT_REPLY = "Sorry but I didn't understand you. Please say `@timekeeper help
 ERRORS_TO = os.getenv('TIMEKEEPER_ERRORS_TO')
 TIMEKEEPER_DATABASE_URI = os.getenv('TIMEKEEPER_DATABASE_URI') or 'sqlite:///' + os.path.join(BASE_PATH, 'db.sqlite3')
 TIMEKEEPER_DEFAULT_TIMEZONE = 'Asia/Tokyo'
+TIMEKEEPER_SQLITE_PRAGMAS = [
+    # Let readers and a writer work concurrently and sync only on checkpoints.
+    ('journal_mode', 'wal'),
+    ('synchronous', 'normal'),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('cache_size', -16 * 1024),  # KiB
+    ('busy_timeout', 5000),  # milliseconds
+]
+TIMEKEEPER_USER_CACHE_SIZE = 1024
+TIMEKEEPER_USER_CACHE_TTL = 300  # seconds
+TIMEKEEPER_WRITE_BEHIND = os.getenv('TIMEKEEPER_WRITE_BEHIND') not in (None, '', '0')
+TIMEKEEPER_WRITE_BEHIND_QUEUE_SIZE = 10000
+TIMEKEEPER_FIGURE_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'timekeeper', 'figures')
+TIMEKEEPER_FIGURE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+TIMEKEEPER_RENDER_WORKERS = 2
+TIMEKEEPER_RENDER_QUEUE_SIZE = 8
+TIMEKEEPER_RENDER_TIMEOUT = 60  # seconds
+# Load pandas/matplotlib in background after connecting instead of on demand.
+TIMEKEEPER_WARM_UP_ANALYTICS = False
+# User IDs allowed to run `@timekeeper stats` and `@timekeeper profile`.
+TIMEKEEPER_ADMINS = [user_id for user_id in os.getenv('TIMEKEEPER_ADMINS', '').split(',') if user_id]
+# Serve metrics in the Prometheus text format on this port if set.
+TIMEKEEPER_METRICS_PORT = int(os.getenv('TIMEKEEPER_METRICS_PORT') or 0) or None
+# Retries of a Slack Web API call rate limited by HTTP 429.
+TIMEKEEPER_SLACK_API_MAX_RETRIES = 3
+# Connections to Slack kept alive.
+TIMEKEEPER_SLACK_API_POOL_SIZE = 10
+# Reactions and replies waiting to be sent, beyond which they are dropped.
+TIMEKEEPER_SLACK_OUTBOX_SIZE = 1000
+# 'asyncio' to dispatch messages on timekeeper.runtime instead of slackbot.
+TIMEKEEPER_RUNTIME = os.getenv('TIMEKEEPER_RUNTIME') or 'threads'
+TIMEKEEPER_RUNTIME_WORKERS = 4
+# Threads reserved for clock-ins and clock-outs.
+TIMEKEEPER_RUNTIME_URGENT_WORKERS = 2
+TIMEKEEPER_RUNTIME_QUEUE_SIZE = 100
+# Run several processes against one database; see timekeeper.cluster.
+TIMEKEEPER_CLUSTER = os.getenv('TIMEKEEPER_CLUSTER') not in (None, '', '0')
+TIMEKEEPER_CLUSTER_LEASE_TTL = 30  # seconds
+# Threads which run queued handlers in each bot process.
+TIMEKEEPER_CLUSTER_JOB_WORKERS = 1
+TIMEKEEPER_CLUSTER_JOB_TIMEOUT = 300  # seconds
+TIMEKEEPER_CLUSTER_POLL_INTERVAL = 1  # seconds
+# Attendances older than this are archived by `python -m timekeeper archive`.
+TIMEKEEPER_ARCHIVE_HORIZON_DAYS = 365
+# Hour of the day in TIMEKEEPER_NIGHTLY_TIMEZONE to close attendances left
+# open and prepare reports, or None not to schedule them in the bot.
+TIMEKEEPER_NIGHTLY_HOUR = 4
+TIMEKEEPER_NIGHTLY_TIMEZONE = TIMEKEEPER_DEFAULT_TIMEZONE
+# Attendances unfinished for this long are closed by the nightly tasks.
+TIMEKEEPER_AUTO_CLOSE_HOURS = 16
 PLUGINS = [
     'timekeeper.plugins'
 ]
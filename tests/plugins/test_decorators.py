@@ -1,11 +1,18 @@
 import unittest
 from unittest.mock import MagicMock, patch
 
-from timekeeper.models import User
-from timekeeper.plugins.decorators import with_user
+from slackbot import settings
+
+from timekeeper.models import Job, User
+from timekeeper.plugins.decorators import (name_resolver, offloaded,
+                                           offloaded_handlers, user_cache,
+                                           with_trackable_user, with_user)
 
 
 class TestDecorators(unittest.TestCase):
+    def setUp(self):
+        user_cache.clear()
+
     def test_with_user_when_message_does_not_have_user(self):
         func = with_user(lambda message, user: user)
         message = MagicMock()
@@ -30,14 +37,94 @@ class TestDecorators(unittest.TestCase):
 
     def test_with_user_when_message_has_nonexistent_user(self):
         func = with_user(lambda message, user: user)
-        mock_user_info = MagicMock(successful=True)
-        mock_user_info.__getitem__.side_effect = lambda key: None
         message = MagicMock()
         message.configure_mock(**{
             'body.get': lambda key: 'id' if key == 'user' else None,
-            '_client.webapi.users.info': lambda user_id: mock_user_info,
         })
         mock_user = MagicMock()
         mock_user.name = None
-        with patch.object(User, 'get_or_create', lambda id: (mock_user, True)):
+        with patch.object(User, 'get_or_create',
+                          lambda id: (mock_user, True)), \
+                patch.object(name_resolver, 'request') as request:
+            self.assertEqual(func(message), mock_user)
+        request.assert_called_once_with(message._client.webapi, 'id')
+        message._client.webapi.users.info.assert_not_called()
+
+    def test_with_user_caches_user(self):
+        func = with_user(lambda message, user: user)
+        message = MagicMock()
+        message.configure_mock(**{
+            'body.get': lambda key: 'id' if key == 'user' else None,
+        })
+        mock_user = MagicMock()
+        mock_user.name = 'name'
+        get_or_create = MagicMock(return_value=(mock_user, False))
+        with patch.object(User, 'get_or_create', get_or_create):
+            self.assertEqual(func(message), mock_user)
+            self.assertEqual(func(message), mock_user)
+        get_or_create.assert_called_once_with(id='id')
+        self.assertEqual(user_cache.cache_info().hits, 1)
+        self.assertEqual(user_cache.cache_info().misses, 1)
+
+    def test_with_user_connects_on_cache_hit_only_around_handler(self):
+        func = with_user(lambda message, user: user)
+        message = MagicMock()
+        message.configure_mock(**{
+            'body.get': lambda key: 'id' if key == 'user' else None,
+        })
+        mock_user = MagicMock(trackable=False)
+        mock_user.name = 'name'
+        user_cache.set('id', mock_user)
+        with patch('timekeeper.plugins.decorators.connection') as connection:
             self.assertEqual(func(message), mock_user)
+        connection.assert_called_once_with()
+
+    def test_with_trackable_user_ignores_untracked_user_without_connecting(
+            self):
+        handler = MagicMock()
+        func = with_trackable_user(handler)
+        message = MagicMock()
+        message.configure_mock(**{
+            'body.get': lambda key: 'id' if key == 'user' else None,
+        })
+        mock_user = MagicMock(trackable=False)
+        mock_user.name = 'name'
+        user_cache.set('id', mock_user)
+        with patch('timekeeper.plugins.decorators.connection') as connection:
+            self.assertIsNone(func(message))
+            mock_user.trackable = True
+            func(message)
+        handler.assert_called_once_with(message, mock_user)
+        connection.assert_called_once_with()
+
+    def test_offloaded_runs_handler_without_cluster(self):
+        handler = MagicMock(__name__='handler', return_value='result')
+        func = offloaded(handler)
+        message = MagicMock()
+        with patch.object(settings, 'TIMEKEEPER_CLUSTER', False), \
+                patch.object(Job, 'enqueue') as enqueue:
+            self.assertEqual(func(message, 'arg'), 'result')
+        handler.assert_called_once_with(message, 'arg')
+        enqueue.assert_not_called()
+
+    def test_offloaded_job_loads_user_again(self):
+        handler = MagicMock(__name__='handler', return_value='result')
+        offloaded(handler)
+        user_cache.set('U1', MagicMock())
+        message = MagicMock(body={'channel': 'C1', 'user': 'U1'})
+        self.assertEqual(offloaded_handlers['handler'](message, 'arg'),
+                         'result')
+        handler.assert_called_once_with(message, 'arg')
+        self.assertIsNone(user_cache.get('U1'))
+
+    def test_offloaded_queues_job_in_cluster(self):
+        handler = MagicMock(__name__='handler')
+        func = offloaded(handler)
+        message = MagicMock(body={'channel': 'C1', 'user': 'U1'})
+        with patch.object(settings, 'TIMEKEEPER_CLUSTER', True), \
+                patch.object(Job, 'enqueue') as enqueue:
+            func(message, 'arg')
+        handler.assert_not_called()
+        enqueue.assert_called_once_with(
+            'handler',
+            {'body': {'channel': 'C1', 'user': 'U1'}, 'args': ('arg',)})
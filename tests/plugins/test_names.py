@@ -0,0 +1,89 @@
+import unittest
+from unittest.mock import MagicMock, call, patch
+
+from peewee import SqliteDatabase
+
+from timekeeper.models import User
+from timekeeper.plugins.names import NameResolver
+
+
+def create_response(members, next_cursor=''):
+    return MagicMock(successful=True, body={
+        'members': [{'id': id, 'name': name} for id, name in members],
+        'response_metadata': {'next_cursor': next_cursor},
+    })
+
+
+class TestNameResolver(unittest.TestCase):
+    def setUp(self):
+        self.database = SqliteDatabase(':memory:')
+        self.patcher = patch.object(User._meta, 'database', self.database)
+        self.patcher.start()
+        self.database.connect()
+        self.database.create_tables([User], safe=True)
+        self.on_resolved = MagicMock()
+        self.sleep = MagicMock()
+        self.resolver = NameResolver(on_resolved=self.on_resolved,
+                                     max_retries=2, sleep=self.sleep)
+        # Do not start the background thread.
+        self.resolver._thread = MagicMock()
+        self.webapi = MagicMock()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.database.close()
+
+    def test_resolve_pending_resolves_users_in_batch(self):
+        User.create(id='U1')
+        User.create(id='U2')
+        self.webapi.users.get.return_value = create_response(
+            [('U0', 'zero'), ('U1', 'one'), ('U2', 'two')])
+        self.resolver.request(self.webapi, 'U1')
+        self.resolver.request(self.webapi, 'U2')
+        self.assertEqual(self.resolver.resolve_pending(),
+                         {'U1': 'one', 'U2': 'two'})
+        self.webapi.users.get.assert_called_once_with(
+            'users.list', params={'limit': 200, 'cursor': ''})
+        self.webapi.users.info.assert_not_called()
+        self.assertEqual(User.get(User.id == 'U1').name, 'one')
+        self.assertEqual(User.get(User.id == 'U2').name, 'two')
+        self.on_resolved.assert_has_calls([call('U1'), call('U2')],
+                                          any_order=True)
+
+    def test_resolve_pending_follows_cursor(self):
+        User.create(id='U2')
+        self.webapi.users.get.side_effect = [
+            create_response([('U1', 'one')], next_cursor='next'),
+            create_response([('U2', 'two')]),
+        ]
+        self.resolver.request(self.webapi, 'U2')
+        self.assertEqual(self.resolver.resolve_pending(), {'U2': 'two'})
+        self.webapi.users.get.assert_called_with(
+            'users.list', params={'limit': 200, 'cursor': 'next'})
+
+    def test_resolve_pending_retries_with_backoff(self):
+        User.create(id='U1')
+        self.webapi.users.get.side_effect = [
+            MagicMock(successful=False, error='ratelimited'),
+            Exception('connection reset'),
+            create_response([('U1', 'one')]),
+        ]
+        self.resolver.request(self.webapi, 'U1')
+        self.assertEqual(self.resolver.resolve_pending(), {'U1': 'one'})
+        self.sleep.assert_has_calls([call(1.0), call(2.0)])
+
+    def test_resolve_pending_gives_up_after_retries(self):
+        self.webapi.users.get.side_effect = Exception('connection reset')
+        self.resolver.request(self.webapi, 'U1')
+        self.assertEqual(self.resolver.resolve_pending(), {})
+        self.assertEqual(self.webapi.users.get.call_count, 3)
+        self.on_resolved.assert_not_called()
+
+    def test_request_ignores_recently_requested_user(self):
+        self.webapi.users.get.return_value = create_response([])
+        self.resolver.request(self.webapi, 'U1')
+        self.resolver.resolve_pending()
+        self.resolver.request(self.webapi, 'U1')
+        self.assertEqual(self.resolver.resolve_pending(), {})
+        self.webapi.users.get.assert_called_once_with(
+            'users.list', params={'limit': 200, 'cursor': ''})
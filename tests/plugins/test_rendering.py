@@ -0,0 +1,25 @@
+from concurrent.futures import Future
+import unittest
+from unittest.mock import MagicMock
+
+from timekeeper.plugins.rendering import RenderPool, RenderQueueFullError
+
+
+class TestRenderPool(unittest.TestCase):
+    def test_submit_runs_function_in_worker(self):
+        pool = RenderPool(max_workers=1, max_pending=2)
+        try:
+            future = pool.submit(pow, 2, 10)
+            self.assertEqual(future.result(timeout=30), 1024)
+        finally:
+            pool.shutdown()
+
+    def test_submit_raises_error_when_queue_is_full(self):
+        pool = RenderPool(max_workers=1, max_pending=1)
+        pool._executor = MagicMock()
+        future = Future()
+        pool._executor.submit.return_value = future
+        pool.submit(pow, 2, 10)
+        self.assertRaises(RenderQueueFullError, pool.submit, pow, 2, 10)
+        future.set_result(1024)
+        pool.submit(pow, 2, 10)
@@ -0,0 +1,42 @@
+from concurrent.futures import Future
+from datetime import date
+import unittest
+from unittest.mock import patch
+
+from peewee import SqliteDatabase
+
+from timekeeper.models import Attendance, DailyAttendance, User
+from timekeeper.plugins import reports
+
+
+class TestReports(unittest.TestCase):
+    def setUp(self):
+        self.database = SqliteDatabase(':memory:')
+        self.patchers = [patch.object(model._meta, 'database', self.database)
+                         for model in (User, Attendance, DailyAttendance)]
+        for patcher in self.patchers:
+            patcher.start()
+        self.database.connect()
+        self.database.create_tables([Attendance, DailyAttendance, User])
+        self.user = User.create(id='id', name='name')
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        self.database.close()
+
+    def test_render_contribution_figure_plots_every_year(self):
+        dates = [date(2016, 12, 30), date(2016, 12, 31), date(2017, 1, 1)]
+        for day, seconds in zip(dates, [3600, 7200, 28800]):
+            DailyAttendance.create(user=self.user, date=day, break_count=0,
+                                   working_time_seconds=seconds)
+        future = Future()
+        future.set_result(None)
+        with patch.object(reports.render_pool, 'submit',
+                          return_value=future) as submit:
+            reports.render_contribution_figure(self.user, 'path')
+        func, series, path = submit.call_args[0]
+        self.assertIs(func, reports.save_contribution_figure)
+        # calmap plots the first year, scaled over the whole series.
+        self.assertEqual(series.dates.tolist(), dates)
+        self.assertEqual(path, 'path')
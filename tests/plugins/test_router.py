@@ -0,0 +1,100 @@
+from collections import OrderedDict
+import re
+import unittest
+
+from slackbot.manager import PluginsManager
+
+import timekeeper.plugins as plugins
+from timekeeper.plugins.router import Router, install_router
+
+
+def start():
+    pass
+
+
+def finish():
+    pass
+
+
+def timesheet():
+    pass
+
+
+class TestRouter(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        install_router()
+
+    def setUp(self):
+        self.router = Router(OrderedDict([
+            (re.compile('start(ed)? working', re.IGNORECASE), start),
+            (re.compile('resumed? working', re.IGNORECASE), start),
+            (re.compile('(作業を)?再開します'), start),
+            (re.compile('finish(ed)? working', re.IGNORECASE), finish),
+            (re.compile('working'), finish),
+            (re.compile('start'), finish),
+            (re.compile(r'^timesheet from (\S+) to (\S+)$'), timesheet),
+        ]))
+
+    def test_match(self):
+        self.assertEqual(self.router.match('I started working'),
+                         (start, ('ed',)))
+        self.assertEqual(self.router.match('作業を再開します'),
+                         (start, ('作業を',)))
+        self.assertEqual(
+            self.router.match('timesheet from 2017-01-01 to 2017-01-31'),
+            (timesheet, ('2017-01-01', '2017-01-31')))
+
+    def test_match_ignores_case_of_patterns_which_do_so(self):
+        self.assertEqual(self.router.match('STARTED WORKING'),
+                         (start, ('ED',)))
+        self.assertEqual(self.router.match('FINISH WORKING'),
+                         (finish, (None,)))
+
+    def test_match_nothing(self):
+        self.assertEqual(self.router.match('good morning'), (None, None))
+        self.assertEqual(self.router.match(''), (None, None))
+
+    def test_match_picks_earliest_match(self):
+        self.assertEqual(
+            self.router.match('finished working and started working'),
+            (finish, ('ed',)))
+        self.assertEqual(self.router.match('再開します, finished working'),
+                         (start, (None,)))
+
+    def test_match_picks_first_pattern_on_tie(self):
+        self.assertEqual(self.router.match('started working'),
+                         (start, ('ed',)))
+        self.assertEqual(self.router.match('start'), (finish, ()))
+
+    def test_match_pattern_without_literal(self):
+        router = Router(OrderedDict([
+            (re.compile(r'(\w+) and \1'), start),
+            (re.compile(r'^\d+$'), finish),
+        ]))
+        self.assertEqual(router.match('this and this'), (start, ('this',)))
+        self.assertEqual(router.match('42'), (finish, ()))
+        self.assertEqual(router.match('this and that'), (None, None))
+
+    def test_match_like_slackbot(self):
+        get_plugins = PluginsManager.get_plugins.__wrapped__
+        manager = PluginsManager()
+        texts = ['started working', 'Continue working', 'RESUMED WORKING',
+                 '作業を開始します', '作業を再開します', '中断します',
+                 'finished working', 'stop working', 'report working',
+                 'I will be working late', 'good morning']
+        for category in ('listen_to', 'respond_to'):
+            router = Router(manager.commands[category])
+            for text in texts:
+                self.assertEqual(router.match(text),
+                                 next(get_plugins(manager, category, text)),
+                                 text)
+
+    def test_get_plugins_yields_one_handler(self):
+        manager = PluginsManager()
+        self.assertEqual(
+            list(manager.get_plugins(
+                'listen_to', 'resumed working, I mean started working')),
+            [(plugins.on_start_working, ())])
+        self.assertEqual(list(manager.get_plugins('respond_to', None)),
+                         [(None, None)])
@@ -3,7 +3,8 @@ import os.path
 import unittest
 from unittest.mock import MagicMock, call, patch
 
-from timekeeper.plugins.utils import (create_temp_dir, is_direct_message,
+from timekeeper.plugins.utils import (MAX_MESSAGE_LENGTH, create_temp_dir,
+                                      is_direct_message, iter_chunks,
                                       safe_upload_file, triple_backquoted)
 
 
@@ -24,7 +25,7 @@ class TestUtils(unittest.TestCase):
             lambda key: 'CXXXXXXX' if key == 'channel' else None
         )
         filename = 'filename'
-        path = 'path'
+        path = __file__
         comment = 'comment'
         safe_upload_file(message, filename, path, comment, is_text_file=True)
         message.channel.upload_file.assert_called_once_with(filename, path,
@@ -44,6 +45,31 @@ class TestUtils(unittest.TestCase):
                              is_text_file=True)
         message.reply.assert_called_once_with('```\nfoo\n```')
 
+    def test_safe_upload_file_with_large_text_file_in_private_channel(self):
+        message = MagicMock()
+        message.body.__getitem__.side_effect = (
+            lambda key: 'DXXXXXXX' if key == 'channel' else None
+        )
+        lines = ['{:05d},2017-01-01 09:00,2017-01-01 18:00\n'.format(i)
+                 for i in range(1000)]
+        with create_temp_dir() as temp_dir:
+            path = os.path.join(temp_dir, 'timesheet.csv')
+            with open(path, 'w') as f:
+                f.writelines(lines)
+            safe_upload_file(message, 'timesheet.csv', path, 'comment',
+                             is_text_file=True)
+        replies = [args[0] for args, _ in message.reply.call_args_list]
+        self.assertGreater(len(replies), 1)
+        self.assertTrue(all(len(reply) <= MAX_MESSAGE_LENGTH
+                            for reply in replies))
+        self.assertEqual(''.join(reply[4:-4] for reply in replies),
+                         ''.join(lines))
+
+    def test_iter_chunks(self):
+        self.assertEqual(list(iter_chunks(['ab\n', 'cd\n', 'efghijk\n'], 6)),
+                         ['ab\ncd\n', 'efghij', 'k\n'])
+        self.assertEqual(list(iter_chunks([], 6)), [])
+
     def test_safe_upload_file_with_binary_file_in_private_channel_fails(self):
         message = MagicMock()
         message.body.__getitem__.side_effect = (
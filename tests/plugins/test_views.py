@@ -1,9 +1,14 @@
+from datetime import date, datetime, timedelta
 from textwrap import dedent
 import unittest
-from unittest.mock import ANY, MagicMock, patch, sentinel
+from unittest.mock import MagicMock, patch
 
-from timekeeper.plugins.views import (render_timesheet, render_daily_timesheet,
-                                      render_contribution_figure)
+from peewee import SqliteDatabase
+
+from timekeeper.models import Attendance, DailyAttendance, User
+from timekeeper.plugins.views import (iter_timesheet_csv_lines,
+                                      iter_timesheet_markdown_lines,
+                                      render_daily_timesheet, render_timesheet)
 
 
 class TestViews(unittest.TestCase):
@@ -42,10 +47,93 @@ class TestViews(unittest.TestCase):
         ]))
         self.assertEqual(render_daily_timesheet(daily_attendances), expected_value)
 
-    def test_render_contribution_figure(self):
-        series = sentinel.some_object
-        with patch('matplotlib.pyplot.figure') as figure, patch('calmap.yearplot') as yearplot:
-            render_contribution_figure(series)
-            figure.assert_called_once_with(figsize=(8, 2), dpi=72)
-            figure().add_axes.assert_called_once_with([0, 0, 1, 1])
-            yearplot.assert_called_once_with(series, ax=ANY)
+    def test_iter_timesheet_csv_lines(self):
+        attendances = iter([
+            MagicMock(started_at_display='2017-01-01 00:00:00',
+                      finished_at_display=None,
+                      working_time_display=None),
+            MagicMock(started_at_display='2017-01-02 00:00:00',
+                      finished_at_display='2017-01-02 03:00:00',
+                      working_time_display='03:00:00'),
+        ])
+        lines = iter_timesheet_csv_lines(attendances)
+        self.assertEqual(next(lines), 'start,finish,working time\r\n')
+        self.assertEqual(list(lines), [
+            '2017-01-01 00:00:00,,\r\n',
+            '2017-01-02 00:00:00,2017-01-02 03:00:00,03:00:00\r\n',
+        ])
+
+    def test_iter_timesheet_markdown_lines(self):
+        attendances = iter([
+            MagicMock(started_at_display='2017-01-01 00:00:00',
+                      finished_at_display=None,
+                      working_time_display=None),
+        ])
+        self.assertEqual(list(iter_timesheet_markdown_lines(attendances)), [
+            '| start | finish | working time |\n',
+            '| --- | --- | --- |\n',
+            '| 2017-01-01 00:00:00 |  |  |\n',
+        ])
+
+
+class TestViewsQueries(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.database = SqliteDatabase(':memory:')
+        cls.patchers = []
+        cls.patchers.append(patch.object(User._meta, 'database', cls.database))
+        cls.patchers.append(
+            patch.object(Attendance._meta, 'database', cls.database))
+        cls.patchers.append(
+            patch.object(DailyAttendance._meta, 'database', cls.database))
+        for patcher in cls.patchers:
+            patcher.start()
+        cls.database.connect()
+        cls.database.create_tables(
+            [Attendance, DailyAttendance, User], safe=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        for patcher in cls.patchers:
+            patcher.stop()
+        cls.database.close()
+
+    def setUp(self):
+        self.user = User.create(id='id', name='name', timezone_id='US/Eastern')
+        for days in range(40):
+            started_at = datetime(2017, 1, 1, 14) + timedelta(days=days)
+            Attendance.create(started_at=started_at,
+                              finished_at=started_at + timedelta(hours=8),
+                              user=self.user)
+            DailyAttendance.create(
+                date=date(2017, 1, 1) + timedelta(days=days),
+                started_at=started_at,
+                finished_at=started_at + timedelta(hours=8),
+                break_count=0, working_time_seconds=28800, user=self.user)
+
+    def tearDown(self):
+        for model in (DailyAttendance, Attendance, User):
+            model.delete().execute()
+
+    def count_queries(self, func, *args):
+        with patch.object(self.database, 'execute_sql',
+                          wraps=self.database.execute_sql) as execute_sql:
+            result = func(*args)
+        return result, execute_sql.call_count
+
+    def test_render_timesheet_queries_once(self):
+        for limit in (1, 30):
+            timesheet, query_count = self.count_queries(
+                render_timesheet, Attendance.recent(self.user, limit))
+            self.assertEqual(query_count, 1)
+            self.assertEqual(len(timesheet.splitlines()), limit + 2)
+        self.assertIn('2017-02-09 09:00:00  2017-02-09 17:00:00', timesheet)
+
+    def test_render_daily_timesheet_queries_once(self):
+        for limit in (1, 30):
+            timesheet, query_count = self.count_queries(
+                render_daily_timesheet,
+                DailyAttendance.recent(self.user, limit))
+            self.assertEqual(query_count, 1)
+            self.assertEqual(len(timesheet.splitlines()), limit + 2)
+        self.assertIn('2017-02-09 09:00:00  2017-02-09 17:00:00', timesheet)
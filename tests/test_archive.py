@@ -0,0 +1,131 @@
+from datetime import date, datetime, timedelta
+from io import StringIO
+import json
+import unittest
+from unittest.mock import patch
+
+from peewee import SqliteDatabase
+
+from timekeeper.archive import archive_attendances, archive_user
+from timekeeper.models import Attendance, DailyAttendance, User
+from timekeeper.stats import daily_working_time_seconds
+
+
+class TestArchive(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.database = SqliteDatabase(':memory:')
+        cls.patchers = []
+        cls.patchers.append(patch.object(User._meta, 'database', cls.database))
+        cls.patchers.append(
+            patch.object(Attendance._meta, 'database', cls.database))
+        cls.patchers.append(
+            patch.object(DailyAttendance._meta, 'database', cls.database))
+        for patcher in cls.patchers:
+            patcher.start()
+        cls.database.connect()
+        cls.database.create_tables(
+            [Attendance, DailyAttendance, User], safe=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        for patcher in cls.patchers:
+            patcher.stop()
+        cls.database.close()
+
+    def setUp(self):
+        self.user = User.create(id='id', name='name', timezone_id='Asia/Tokyo')
+        # Two attendances a day from 2017-01-01 to 2017-01-10 in JST.
+        for days in range(10):
+            started_at = datetime(2016, 12, 31, 23) + timedelta(days=days)
+            Attendance.create(started_at=started_at,
+                              finished_at=started_at + timedelta(hours=3),
+                              user=self.user)
+            Attendance.create(started_at=started_at + timedelta(hours=4),
+                              finished_at=started_at + timedelta(hours=8),
+                              user=self.user)
+        DailyAttendance.rebuild()
+
+    def tearDown(self):
+        # Archiving runs its own transactions, so clean up explicitly.
+        for model in (DailyAttendance, Attendance, User):
+            model.delete().execute()
+
+    def summaries(self):
+        return list(DailyAttendance
+                    .select(DailyAttendance.date, DailyAttendance.started_at,
+                            DailyAttendance.finished_at,
+                            DailyAttendance.break_count,
+                            DailyAttendance.working_time_seconds)
+                    .order_by(DailyAttendance.date)
+                    .tuples())
+
+    def test_archive_user_keeps_summaries(self):
+        expected = self.summaries()
+        fingerprint = DailyAttendance.fingerprint(self.user)
+        series = daily_working_time_seconds(self.user)
+        self.assertEqual(archive_user(self.user, date(2017, 1, 6)), 10)
+        self.assertEqual(self.summaries(), expected)
+        self.assertEqual(DailyAttendance.fingerprint(self.user), fingerprint)
+        archived_series = daily_working_time_seconds(self.user)
+        for archived_column, column in zip(archived_series, series):
+            self.assertEqual(archived_column.tolist(), column.tolist())
+        self.assertEqual(Attendance.select().count(), 10)
+        self.assertEqual(Attendance.select()
+                         .order_by(Attendance.started_at).first().started_at,
+                         datetime(2017, 1, 5, 23))
+        archived_days = (DailyAttendance
+                         .select(DailyAttendance.date)
+                         .where(DailyAttendance.archived == True)  # noqa: E712
+                         .order_by(DailyAttendance.date)
+                         .tuples())
+        archived_dates = [d for d, in archived_days]
+        self.assertEqual(archived_dates,
+                         [date(2017, 1, day) for day in range(1, 6)])
+
+    def test_rebuild_keeps_archived_summaries(self):
+        expected = self.summaries()
+        archive_user(self.user, date(2017, 1, 6))
+        DailyAttendance.rebuild()
+        self.assertEqual(self.summaries(), expected)
+        DailyAttendance.rebuild(self.user)
+        self.assertEqual(self.summaries(), expected)
+
+    def test_archive_user_writes_archived_attendances(self):
+        f = StringIO()
+        archive_user(self.user, date(2017, 1, 3), f)
+        lines = f.getvalue().splitlines()
+        self.assertEqual(json.loads(lines[0])['table'], 'attendance')
+        self.assertEqual(len(lines), 5)
+
+    def test_archive_user_keeps_days_since_open_attendance(self):
+        attendance, _ = self.user.start_working(datetime(2017, 1, 2, 23))
+        self.assertEqual(archive_user(self.user, date(2017, 1, 6)), 4)
+        self.assertEqual(self.user.open_attendance(), attendance)
+        self.assertEqual(self.user.finish_working(datetime(2017, 1, 3, 1))[0],
+                         attendance)
+        day = DailyAttendance.get(DailyAttendance.date == date(2017, 1, 3))
+        self.assertFalse(day.archived)
+        self.assertEqual(day.break_count, 2)
+
+    def test_archive_user_merges_into_archived_summaries(self):
+        expected = self.summaries()
+        archive_user(self.user, date(2017, 1, 6))
+        # e.g. imported again from an archive file
+        started_at = datetime(2017, 1, 1, 10)
+        Attendance.create(started_at=started_at,
+                          finished_at=started_at + timedelta(hours=1),
+                          user=self.user)
+        DailyAttendance.rebuild()
+        self.assertEqual(self.summaries(), expected)
+        self.assertEqual(archive_user(self.user, date(2017, 1, 6)), 1)
+        day = DailyAttendance.get(DailyAttendance.date == date(2017, 1, 1))
+        self.assertEqual(day.break_count, 2)
+        self.assertEqual(day.working_time_seconds, 8 * 60 * 60)
+        self.assertEqual(day.finished_at, datetime(2017, 1, 1, 11))
+
+    def test_archive_attendances_keeps_the_horizon(self):
+        with patch('timekeeper.archive.datetime') as datetime_mock:
+            datetime_mock.utcnow.return_value = datetime(2017, 1, 12)
+            self.assertEqual(archive_attendances(horizon_days=4), 14)
+        self.assertEqual(Attendance.select().count(), 6)
@@ -0,0 +1,22 @@
+import unittest
+from unittest.mock import MagicMock, call, patch
+
+from slackbot import settings
+
+import bot
+import timekeeper.plugins as plugins
+
+
+class TestBot(unittest.TestCase):
+    def test_exit_on_lost_lease_flushes_queues(self):
+        manager = MagicMock()
+        with patch.object(plugins, 'attendance_writer', manager.writer), \
+                patch.object(plugins, 'outbox', manager.outbox), \
+                patch.object(plugins, 'reply_outbox', manager.reply_outbox), \
+                patch('os._exit', manager.exit):
+            bot.exit_on_lost_lease()
+        timeout = settings.TIMEKEEPER_CLUSTER_LEASE_TTL / 3
+        self.assertEqual(manager.mock_calls, [call.writer.stop(timeout),
+                                              call.outbox.flush(timeout),
+                                              call.reply_outbox.flush(timeout),
+                                              call.exit(1)])
@@ -0,0 +1,109 @@
+import os.path
+import unittest
+
+from timekeeper.cache import CacheInfo, FileCache, TTLCache
+from timekeeper.plugins.utils import create_temp_dir
+
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache(unittest.TestCase):
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.cache = TTLCache(maxsize=2, ttl=10, timer=self.timer)
+
+    def test_get_returns_default_on_miss(self):
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(self.cache.get('key', 'default'), 'default')
+        self.assertEqual(self.cache.cache_info(), CacheInfo(0, 2, 2, 0, 0))
+
+    def test_get_returns_value_on_hit(self):
+        self.cache.set('key', 'value')
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.assertEqual(self.cache.cache_info(), CacheInfo(1, 0, 2, 1, 0))
+
+    def test_get_expires_entry_after_ttl(self):
+        self.cache.set('key', 'value')
+        self.timer.now = 9
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.timer.now = 10
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_set_evicts_least_recently_used_entry(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('c'), 3)
+        self.assertEqual(self.cache.cache_info().evictions, 1)
+
+    def test_invalidate_removes_entry(self):
+        self.cache.set('key', 'value')
+        self.cache.invalidate('key')
+        self.cache.invalidate('nonexistent key')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_clear_resets_counters(self):
+        self.cache.set('key', 'value')
+        self.cache.get('key')
+        self.cache.clear()
+        self.assertEqual(self.cache.cache_info(), CacheInfo(0, 0, 2, 0, 0))
+
+
+class TestFileCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir_context = create_temp_dir()
+        self.temp_dir = self.temp_dir_context.__enter__()
+        self.cache = FileCache(os.path.join(self.temp_dir, 'cache'),
+                               max_bytes=10)
+
+    def tearDown(self):
+        self.temp_dir_context.__exit__(None, None, None)
+
+    def create_file(self, content):
+        path = os.path.join(self.temp_dir, 'source')
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def read_file(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_get_returns_none_on_miss(self):
+        self.assertIsNone(self.cache.get('name', (1,)))
+        self.assertEqual(self.cache.cache_info(), CacheInfo(0, 1, 10, 0, 0))
+
+    def test_get_returns_cached_file(self):
+        path = self.cache.put('name', (1,), self.create_file('abc'))
+        self.assertEqual(self.cache.get('name', (1,)), path)
+        self.assertEqual(self.read_file(path), 'abc')
+        self.assertEqual(self.cache.cache_info(), CacheInfo(1, 0, 10, 3, 0))
+
+    def test_put_replaces_older_versions(self):
+        self.cache.put('name', (1,), self.create_file('abc'))
+        self.cache.put('name2', (1,), self.create_file('def'))
+        self.cache.put('name', (2,), self.create_file('ghi'))
+        self.assertIsNone(self.cache.get('name', (1,)))
+        self.assertEqual(self.read_file(self.cache.get('name', (2,))), 'ghi')
+        self.assertIsNotNone(self.cache.get('name2', (1,)))
+
+    def test_put_evicts_least_recently_used_files(self):
+        path_a = self.cache.put('a', (), self.create_file('aaaa'))
+        path_b = self.cache.put('b', (), self.create_file('bbbb'))
+        os.utime(path_a, (0, 0))
+        os.utime(path_b, (1, 1))
+        self.cache.put('c', (), self.create_file('cccc'))
+        self.assertIsNone(self.cache.get('a', ()))
+        self.assertIsNotNone(self.cache.get('b', ()))
+        self.assertIsNotNone(self.cache.get('c', ()))
+        self.assertEqual(self.cache.cache_info().evictions, 1)
@@ -0,0 +1,33 @@
+import os.path
+import unittest
+from unittest.mock import ANY, patch, sentinel
+
+from matplotlib.figure import Figure
+import numpy as np
+
+from timekeeper.charts import (render_contribution_figure,
+                               save_contribution_figure)
+from timekeeper.plugins.utils import create_temp_dir
+from timekeeper.stats import WorkingTimeSeries
+
+
+class TestCharts(unittest.TestCase):
+    def test_render_contribution_figure(self):
+        series = sentinel.some_object
+        with patch('calmap.yearplot') as yearplot, \
+                patch('matplotlib.pyplot.figure') as pyplot_figure:
+            figure = render_contribution_figure(series)
+        self.assertIsInstance(figure, Figure)
+        self.assertEqual(tuple(figure.get_size_inches()), (8, 2))
+        self.assertEqual(figure.dpi, 72)
+        yearplot.assert_called_once_with(series, ax=ANY)
+        pyplot_figure.assert_not_called()
+
+    def test_save_contribution_figure(self):
+        dates = np.arange('2017-01-01', '2017-01-31', dtype='datetime64[D]')
+        series = WorkingTimeSeries(dates, np.arange(30, dtype=float))
+        with create_temp_dir() as temp_dir:
+            path = os.path.join(temp_dir, 'contributions.png')
+            self.assertEqual(save_contribution_figure(series, path), path)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(8), b'\x89PNG\r\n\x1a\n')
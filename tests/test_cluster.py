@@ -0,0 +1,336 @@
+from datetime import datetime, timedelta
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+from textwrap import dedent
+from threading import Event
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from peewee import SqliteDatabase
+
+from timekeeper.cluster import JobWorker, LeaseKeeper, WebAPIMessage
+from timekeeper.models import Job, Lease
+
+MODELS = [Lease, Job]
+
+
+class TestLease(unittest.TestCase):
+    def setUp(self):
+        self.database = SqliteDatabase(':memory:')
+        self.patchers = [patch.object(model._meta, 'database', self.database)
+                         for model in MODELS]
+        for patcher in self.patchers:
+            patcher.start()
+        self.database.connect()
+        self.database.create_tables(MODELS)
+        self.now = datetime(2017, 1, 1)
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        self.database.close()
+
+    def test_acquire_free_lease(self):
+        self.assertEqual(Lease.acquire('bot', 'a', 30, now=self.now),
+                         self.now + timedelta(seconds=30))
+        self.assertEqual(Lease.get(Lease.name == 'bot').holder, 'a')
+
+    def test_acquire_renews_own_lease(self):
+        Lease.acquire('bot', 'a', 30, now=self.now)
+        now = self.now + timedelta(seconds=10)
+        self.assertEqual(Lease.acquire('bot', 'a', 30, now=now),
+                         now + timedelta(seconds=30))
+
+    def test_acquire_fails_while_another_holds_lease(self):
+        Lease.acquire('bot', 'a', 30, now=self.now)
+        self.assertIsNone(Lease.acquire('bot', 'b', 30,
+                                        now=self.now + timedelta(seconds=29)))
+        self.assertEqual(Lease.get(Lease.name == 'bot').holder, 'a')
+
+    def test_acquire_takes_over_expired_lease(self):
+        Lease.acquire('bot', 'a', 30, now=self.now)
+        self.assertIsNotNone(Lease.acquire(
+            'bot', 'b', 30, now=self.now + timedelta(seconds=31)))
+        self.assertIsNone(Lease.acquire('bot', 'a', 30,
+                                        now=self.now + timedelta(seconds=32)))
+
+    def test_release_frees_only_own_lease(self):
+        Lease.acquire('bot', 'a', 30, now=self.now)
+        Lease.release('bot', 'b')
+        self.assertIsNone(Lease.acquire('bot', 'b', 30, now=self.now))
+        Lease.release('bot', 'a')
+        self.assertIsNotNone(Lease.acquire('bot', 'b', 30, now=self.now))
+
+
+class TestLeaseKeeper(unittest.TestCase):
+    def setUp(self):
+        # The keeper renews the lease on another thread, which does not share
+        # an in-memory database.
+        self.temp_dir = tempfile.mkdtemp()
+        self.database = SqliteDatabase(
+            os.path.join(self.temp_dir, 'db.sqlite3'))
+        self.patchers = [patch.object(model._meta, 'database', self.database)
+                         for model in MODELS]
+        for patcher in self.patchers:
+            patcher.start()
+        self.database.create_tables(MODELS)
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        self.database.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_lease_keeper_renews_lease(self):
+        keeper = LeaseKeeper('bot', 'a', 0.3)
+        keeper.wait()
+        time.sleep(0.5)
+        self.assertIsNone(Lease.acquire('bot', 'b', 0.3))
+        keeper.release()
+        self.assertIsNotNone(Lease.acquire('bot', 'b', 0.3))
+
+    def test_lease_keeper_reports_lost_lease(self):
+        lost = Event()
+        keeper = LeaseKeeper('bot', 'a', 0.3, on_lost=lost.set)
+        keeper.wait()
+        (Lease.update(holder='b',
+                      expires_at=datetime.utcnow() + timedelta(hours=1))
+            .execute())
+        self.assertTrue(lost.wait(2))
+        keeper.release()
+        self.assertEqual(Lease.get(Lease.name == 'bot').holder, 'b')
+
+
+class TestJob(unittest.TestCase):
+    def setUp(self):
+        self.database = SqliteDatabase(':memory:')
+        self.patchers = [patch.object(model._meta, 'database', self.database)
+                         for model in MODELS]
+        for patcher in self.patchers:
+            patcher.start()
+        self.database.connect()
+        self.database.create_tables(MODELS)
+        self.now = datetime(2017, 1, 1)
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        self.database.close()
+
+    def test_claim_takes_oldest_pending_job(self):
+        first = Job.enqueue('kind', {'n': 1})
+        second = Job.enqueue('kind', {'n': 2})
+        job = Job.claim('a', 60, now=self.now)
+        self.assertEqual(job.id, first.id)
+        self.assertEqual(job.data, {'n': 1})
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(Job.claim('b', 60, now=self.now).id, second.id)
+        self.assertIsNone(Job.claim('c', 60, now=self.now))
+
+    def test_claim_takes_expired_job_again(self):
+        Job.enqueue('kind', {})
+        job = Job.claim('a', 60, now=self.now)
+        self.assertIsNone(
+            Job.claim('b', 60, now=self.now + timedelta(seconds=59)))
+        reclaimed = Job.claim('b', 60, now=self.now + timedelta(seconds=61))
+        self.assertEqual(reclaimed.id, job.id)
+        self.assertEqual(reclaimed.worker, 'b')
+        self.assertEqual(reclaimed.attempts, 2)
+
+    def test_claim_gives_up_after_max_attempts(self):
+        Job.enqueue('kind', {})
+        now = self.now
+        for _ in range(2):
+            self.assertIsNotNone(Job.claim('a', 60, max_attempts=2, now=now))
+            now += timedelta(seconds=61)
+        self.assertIsNone(Job.claim('a', 60, max_attempts=2, now=now))
+        self.assertEqual(Job.get().status, Job.FAILED)
+
+    def test_job_worker_runs_handler(self):
+        handler = MagicMock()
+        client = MagicMock()
+        Job.enqueue('show_timesheet', {'body': {'channel': 'C1', 'user': 'U1',
+                                                'text': 'timesheet'},
+                                       'args': [None, 'my ']})
+        worker = JobWorker(client, {'show_timesheet': handler}, 'worker')
+        self.assertTrue(worker.run_once())
+        message, *args = handler.call_args[0]
+        self.assertIsInstance(message, WebAPIMessage)
+        self.assertEqual(message.body['user'], 'U1')
+        self.assertEqual(args, [None, 'my '])
+        self.assertFalse(Job.select().exists())
+        self.assertFalse(worker.run_once())
+
+    def test_job_worker_replies_through_web_api(self):
+        def handler(message):
+            message.reply('Here.')
+            message.channel.upload_file('a.png', '/path/to/a.png', 'comment')
+
+        client = MagicMock()
+        Job.enqueue('kind', {'body': {'channel': 'C1', 'user': 'U1'},
+                             'args': []})
+        JobWorker(client, {'kind': handler}, 'worker').run_once()
+        client.webapi.chat.post_message.assert_called_once_with(
+            'C1', '<@U1>: Here.', as_user=True, thread_ts=None)
+        client.upload_file.assert_called_once_with(
+            'C1', 'a.png', '/path/to/a.png', 'comment')
+
+    def test_job_worker_fails_job(self):
+        client = MagicMock()
+        Job.enqueue('kind',
+                    {'body': {'channel': 'D1', 'text': 'contributions'},
+                     'args': []})
+        handler = MagicMock(side_effect=RuntimeError('oops'))
+        JobWorker(client, {'kind': handler}, 'worker').run_once()
+        job = Job.get()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('oops', job.error)
+        client.webapi.chat.post_message.assert_called_once_with(
+            'D1', 'I had a problem handling "contributions"', as_user=True,
+            thread_ts=None)
+
+
+def _bind(path):
+    # Spawned processes may start slowly on a busy machine, so wait long
+    # for locks rather than fail.
+    database = SqliteDatabase(path, pragmas=[('journal_mode', 'wal'),
+                                             ('busy_timeout', 60000)])
+    for model in MODELS:
+        model._meta.database = database
+    return database
+
+
+def _acquire_lease(path, holder, barrier, results):
+    _bind(path)
+    barrier.wait(120)
+    results.put((holder, Lease.acquire('bot', holder, 60) is not None))
+
+
+def _claim_jobs(path, worker, barrier, results):
+    _bind(path)
+    barrier.wait(120)
+    while True:
+        job = Job.claim(worker, 60)
+        if job is None:
+            break
+        results.put(job.id)
+        job.complete()
+    results.put(None)
+
+
+class TestProcesses(unittest.TestCase):
+    """
+    Runs several processes against one SQLite database.
+    """
+
+    process_count = 4
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'db.sqlite3')
+        self.context = multiprocessing.get_context('spawn')
+        self.barrier = self.context.Barrier(self.process_count)
+        self.results = self.context.Queue()
+        database = SqliteDatabase(self.path)
+        with patch.object(Lease._meta, 'database', database), \
+                patch.object(Job._meta, 'database', database):
+            database.create_tables(MODELS)
+            self.job_ids = [Job.enqueue('kind', {}).id for _ in range(40)]
+        database.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def run_processes(self, target):
+        processes = [self.context.Process(
+                         target=target,
+                         args=(self.path, 'worker-{}'.format(i),
+                               self.barrier, self.results))
+                     for i in range(self.process_count)]
+        for process in processes:
+            process.start()
+        return processes
+
+    def join(self, processes):
+        """
+        Waits for the processes to exit successfully.
+
+        Results are read afterwards, which never blocks since every process
+        has put all its results by then; they are few enough to fit in the
+        pipe of the queue, so that processes do not wait for them to be read.
+        """
+        for process in processes:
+            process.join(120)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            self.assertEqual(process.exitcode, 0)
+
+    def test_only_one_process_acquires_lease(self):
+        processes = self.run_processes(_acquire_lease)
+        self.join(processes)
+        results = [self.results.get(timeout=10) for _ in processes]
+        self.assertEqual(sum(acquired for _, acquired in results), 1)
+
+    def test_each_job_is_claimed_once(self):
+        processes = self.run_processes(_claim_jobs)
+        self.join(processes)
+        claimed_ids = []
+        finished_count = 0
+        while finished_count < len(processes):
+            job_id = self.results.get(timeout=10)
+            if job_id is None:
+                finished_count += 1
+            else:
+                claimed_ids.append(job_id)
+        self.assertEqual(sorted(claimed_ids), self.job_ids)
+
+
+class TestNextToBot(unittest.TestCase):
+    """
+    Runs job workers and maintenance commands while the bot holds the
+    metrics port.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.socket = socket.socket()
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.listen(1)
+        path = os.path.join(self.temp_dir, 'db.sqlite3')
+        self.env = dict(os.environ,
+                        TIMEKEEPER_DATABASE_URI='sqlite:///' + path,
+                        TIMEKEEPER_METRICS_PORT=str(
+                            self.socket.getsockname()[1]))
+
+    def tearDown(self):
+        self.socket.close()
+        shutil.rmtree(self.temp_dir)
+
+    def run_python(self, *args):
+        process = subprocess.run([sys.executable] + list(args), env=self.env,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE,
+                                 universal_newlines=True, timeout=60)
+        self.assertEqual(process.returncode, 0, process.stderr)
+        return process.stdout
+
+    def test_job_workers_start_only_workers(self):
+        output = self.run_python('-c', dedent("""\
+            import threading
+            from timekeeper.cluster import start_job_workers
+            start_job_workers(2)
+            print(sorted(thread.name.rsplit(':', 1)[-1]
+                         for thread in threading.enumerate()))
+            """))
+        self.assertEqual(output.strip(),
+                         repr(['MainThread', 'job-worker-0', 'job-worker-1']))
+
+    def test_nightly_tasks(self):
+        self.run_python('-m', 'timekeeper', 'nightly')
@@ -0,0 +1,112 @@
+import os.path
+import unittest
+from unittest.mock import patch
+
+from peewee import SqliteDatabase
+from playhouse.pool import PooledSqliteDatabase
+
+from timekeeper.database import (connection, create_db, migrate_columns,
+                                 migrate_indexes, pool_stats)
+from timekeeper.plugins.utils import create_temp_dir
+from timekeeper.models import Attendance, User
+
+
+class TestDatabase(unittest.TestCase):
+    def setUp(self):
+        self.database = SqliteDatabase(':memory:')
+        self.patchers = []
+        self.patchers.append(
+            patch.object(User._meta, 'database', self.database))
+        self.patchers.append(
+            patch.object(Attendance._meta, 'database', self.database))
+        for patcher in self.patchers:
+            patcher.start()
+        self.database.connect()
+        self.database.create_tables([Attendance, User], safe=True)
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        self.database.close()
+
+    def get_index_columns(self):
+        return {tuple(index.columns)
+                for index in self.database.get_indexes('attendance')}
+
+    def test_migrate_indexes_creates_missing_indexes(self):
+        for index in self.database.get_indexes('attendance'):
+            if len(index.columns) > 1:
+                self.database.execute_sql('drop index "{}"'.format(index.name))
+        self.assertNotIn(('user_id', 'started_at'), self.get_index_columns())
+        migrate_indexes([Attendance])
+        self.assertIn(('user_id', 'started_at'), self.get_index_columns())
+        self.assertIn(('user_id', 'finished_at'), self.get_index_columns())
+
+    def test_migrate_indexes_is_idempotent(self):
+        indexes = self.database.get_indexes('attendance')
+        migrate_indexes([Attendance])
+        self.assertEqual(self.database.get_indexes('attendance'), indexes)
+
+    def test_migrate_columns_adds_missing_columns(self):
+        self.database.execute_sql('drop table user')
+        self.database.execute_sql(
+            'create table user (id varchar(255) primary key, '
+            'created_at datetime not null, '
+            'timezone_id varchar(255) not null, trackable integer not null)')
+        added_columns = migrate_columns(User,
+                                        [User.name, User.open_attendance_id])
+        self.assertEqual(added_columns, ['name', 'open_attendance_id'])
+        columns = {column.name for column in self.database.get_columns('user')}
+        self.assertIn('name', columns)
+        self.assertIn('open_attendance_id', columns)
+        self.assertEqual(
+            migrate_columns(User, [User.name, User.open_attendance_id]), [])
+
+
+class TestConnection(unittest.TestCase):
+    def test_connection_opens_and_closes_connection(self):
+        database = SqliteDatabase(':memory:')
+        with connection(database) as db:
+            self.assertIs(db, database)
+            self.assertFalse(database.is_closed())
+        self.assertTrue(database.is_closed())
+
+    def test_connection_keeps_connection_opened_outside(self):
+        database = SqliteDatabase(':memory:')
+        database.connect()
+        with connection(database):
+            with connection(database):
+                pass
+            self.assertFalse(database.is_closed())
+        self.assertFalse(database.is_closed())
+        database.close()
+
+    def test_connection_returns_connection_to_pool(self):
+        with create_temp_dir() as temp_dir:
+            path = os.path.join(temp_dir, 'db.sqlite3')
+            database = PooledSqliteDatabase(path, max_connections=4)
+            with connection(database):
+                self.assertEqual(pool_stats(database),
+                                 {'max_connections': 4, 'in_use': 1,
+                                  'available': 0})
+            self.assertEqual(pool_stats(database),
+                             {'max_connections': 4, 'in_use': 0,
+                              'available': 1})
+            database.close_all()
+
+    def test_pool_stats_returns_none_without_pool(self):
+        self.assertIsNone(pool_stats(SqliteDatabase(':memory:')))
+
+
+class TestCreateDb(unittest.TestCase):
+    def test_create_db_applies_sqlite_pragmas(self):
+        pragmas = [('journal_mode', 'wal'), ('synchronous', 'normal')]
+        with create_temp_dir() as temp_dir, \
+                patch('timekeeper.database.settings.TIMEKEEPER_SQLITE_PRAGMAS',
+                      pragmas):
+            for scheme in ('sqlite', 'sqlite+pool'):
+                uri = '{}:///{}'.format(scheme, os.path.join(temp_dir, scheme))
+                database = create_db(uri)
+                with connection(database):
+                    self.assertEqual(database.pragma('journal_mode'), ('wal',))
+                    self.assertEqual(database.pragma('synchronous'), (1,))
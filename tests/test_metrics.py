@@ -0,0 +1,191 @@
+from threading import Event, Thread
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from peewee import SqliteDatabase
+from playhouse.pool import PooledSqliteDatabase
+import slacker
+
+from timekeeper.cache import TTLCache
+from timekeeper.database import connection
+from timekeeper.metrics import (Histogram, Registry, SamplingProfiler,
+                                instrument_cache, instrument_database,
+                                instrument_slack_api, instrumented, registry)
+from timekeeper.models import User
+
+
+class TestHistogram(unittest.TestCase):
+    def test_observe_and_quantile(self):
+        histogram = Histogram((1, 2, 4))
+        self.assertIsNone(histogram.quantile(0.5))
+        for value in (0.5, 1, 1.5, 3, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.bucket_counts, [2, 1, 1, 1])
+        self.assertEqual(histogram.count, 5)
+        self.assertEqual(histogram.sum, 16)
+        self.assertEqual(histogram.quantile(0.4), 1)
+        self.assertEqual(histogram.quantile(0.8), 4)
+        self.assertEqual(histogram.quantile(1), 10)
+
+
+class TestRegistry(unittest.TestCase):
+    def test_render(self):
+        registry = Registry()
+        registry.describe('requests_total', 'counter', 'Requests.')
+        registry.describe('seconds', 'histogram', 'Seconds.', (0.1, 1))
+        registry.increment('requests_total', handler='a"b')
+        registry.increment('requests_total', 2, handler='a"b')
+        registry.observe('seconds', 0.5, handler='x')
+        registry.observe('seconds', 5, handler='x')
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP requests_total Requests.',
+            '# TYPE requests_total counter',
+            'requests_total{handler="a\\"b"} 3',
+            '# HELP seconds Seconds.',
+            '# TYPE seconds histogram',
+            'seconds_bucket{handler="x",le="0.1"} 0',
+            'seconds_bucket{handler="x",le="1"} 1',
+            'seconds_bucket{handler="x",le="+Inf"} 2',
+            'seconds_sum{handler="x"} 5.5',
+            'seconds_count{handler="x"} 2',
+        ]) + '\n')
+
+    def test_samples_are_copied(self):
+        registry = Registry()
+        registry.describe('seconds', 'histogram', 'Seconds.', (1,))
+        with registry.timer('seconds'):
+            pass
+        samples = registry.samples('seconds')
+        registry.observe('seconds', 0)
+        self.assertEqual(samples[()].count, 1)
+        registry.clear()
+        self.assertEqual(registry.samples('seconds'), {})
+
+    def test_collectors_set_values_before_reading(self):
+        registry = Registry()
+        registry.describe('connections', 'gauge', 'Connections.')
+        values = iter([2, 1])
+        registry.add_collector(
+            lambda: registry.set('connections', next(values), state='idle'))
+        self.assertEqual(registry.samples('connections'),
+                         {(('state', 'idle'),): 2})
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP connections Connections.',
+            '# TYPE connections gauge',
+            'connections{state="idle"} 1',
+        ]) + '\n')
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        registry.clear()
+
+    def tearDown(self):
+        registry.clear()
+
+    def test_instrumented_records_queries_of_handler(self):
+        database = SqliteDatabase(':memory:')
+        instrument_database(database)
+        instrument_database(database)
+        with patch.object(User._meta, 'database', database):
+            database.create_tables([User])
+            registry.clear()
+
+            @instrumented
+            def handler(message):
+                User.create(id='id', name='name')
+                return User.select().count()
+
+            self.assertEqual(handler(None), 1)
+        key = (('handler', 'handler'),)
+        self.assertEqual(
+            registry.samples('timekeeper_handler_queries')[key].sum, 2)
+        self.assertEqual(
+            registry.samples('timekeeper_handler_seconds')[key].count, 1)
+        self.assertEqual(registry.samples('timekeeper_handler_requests_total'),
+                         {(('handler', 'handler'), ('status', 'ok')): 1})
+        self.assertEqual(
+            registry.samples('timekeeper_sql_seconds')[()].count, 2)
+
+    def test_instrument_database_exposes_pool_connections(self):
+        database = PooledSqliteDatabase(':memory:', max_connections=4)
+        with patch.object(registry, '_collectors', []):
+            instrument_database(database)
+            with connection(database):
+                in_use = registry.samples('timekeeper_db_connections')
+            available = registry.samples('timekeeper_db_connections')
+        database.close_all()
+        self.assertEqual(in_use, {(('state', 'in_use'),): 1,
+                                  (('state', 'available'),): 0})
+        self.assertEqual(available, {(('state', 'in_use'),): 0,
+                                     (('state', 'available'),): 1})
+
+    def test_instrumented_records_errors(self):
+        @instrumented
+        def handler(message):
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            handler(None)
+        self.assertEqual(registry.samples('timekeeper_handler_requests_total'),
+                         {(('handler', 'handler'), ('status', 'error')): 1})
+
+    def test_instrument_slack_api(self):
+        with patch.object(slacker.BaseAPI, '_request',
+                          slacker.BaseAPI._request):
+            instrument_slack_api()
+            instrument_slack_api()
+            response = MagicMock(status_code=200, text='{"ok": true}')
+            api = slacker.BaseAPI()
+            api._request(lambda url, **kwargs: response, 'users.list')
+        key = (('method', 'users.list'),)
+        self.assertEqual(
+            registry.samples('timekeeper_slack_api_seconds')[key].count, 1)
+        self.assertEqual(
+            registry.samples('timekeeper_slack_api_requests_total'),
+            {(('method', 'users.list'), ('status', 'ok')): 1})
+
+    def test_instrument_cache(self):
+        cache = TTLCache(maxsize=1, ttl=10)
+        with patch.object(registry, '_collectors', []):
+            instrument_cache(cache, 'test')
+            cache.set('a', 1)
+            cache.get('a')
+            cache.get('b')
+            cache.set('b', 2)
+            rendered = registry.render()
+        key = (('cache', 'test'),)
+        self.assertIn('timekeeper_cache_hits_total{cache="test"} 1',
+                      rendered)
+        self.assertIn('timekeeper_cache_misses_total{cache="test"} 1',
+                      rendered)
+        self.assertEqual(
+            registry.samples('timekeeper_cache_evictions_total')[key], 1)
+
+
+def busy_function(stopped):
+    while not stopped.is_set():
+        sum(range(1000))
+
+
+class TestSamplingProfiler(unittest.TestCase):
+    def test_start_and_stop(self):
+        profiler = SamplingProfiler(interval=0.001)
+        self.assertIsNone(profiler.stop())
+        stopped = Event()
+        thread = Thread(target=busy_function, args=(stopped,))
+        thread.start()
+        try:
+            self.assertTrue(profiler.start())
+            self.assertFalse(profiler.start())
+            self.assertTrue(profiler.is_running)
+            time.sleep(0.05)
+            stacks = profiler.stop()
+        finally:
+            stopped.set()
+            thread.join()
+        self.assertFalse(profiler.is_running)
+        self.assertIn('test_metrics.py:busy_function', stacks)
+        stack, count = stacks.splitlines()[0].rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
@@ -1,9 +1,9 @@
-from datetime import datetime, timedelta, tzinfo
+from datetime import date, datetime, timedelta, tzinfo
 import unittest
 from unittest.mock import patch
 
 from peewee import SqliteDatabase
-from pytz import timezone
+from pytz import timezone, utc
 
 from timekeeper.models import Attendance, DailyAttendance, User
 
@@ -12,14 +12,17 @@ class TestUser(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         cls.database = SqliteDatabase(':memory:')
-        cls.database.set_autocommit(False)
         cls.patchers = []
         cls.patchers.append(patch.object(User._meta, 'database', cls.database))
-        cls.patchers.append(patch.object(Attendance._meta, 'database', cls.database))
+        cls.patchers.append(
+            patch.object(Attendance._meta, 'database', cls.database))
+        cls.patchers.append(
+            patch.object(DailyAttendance._meta, 'database', cls.database))
         for patcher in cls.patchers:
             patcher.start()
         cls.database.connect()
-        cls.database.create_tables([Attendance, User], safe=True)
+        cls.database.create_tables(
+            [Attendance, DailyAttendance, User], safe=True)
 
     @classmethod
     def tearDownClass(cls):
@@ -28,11 +31,12 @@ class TestUser(unittest.TestCase):
         cls.database.close()
 
     def setUp(self):
-        self.database.begin()
         self.user = User.create(id='id', name='name', timezone_id='Asia/Tokyo')
 
     def tearDown(self):
-        self.database.rollback()
+        # User runs its own transactions, so clean up explicitly.
+        for model in (DailyAttendance, Attendance, User):
+            model.delete().execute()
 
     def test_last_attendance_returns_none_without_attendances(self):
         """last_attendance() returns None when the user has no attendance."""
@@ -52,6 +56,118 @@ class TestUser(unittest.TestCase):
             attendance = Attendance.create(started_at=started_at, finished_at=finished_at, user=self.user)
         self.assertEqual(self.user.last_attendance(), attendance)
 
+    def test_open_attendance_returns_none_without_attendances(self):
+        self.assertIsNone(self.user.open_attendance())
+
+    def test_start_working_opens_attendance(self):
+        started_at = datetime(2017, 1, 1)
+        attendance, has_unfinished_work = self.user.start_working(started_at)
+        self.assertFalse(has_unfinished_work)
+        self.assertEqual(attendance.started_at, started_at)
+        self.assertIsNone(attendance.finished_at)
+        self.assertEqual(self.user.open_attendance(), attendance)
+        user = User.get(User.id == self.user.id)
+        self.assertEqual(user.open_attendance_id, attendance.id)
+
+    def test_start_working_twice_reports_unfinished_work(self):
+        self.user.start_working(datetime(2017, 1, 1))
+        attendance, has_unfinished_work = self.user.start_working(
+            datetime(2017, 1, 2))
+        self.assertTrue(has_unfinished_work)
+        self.assertEqual(self.user.open_attendance(), attendance)
+
+    def test_finish_working_closes_open_attendance(self):
+        self.user.start_working(datetime(2017, 1, 1, 9))
+        attendance, has_unstarted_work = self.user.finish_working(
+            datetime(2017, 1, 1, 12))
+        self.assertFalse(has_unstarted_work)
+        self.assertTrue(attendance.is_complete)
+        self.assertIsNone(self.user.open_attendance())
+        self.assertEqual(Attendance.select().count(), 1)
+        daily_attendance = self.user.daily_attendances.get()
+        self.assertEqual(daily_attendance.working_time, timedelta(hours=3))
+
+    def test_finish_working_summarizes_local_date(self):
+        self.user.timezone_id = 'US/Eastern'
+        self.user.save()
+        # 2017-01-02 03:00 UTC is 2017-01-01 22:00 EST.
+        self.user.start_working(datetime(2017, 1, 2, 3))
+        self.user.finish_working(datetime(2017, 1, 2, 4))
+        daily_attendance = self.user.daily_attendances.get()
+        self.assertEqual(daily_attendance.date, date(2017, 1, 1))
+
+    def test_finish_working_without_open_attendance_reports_unstarted_work(
+            self):
+        finished_at = datetime(2017, 1, 1, 12)
+        attendance, has_unstarted_work = self.user.finish_working(finished_at)
+        self.assertTrue(has_unstarted_work)
+        self.assertIsNone(attendance.started_at)
+        self.assertEqual(attendance.finished_at, finished_at)
+        self.assertFalse(DailyAttendance.select().exists())
+
+    def test_finish_working_reads_open_attendance_closed_elsewhere(self):
+        attendance, _ = self.user.start_working(datetime(2017, 1, 1, 9))
+        # Another process closes it while this object is cached.
+        User.update(open_attendance_id=None).execute()
+        finished, has_unstarted_work = self.user.finish_working(
+            datetime(2017, 1, 3))
+        self.assertTrue(has_unstarted_work)
+        self.assertNotEqual(finished.id, attendance.id)
+        self.assertIsNone(
+            Attendance.get(Attendance.id == attendance.id).finished_at)
+        self.assertFalse(DailyAttendance.select().exists())
+
+    def test_start_working_reads_open_attendance_opened_elsewhere(self):
+        User.get(User.id == self.user.id).start_working(
+            datetime(2017, 1, 1, 9))
+        _, has_unfinished_work = self.user.start_working(
+            datetime(2017, 1, 1, 10))
+        self.assertTrue(has_unfinished_work)
+
+    def test_finish_working_keeps_open_attendance_on_rollback(self):
+        attendance, _ = self.user.start_working(datetime(2017, 1, 1, 9))
+        with patch.object(DailyAttendance, '_refresh',
+                          side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            self.user.finish_working(datetime(2017, 1, 1, 12))
+        self.assertEqual(self.user.open_attendance_id, attendance.id)
+        self.assertEqual(User.get(User.id == self.user.id).open_attendance_id,
+                         attendance.id)
+        self.assertIsNone(
+            Attendance.get(Attendance.id == attendance.id).finished_at)
+
+    def test_close_stale_attendances(self):
+        other = User.create(id='other', name='other')
+        self.user.start_working(datetime(2017, 1, 1, 9))
+        other.start_working(datetime(2017, 1, 2, 9))
+        self.assertEqual(User.close_stale_attendances(datetime(2017, 1, 2)),
+                         ['id'])
+        self.assertIsNone(User.get(User.id == 'id').open_attendance_id)
+        self.assertIsNotNone(User.get(User.id == 'other').open_attendance_id)
+        user = User.get(User.id == 'id')
+        attendance, has_unstarted_work = user.finish_working(
+            datetime(2017, 1, 3))
+        self.assertTrue(has_unstarted_work)
+        self.assertIsNone(attendance.started_at)
+        self.assertFalse(DailyAttendance.select().exists())
+
+    def test_close_stale_attendances_keeps_attendance_started_meanwhile(self):
+        self.user.start_working(datetime(2017, 1, 1, 9))
+        update = User.update
+        started = []
+
+        def start_working_then_update(*args, **kwargs):
+            if not started:
+                started.append(None)
+                started[0], _ = self.user.start_working(
+                    datetime(2017, 1, 3, 9))
+            return update(*args, **kwargs)
+
+        with patch.object(User, 'update', start_working_then_update):
+            User.close_stale_attendances(datetime(2017, 1, 2))
+        self.assertEqual(User.get(User.id == 'id').open_attendance_id,
+                         started[0].id)
+
     def test_timezone_returns_timezone_object(self):
         self.assertIsInstance(self.user.timezone, tzinfo)
         dt = datetime(2017, 1, 1)
@@ -70,7 +186,8 @@ class TestAttendance(unittest.TestCase):
         cls.database.set_autocommit(False)
         cls.patchers = []
         cls.patchers.append(patch.object(User._meta, 'database', cls.database))
-        cls.patchers.append(patch.object(Attendance._meta, 'database', cls.database))
+        cls.patchers.append(
+            patch.object(Attendance._meta, 'database', cls.database))
         for patcher in cls.patchers:
             patcher.start()
         cls.database.connect()
@@ -117,6 +234,20 @@ class TestAttendance(unittest.TestCase):
                                            user=self.user)
             self.assertEqual(attendance.working_time, expected_value)
 
+    def test_fingerprint_changes_with_attendances(self):
+        fingerprints = [Attendance.fingerprint(self.user)]
+        attendance = Attendance.create(started_at=datetime(2017, 1, 1),
+                                       user=self.user)
+        fingerprints.append(Attendance.fingerprint(self.user))
+        attendance.finished_at = datetime(2017, 1, 1, 8)
+        attendance.save()
+        fingerprints.append(Attendance.fingerprint(self.user))
+        attendance.delete_instance()
+        fingerprints.append(Attendance.fingerprint(self.user))
+        self.assertEqual(fingerprints[0], (0, None, 0, None))
+        for before, after in zip(fingerprints, fingerprints[1:]):
+            self.assertNotEqual(before, after)
+
     def test_started_at_display(self):
         started_at = datetime(2017, 1, 1)
         attendance = Attendance.create(started_at=started_at, user=self.user)
@@ -144,3 +275,194 @@ class TestAttendance(unittest.TestCase):
                                            finished_at=finished_at,
                                            user=self.user)
             self.assertEqual(attendance.working_time_display, expected_value)
+
+    def test_iterate_between_pages_by_started_at_and_id(self):
+        other_user = User.create(id='other_id', name='other_name')
+        expected = []
+        for hours in range(10):
+            started_at = datetime(2017, 1, 1) + timedelta(hours=hours // 2)
+            expected.append(Attendance.create(started_at=started_at,
+                                              user=self.user))
+            Attendance.create(started_at=started_at, user=other_user)
+        Attendance.create(started_at=datetime(2017, 1, 1, 5), user=self.user)
+        for page_size in (1, 2, 3, 10, 100):
+            attendances = list(Attendance.iterate_between(
+                self.user, datetime(2017, 1, 1), datetime(2017, 1, 1, 5),
+                page_size=page_size))
+            self.assertEqual(attendances, expected, page_size)
+
+
+class TestDailyAttendance(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.database = SqliteDatabase(':memory:')
+        cls.patchers = []
+        cls.patchers.append(patch.object(User._meta, 'database', cls.database))
+        cls.patchers.append(
+            patch.object(Attendance._meta, 'database', cls.database))
+        cls.patchers.append(
+            patch.object(DailyAttendance._meta, 'database', cls.database))
+        for patcher in cls.patchers:
+            patcher.start()
+        cls.database.connect()
+        cls.database.create_tables(
+            [Attendance, DailyAttendance, User], safe=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        for patcher in cls.patchers:
+            patcher.stop()
+        cls.database.close()
+
+    def setUp(self):
+        self.user = User.create(id='id', name='name', timezone_id='Asia/Tokyo')
+        self.other_user = User.create(id='other_id', name='other_name',
+                                      timezone_id='Asia/Tokyo')
+
+    def tearDown(self):
+        # DailyAttendance runs its own transactions, so clean up explicitly.
+        for model in (DailyAttendance, Attendance, User):
+            model.delete().execute()
+
+    def test_refresh_aggregates_attendances_of_the_day(self):
+        Attendance.create(started_at=datetime(2017, 1, 1, 9),
+                          finished_at=datetime(2017, 1, 1, 12),
+                          user=self.user)
+        Attendance.create(started_at=datetime(2017, 1, 1, 13),
+                          finished_at=datetime(2017, 1, 1, 18, 30),
+                          user=self.user)
+        Attendance.create(started_at=datetime(2017, 1, 2, 9),
+                          finished_at=datetime(2017, 1, 2, 12),
+                          user=self.user)
+        Attendance.create(started_at=datetime(2017, 1, 1, 9),
+                          finished_at=datetime(2017, 1, 1, 10),
+                          user=self.other_user)
+        Attendance.create(started_at=datetime(2017, 1, 1, 19), user=self.user)
+        DailyAttendance.refresh(self.user, date(2017, 1, 1))
+        daily_attendance = DailyAttendance.get()
+        self.assertEqual(DailyAttendance.select().count(), 1)
+        self.assertEqual(daily_attendance.user, self.user)
+        self.assertEqual(daily_attendance.date, date(2017, 1, 1))
+        self.assertEqual(daily_attendance.started_at, datetime(2017, 1, 1, 9))
+        self.assertEqual(daily_attendance.finished_at,
+                         datetime(2017, 1, 1, 18, 30))
+        self.assertEqual(daily_attendance.break_count, 1)
+        self.assertEqual(daily_attendance.working_time,
+                         timedelta(hours=8, minutes=30))
+
+    def test_refresh_replaces_existing_summary(self):
+        attendance = Attendance.create(started_at=datetime(2017, 1, 1, 9),
+                                       finished_at=datetime(2017, 1, 1, 12),
+                                       user=self.user)
+        DailyAttendance.refresh(self.user, date(2017, 1, 1))
+        attendance.finished_at = datetime(2017, 1, 1, 13)
+        attendance.save()
+        DailyAttendance.refresh(self.user, date(2017, 1, 1))
+        daily_attendance = DailyAttendance.get()
+        self.assertEqual(DailyAttendance.select().count(), 1)
+        self.assertEqual(daily_attendance.working_time, timedelta(hours=4))
+
+    def test_refresh_removes_summary_without_attendances(self):
+        attendance = Attendance.create(started_at=datetime(2017, 1, 1, 9),
+                                       finished_at=datetime(2017, 1, 1, 12),
+                                       user=self.user)
+        DailyAttendance.refresh(self.user, date(2017, 1, 1))
+        attendance.delete_instance()
+        DailyAttendance.refresh(self.user, date(2017, 1, 1))
+        self.assertFalse(DailyAttendance.select().exists())
+
+    def test_rebuild_is_consistent_with_refresh(self):
+        started_at = datetime(2017, 1, 1, 9)
+        for days in range(3):
+            for user in (self.user, self.other_user):
+                for hours in (0, 4):
+                    offset = timedelta(days=days, hours=hours)
+                    Attendance.create(
+                        started_at=started_at + offset,
+                        finished_at=started_at + offset + timedelta(hours=3),
+                        user=user)
+        for days in range(3):
+            for user in (self.user, self.other_user):
+                DailyAttendance.refresh(user, date(2017, 1, 1 + days))
+        refreshed = list(DailyAttendance.select().tuples())
+        DailyAttendance.rebuild()
+        rebuilt = list(DailyAttendance.select().tuples())
+        self.assertEqual(len(rebuilt), 6)
+        self.assertCountEqual(rebuilt, refreshed)
+
+    def test_fingerprint_changes_with_summaries(self):
+        self.assertEqual(DailyAttendance.fingerprint(self.user),
+                         (0, None, None, None))
+        attendance = Attendance.create(started_at=datetime(2017, 1, 1, 9),
+                                       finished_at=datetime(2017, 1, 1, 12),
+                                       user=self.user)
+        DailyAttendance.refresh(self.user, date(2017, 1, 1))
+        fingerprint = DailyAttendance.fingerprint(self.user)
+        self.assertEqual(fingerprint[:2], (1, date(2017, 1, 1)))
+        attendance.finished_at = datetime(2017, 1, 1, 13)
+        attendance.save()
+        DailyAttendance.refresh(self.user, date(2017, 1, 1))
+        self.assertNotEqual(DailyAttendance.fingerprint(self.user),
+                            fingerprint)
+
+    def test_rebuild_buckets_by_local_date_across_dst(self):
+        users = [User.create(id=timezone_id, name=timezone_id,
+                             timezone_id=timezone_id)
+                 for timezone_id in ('US/Eastern', 'Europe/London')]
+        expected = {}
+        rows = []
+        started_at = datetime(2014, 1, 1)
+        while started_at < datetime(2018, 1, 1):
+            finished_at = started_at + timedelta(minutes=30)
+            for user in users:
+                rows.append({'started_at': started_at,
+                             'finished_at': finished_at, 'user': user})
+                local_started_at = (utc.localize(started_at)
+                                    .astimezone(timezone(user.timezone_id)))
+                key = (user.id, local_started_at.date())
+                count, seconds = expected.get(key, (0, 0))
+                expected[key] = (count + 1, seconds + 1800)
+            started_at += timedelta(hours=11, minutes=7)
+        for i in range(0, len(rows), 100):
+            Attendance.insert_many(rows[i:i + 100]).execute()
+        DailyAttendance.rebuild()
+        rebuilt = {(d.user_id, d.date):
+                   (d.break_count + 1, d.working_time_seconds)
+                   for d in DailyAttendance.select()}
+        self.assertEqual(rebuilt, expected)
+
+    def test_refresh_is_consistent_with_rebuild_on_dst_days(self):
+        user = User.create(id='eastern', name='eastern',
+                           timezone_id='US/Eastern')
+        days = [date(2017, 3, 11), date(2017, 3, 12), date(2017, 3, 13),
+                date(2017, 11, 4), date(2017, 11, 5), date(2017, 11, 6)]
+        for day in days:
+            started_at = datetime.combine(day, datetime.min.time())
+            for hours in range(0, 24, 3):
+                Attendance.create(
+                    started_at=started_at + timedelta(hours=hours),
+                    finished_at=started_at + timedelta(hours=hours + 1),
+                    user=user)
+        DailyAttendance.rebuild(user)
+        rebuilt = list(DailyAttendance.select().tuples())
+        for day in [days[0] - timedelta(days=1)] + days:
+            DailyAttendance.refresh(user, day)
+        refreshed = list(DailyAttendance.select().tuples())
+        self.assertCountEqual(refreshed, rebuilt)
+        self.assertEqual(
+            DailyAttendance.get(date=date(2017, 3, 12)).break_count, 7)
+
+    def test_rebuild_only_the_user(self):
+        for user in (self.user, self.other_user):
+            Attendance.create(started_at=datetime(2017, 1, 1, 5),
+                              finished_at=datetime(2017, 1, 1, 8),
+                              user=user)
+        DailyAttendance.rebuild()
+        self.user.timezone_id = 'US/Pacific'
+        self.user.save()
+        Attendance.delete().where(Attendance.user == self.other_user).execute()
+        DailyAttendance.rebuild(self.user)
+        self.assertEqual(DailyAttendance.get(user=self.user).date,
+                         date(2016, 12, 31))
+        self.assertEqual(DailyAttendance.get(user=self.other_user).date,
+                         date(2017, 1, 1))
@@ -0,0 +1,172 @@
+import base64
+import hashlib
+import json
+import re
+import socket
+import struct
+from threading import Event, Thread
+import unittest
+
+from slackbot.manager import PluginsManager
+from slackbot.slackclient import SlackClient
+
+from timekeeper.plugins.decorators import urgent
+from timekeeper.runtime import BUSY_REPLY, Runtime
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+class FakeWebSocketServer:
+    """
+    Accepts a websocket connection and exchanges unfragmented text frames.
+    """
+
+    def __init__(self):
+        self._socket = socket.socket()
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.listen(1)
+        self.url = 'ws://127.0.0.1:{}/'.format(self._socket.getsockname()[1])
+        self._connection = None
+
+    def accept(self):
+        self._connection, _ = self._socket.accept()
+        self._connection.settimeout(5)
+        request = b''
+        while b'\r\n\r\n' not in request:
+            request += self._connection.recv(4096)
+        key = re.search(br'Sec-WebSocket-Key: *(\S+)', request,
+                        re.IGNORECASE).group(1)
+        accept = base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest())
+        self._connection.sendall(
+            b'HTTP/1.1 101 Switching Protocols\r\n'
+            b'Upgrade: websocket\r\n'
+            b'Connection: Upgrade\r\n'
+            b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+
+    def send(self, event):
+        payload = json.dumps(event).encode('utf-8')
+        if len(payload) < 126:
+            header = struct.pack('!BB', 0x81, len(payload))
+        else:
+            header = struct.pack('!BBH', 0x81, 126, len(payload))
+        self._connection.sendall(header + payload)
+
+    def receive(self):
+        _, length = struct.unpack('!BB', self._receive_exactly(2))
+        length &= 0x7f
+        if length == 126:
+            length, = struct.unpack('!H', self._receive_exactly(2))
+        elif length == 127:
+            length, = struct.unpack('!Q', self._receive_exactly(8))
+        mask = self._receive_exactly(4)
+        payload = bytes(byte ^ mask[i % 4] for i, byte
+                        in enumerate(self._receive_exactly(length)))
+        return json.loads(payload.decode('utf-8'))
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+        self._socket.close()
+
+    def _receive_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self._connection.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('The client closed the connection.')
+            data += chunk
+        return data
+
+
+class TestRuntime(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeWebSocketServer()
+        self.client = SlackClient('token', connect=False)
+        self.client.parse_user_data([{'id': 'U1', 'name': 'alice'}])
+        accepting = Thread(target=self.server.accept)
+        accepting.start()
+        self.client.parse_slack_login_data({
+            'url': self.server.url,
+            'team': {'domain': 'example'},
+            'self': {'id': 'UBOT', 'name': 'timekeeper'},
+        })
+        accepting.join()
+        self.reporting = Event()
+        self.released = Event()
+        self.clocked = Event()
+        self.plugins = PluginsManager()
+        self.plugins.commands = {
+            'respond_to': {re.compile('^report$'): self.report},
+            'listen_to': {re.compile('started working'): self.start_working},
+            'default_reply': {},
+        }
+        self.runtime = None
+        self.thread = None
+
+    def tearDown(self):
+        self.released.set()
+        if self.runtime is not None:
+            self.runtime.stop()
+            self.thread.join(5)
+        self.client.websocket.shutdown()
+        self.server.close()
+
+    def report(self, message):
+        self.reporting.set()
+        self.released.wait(5)
+        message.reply('report')
+
+    @urgent
+    def start_working(self, message):
+        self.clocked.set()
+        message.reply('started')
+
+    def start_runtime(self, **kwargs):
+        self.runtime = Runtime(self.client, self.plugins, **kwargs)
+        self.thread = Thread(target=self.runtime.run)
+        self.thread.start()
+
+    def send_message(self, text, channel='D1'):
+        self.server.send({'type': 'message', 'user': 'U1', 'channel': channel,
+                          'text': text, 'ts': '1.0'})
+
+    def receive_texts(self, count):
+        return [self.server.receive()['text'] for _ in range(count)]
+
+    def test_urgent_handlers_do_not_wait_for_others(self):
+        self.start_runtime(workers=1, urgent_workers=1)
+        for _ in range(3):
+            self.send_message('report')
+        self.send_message('I started working', channel='C1')
+        self.assertTrue(self.clocked.wait(5))
+        self.assertEqual(self.receive_texts(1), ['<@U1>: started'])
+        self.released.set()
+        self.assertEqual(self.receive_texts(3), ['report'] * 3)
+
+    def test_declines_messages_if_queue_is_full(self):
+        self.start_runtime(workers=1, queue_size=1)
+        self.send_message('report')
+        self.assertTrue(self.reporting.wait(5))
+        self.send_message('report')
+        self.send_message('report')
+        self.assertEqual(self.receive_texts(1), [BUSY_REPLY])
+        self.released.set()
+        self.assertEqual(self.receive_texts(2), ['report'] * 2)
+
+    def test_ignores_messages_nobody_listens_to(self):
+        self.start_runtime(workers=1, urgent_workers=1)
+        self.send_message('hello', channel='C1')
+        self.send_message('I started working', channel='C1')
+        self.assertEqual(self.receive_texts(1), ['<@U1>: started'])
+
+    def test_updates_users_and_channels(self):
+        self.start_runtime()
+        self.server.send({'type': 'team_join',
+                          'user': {'id': 'U2', 'name': 'bob'}})
+        self.server.send({'type': 'channel_created',
+                          'channel': {'id': 'C2', 'name': 'general'}})
+        self.send_message('<@UBOT> report', channel='C2')
+        self.released.set()
+        self.assertEqual(self.receive_texts(1), ['<@U1>: report'])
+        self.assertEqual(self.client.users['U2']['name'], 'bob')
+        self.assertEqual(self.client.channels['C2']['name'], 'general')
@@ -0,0 +1,39 @@
+from datetime import datetime
+from threading import Event
+import unittest
+from unittest.mock import patch
+
+from timekeeper.scheduler import DailyScheduler
+
+
+class TestDailyScheduler(unittest.TestCase):
+    def test_next_run(self):
+        scheduler = DailyScheduler(None, 4, timezone_id='Asia/Tokyo')
+        # 04:00 in Tokyo is 19:00 in UTC of the previous day.
+        self.assertEqual(scheduler.next_run(datetime(2017, 1, 1, 12)),
+                         datetime(2017, 1, 1, 19))
+        self.assertEqual(scheduler.next_run(datetime(2017, 1, 1, 19)),
+                         datetime(2017, 1, 2, 19))
+        self.assertEqual(scheduler.next_run(datetime(2017, 1, 1, 20)),
+                         datetime(2017, 1, 2, 19))
+
+    def test_next_run_across_dst(self):
+        scheduler = DailyScheduler(None, 4, 30, timezone_id='Europe/London')
+        self.assertEqual(scheduler.next_run(datetime(2017, 3, 25, 5)),
+                         datetime(2017, 3, 26, 3, 30))
+        self.assertEqual(scheduler.next_run(datetime(2017, 3, 26, 5)),
+                         datetime(2017, 3, 27, 3, 30))
+
+    def test_runs_function(self):
+        called = Event()
+
+        def func():
+            called.set()
+            raise RuntimeError('the scheduler keeps running')
+
+        scheduler = DailyScheduler(func, 0)
+        runs = [datetime(2017, 1, 1), datetime(2100, 1, 1)]
+        with patch.object(scheduler, 'next_run', side_effect=runs):
+            scheduler.start()
+            self.assertTrue(called.wait(5))
+            scheduler.stop()
@@ -0,0 +1,227 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+from threading import Event, Thread
+import unittest
+from unittest.mock import MagicMock, patch
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+import slacker
+
+from timekeeper.metrics import registry
+from timekeeper.slackapi import Outbox, SlackAPI, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeSlackServer:
+    """
+    Answers Web API requests with the queued statuses, then with ok.
+    """
+
+    def __init__(self):
+        self.statuses = []
+        self.requests = []
+        self.connections = set()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self.respond(parse_qs(urlsplit(self.path).query))
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                params = parse_qs(urlsplit(self.path).query)
+                body = self.rfile.read(length).decode('utf-8')
+                params.update(parse_qs(body))
+                self.respond(params)
+
+            def respond(self, params):
+                server.connections.add(self.client_address)
+                server.requests.append((urlsplit(self.path).path, params))
+                status = server.statuses.pop(0) if server.statuses else 200
+                body = json.dumps({'ok': status == 200}).encode('utf-8')
+                self.send_response(status)
+                if status == 429:
+                    self.send_header('Retry-After', '2')
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/api/'.format(self._server.server_port)
+        self._thread = Thread(target=self._server.serve_forever, args=(0.05,),
+                              daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_reserve(self):
+        clock = FakeClock()
+        bucket = TokenBucket(0.5, 2, clock)
+        self.assertEqual([bucket.reserve() for _ in range(4)], [0, 0, 2, 4])
+        clock.now = 10
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0, 0, 2])
+
+    def test_pause(self):
+        clock = FakeClock()
+        bucket = TokenBucket(1, 5, clock)
+        bucket.pause(30)
+        self.assertEqual(bucket.reserve(), 30)
+        self.assertEqual(bucket.reserve(), 31)
+        clock.now = 40
+        self.assertEqual(bucket.reserve(), 0)
+
+
+class TestSlackAPI(unittest.TestCase):
+    def setUp(self):
+        registry.clear()
+        self.server = FakeSlackServer()
+        self.clock = FakeClock()
+        self.sleeps = []
+        self.api = SlackAPI(base_url=self.server.url, clock=self.clock,
+                            sleep=self.sleeps.append)
+
+    def tearDown(self):
+        self.api.session.close()
+        self.server.close()
+
+    def test_request_retries_after_retry_after(self):
+        self.server.statuses = [429]
+        response = self.api.request('get', slacker.get_api_url('users.list'))
+        self.assertEqual(response.json(), {'ok': True})
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.sleeps, [2])
+        self.assertEqual(
+            registry.samples('timekeeper_slack_api_rate_limited_total'),
+            {(('method', 'users.list'),): 1})
+        throttled = registry.samples('timekeeper_slack_api_throttled_seconds')
+        self.assertEqual(throttled[(('method', 'users.list'),)].count, 2)
+
+    def test_request_raises_if_rate_limited_too_often(self):
+        self.api.max_retries = 1
+        self.server.statuses = [429, 429]
+        with self.assertRaises(requests.HTTPError):
+            self.api.request('get', slacker.get_api_url('users.list'))
+        self.assertEqual(
+            registry.samples('timekeeper_slack_api_rate_limited_total'),
+            {(('method', 'users.list'),): 2})
+
+    def test_request_waits_for_tokens(self):
+        # reactions.add is in tier 3 which allows bursts of 5 and 50 calls
+        # per minute.
+        for _ in range(7):
+            self.api.request('post', slacker.get_api_url('reactions.add'))
+        self.assertEqual(self.sleeps, [1.2, 2.4])
+
+    def test_request_reuses_connection(self):
+        for _ in range(3):
+            self.api.request('get', slacker.get_api_url('users.list'))
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_install(self):
+        with patch.object(slacker.BaseAPI, 'get', slacker.BaseAPI.get), \
+                patch.object(slacker.BaseAPI, 'post', slacker.BaseAPI.post):
+            self.api.install()
+            self.server.statuses = [429]
+            client = slacker.Slacker('token', rate_limit_retries=30)
+            client.reactions.add('stopwatch', channel='C1', timestamp='1.0')
+        path, params = self.server.requests[-1]
+        self.assertEqual(path, '/api/reactions.add')
+        self.assertEqual(params['token'], ['token'])
+        self.assertEqual(params['name'], ['stopwatch'])
+        self.assertEqual(self.sleeps, [2])
+
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        registry.clear()
+        self.outbox = Outbox(maxsize=2, max_retries=2, backoff=0)
+        self.blocking = Event()
+        self.released = Event()
+        self.calls = []
+
+    def block(self):
+        self.blocking.set()
+        self.released.wait(5)
+
+    def submit_blocking_call(self):
+        self.outbox.submit(self.block)
+        self.assertTrue(self.blocking.wait(5))
+
+    def outbox_samples(self):
+        samples = registry.samples('timekeeper_slack_outbox_calls_total')
+        return {dict(key)['status']: value for key, value in samples.items()}
+
+    def test_submit(self):
+        self.outbox.submit(self.calls.append, 'a')
+        self.outbox.submit(self.calls.append, 'b')
+        self.assertTrue(self.outbox.flush(5))
+        self.assertEqual(self.calls, ['a', 'b'])
+
+    def test_submit_coalesces_duplicates(self):
+        self.submit_blocking_call()
+        for _ in range(3):
+            self.assertTrue(
+                self.outbox.submit(self.calls.append, 'a', key='a'))
+        self.released.set()
+        self.assertTrue(self.outbox.flush(5))
+        self.outbox.submit(self.calls.append, 'a', key='a')
+        self.assertTrue(self.outbox.flush(5))
+        self.assertEqual(self.calls, ['a', 'a'])
+        self.assertEqual(self.outbox_samples(), {'ok': 3, 'coalesced': 2})
+
+    def test_submit_drops_calls_if_full(self):
+        self.submit_blocking_call()
+        self.outbox.submit(self.calls.append, 'a')
+        self.outbox.submit(self.calls.append, 'b')
+        self.assertFalse(self.outbox.submit(self.calls.append, 'c'))
+        self.released.set()
+        self.assertTrue(self.outbox.flush(5))
+        self.assertEqual(self.calls, ['a', 'b'])
+        self.assertEqual(self.outbox_samples()['dropped'], 1)
+
+    def test_outboxes_do_not_wait_for_each_other(self):
+        self.submit_blocking_call()
+        reply_outbox = Outbox(name='timekeeper-reply-outbox')
+        reply_outbox.submit(self.calls.append, 'reply')
+        self.assertTrue(reply_outbox.flush(5))
+        self.assertEqual(self.calls, ['reply'])
+        self.assertEqual(reply_outbox._thread.name, 'timekeeper-reply-outbox')
+        self.released.set()
+        self.assertTrue(self.outbox.flush(5))
+
+    def test_retries_failed_call(self):
+        response = MagicMock(status_code=429, headers={'Retry-After': '0'})
+        func = MagicMock(side_effect=[requests.HTTPError(response=response),
+                                      ValueError(), None])
+        self.outbox.submit(func, 'a', key='a')
+        self.assertTrue(self.outbox.flush(5))
+        self.assertEqual(func.call_count, 3)
+        self.assertEqual(self.outbox_samples(), {'retried': 2, 'ok': 1})
+
+    def test_gives_up_failed_call(self):
+        func = MagicMock(side_effect=ValueError())
+        self.outbox.submit(func, key='a')
+        self.assertTrue(self.outbox.flush(5))
+        self.assertEqual(func.call_count, 3)
+        self.assertEqual(self.outbox_samples(), {'retried': 2, 'failed': 1})
+        self.outbox.submit(func, key='a')
+        self.assertTrue(self.outbox.flush(5))
+        self.assertEqual(func.call_count, 6)
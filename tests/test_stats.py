@@ -0,0 +1,181 @@
+from datetime import date
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from peewee import SqliteDatabase
+
+from timekeeper.models import Attendance, DailyAttendance, User
+from timekeeper.stats import (WorkingTimeSeries, daily_working_time_seconds,
+                              team_stats, working_time_ratio_series)
+
+
+class TestStats(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.database = SqliteDatabase(':memory:')
+        cls.patchers = []
+        cls.patchers.append(patch.object(User._meta, 'database', cls.database))
+        cls.patchers.append(
+            patch.object(Attendance._meta, 'database', cls.database))
+        cls.patchers.append(
+            patch.object(DailyAttendance._meta, 'database', cls.database))
+        for patcher in cls.patchers:
+            patcher.start()
+        cls.database.connect()
+        cls.database.create_tables(
+            [Attendance, DailyAttendance, User], safe=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        for patcher in cls.patchers:
+            patcher.stop()
+        cls.database.close()
+
+    def setUp(self):
+        self.user = User.create(id='id', name='name', timezone_id='Asia/Tokyo')
+        other_user = User.create(id='other_id', name='other_name',
+                                 timezone_id='Asia/Tokyo')
+        self.seconds = [3600, 7200, 1800, 28800]
+        self.dates = [date(2016, 12, 31), date(2017, 1, 1),
+                      date(2017, 1, 2), date(2017, 1, 4)]
+        for day, seconds in reversed(list(zip(self.dates, self.seconds))):
+            DailyAttendance.create(user=self.user, date=day, break_count=0,
+                                   working_time_seconds=seconds)
+        DailyAttendance.create(user=other_user, date=date(2017, 1, 3),
+                               break_count=0, working_time_seconds=60)
+
+    def tearDown(self):
+        for model in (DailyAttendance, Attendance, User):
+            model.delete().execute()
+
+    def test_daily_working_time_seconds_returns_sorted_arrays(self):
+        dates, seconds = daily_working_time_seconds(self.user, chunk_size=3)
+        self.assertEqual(dates.dtype, np.dtype('datetime64[D]'))
+        self.assertEqual(dates.tolist(), self.dates)
+        self.assertEqual(seconds.tolist(), self.seconds)
+
+    def test_daily_working_time_seconds_with_bounds(self):
+        dates, seconds = daily_working_time_seconds(
+            self.user, start=date(2017, 1, 1), end=date(2017, 1, 4))
+        self.assertEqual(dates.tolist(), self.dates[1:3])
+        self.assertEqual(seconds.tolist(), self.seconds[1:3])
+
+    def test_daily_working_time_seconds_without_rows(self):
+        dates, seconds = daily_working_time_seconds(self.user,
+                                                    start=date(2018, 1, 1))
+        self.assertEqual(len(dates), 0)
+        self.assertEqual(len(seconds), 0)
+
+    def test_daily_working_time_seconds_runs_one_query(self):
+        with patch.object(self.database, 'execute_sql',
+                          wraps=self.database.execute_sql) as execute_sql:
+            dates, seconds = daily_working_time_seconds(self.user,
+                                                        chunk_size=1)
+        self.assertEqual(execute_sql.call_count, 1)
+        self.assertEqual(dates.tolist(), self.dates)
+        self.assertEqual(seconds.tolist(), self.seconds)
+
+    def test_working_time_ratio_series_matches_pandas(self):
+        import pandas as pd
+
+        series = working_time_ratio_series(self.user)
+        self.assertIsInstance(series, WorkingTimeSeries)
+        expected = pd.Series(self.seconds, index=pd.DatetimeIndex(self.dates))
+        expected = expected / expected.std()
+        np.testing.assert_allclose(series.values, expected.values)
+        actual = series.to_pandas()
+        self.assertTrue(actual.index.equals(expected.index))
+        np.testing.assert_allclose(actual.values, expected.values)
+
+    def test_working_time_ratio_series_with_single_row(self):
+        series = working_time_ratio_series(self.user, end=date(2017, 1, 1))
+        self.assertEqual(len(series.values), 1)
+        self.assertTrue(np.isnan(series.values[0]))
+
+
+class TestTeamStats(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.database = SqliteDatabase(':memory:')
+        cls.patchers = []
+        cls.patchers.append(patch.object(User._meta, 'database', cls.database))
+        cls.patchers.append(
+            patch.object(Attendance._meta, 'database', cls.database))
+        cls.patchers.append(
+            patch.object(DailyAttendance._meta, 'database', cls.database))
+        for patcher in cls.patchers:
+            patcher.start()
+        cls.database.connect()
+        cls.database.create_tables(
+            [Attendance, DailyAttendance, User], safe=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        for patcher in cls.patchers:
+            patcher.stop()
+        cls.database.close()
+
+    def setUp(self):
+        self.alice = User.create(id='alice', name='alice', trackable=True)
+        self.bob = User.create(id='bob', name='bob', trackable=True)
+        self.carol = User.create(id='carol', name='carol', trackable=False)
+        summaries = [
+            (self.alice, date(2017, 1, 1), 3600, 1),
+            (self.alice, date(2017, 1, 2), 7200, 0),
+            (self.alice, date(2017, 1, 9), 1800, 2),
+            (self.bob, date(2017, 1, 3), 600, 0),
+            (self.carol, date(2017, 1, 4), 60, 0),
+        ]
+        for user, day, seconds, break_count in summaries:
+            DailyAttendance.create(user=user, date=day,
+                                   break_count=break_count,
+                                   working_time_seconds=seconds)
+
+    def tearDown(self):
+        for model in (DailyAttendance, Attendance, User):
+            model.delete().execute()
+
+    def test_team_stats_of_trackable_users(self):
+        stats = team_stats()
+        self.assertEqual(stats.user_ids, ['alice', 'bob'])
+        self.assertEqual(stats.dates[0], np.datetime64('2017-01-01'))
+        self.assertEqual(stats.dates[-1], np.datetime64('2017-01-09'))
+        self.assertEqual(stats.working_time_seconds.shape, (2, 9))
+        self.assertEqual(stats.working_time_seconds[0].tolist(),
+                         [3600, 7200, 0, 0, 0, 0, 0, 0, 1800])
+        self.assertEqual(stats.working_time_seconds[1].tolist(),
+                         [0, 0, 600, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(stats.break_counts[0].tolist(),
+                         [1, 0, 0, 0, 0, 0, 0, 0, 2])
+        self.assertEqual(stats.recorded.sum(), 4)
+
+    def test_team_stats_of_given_users(self):
+        stats = team_stats([self.carol, 'bob', 'unknown'],
+                           start=date(2017, 1, 2), end=date(2017, 1, 9))
+        self.assertEqual(stats.user_ids, ['carol', 'bob', 'unknown'])
+        self.assertEqual(stats.dates.tolist(),
+                         [date(2017, 1, 3), date(2017, 1, 4)])
+        self.assertEqual(stats.working_time_seconds.tolist(),
+                         [[0, 60], [600, 0], [0, 0]])
+
+    def test_team_stats_without_users(self):
+        stats = team_stats([])
+        self.assertEqual(stats.user_ids, [])
+        self.assertEqual(stats.working_time_seconds.shape, (0, 0))
+
+    def test_weekly_working_time_seconds(self):
+        weeks, totals = team_stats().weekly_working_time_seconds()
+        self.assertEqual(weeks.tolist(), [date(2016, 12, 26),
+                                          date(2017, 1, 2),
+                                          date(2017, 1, 9)])
+        self.assertEqual(totals.tolist(), [[3600, 7200, 1800], [0, 600, 0]])
+
+    def test_working_time_ratios_match_working_time_ratio_series(self):
+        stats = team_stats()
+        ratios = stats.working_time_ratios()
+        series = working_time_ratio_series(self.alice)
+        np.testing.assert_allclose(ratios[0][stats.recorded[0]], series.values)
+        self.assertTrue(np.isnan(ratios[0][2]))
+        # bob has only one summary.
+        self.assertTrue(np.isnan(ratios[1]).all())
@@ -0,0 +1,88 @@
+from datetime import date, datetime, timedelta
+import unittest
+
+import pytz
+
+from timekeeper.timezones import (get_offset_table, get_timezone, local_date,
+                                  local_day_range, to_local, utc_offset,
+                                  utc_offset_ranges)
+
+
+def utc_datetimes(start, end, step=timedelta(minutes=97)):
+    utc_datetime = start
+    while utc_datetime < end:
+        yield utc_datetime
+        utc_datetime += step
+
+
+class TestTimezones(unittest.TestCase):
+    timezone_ids = ['US/Eastern', 'Europe/London', 'Asia/Tokyo',
+                    'Australia/Lord_Howe', 'UTC', 'Etc/GMT+5']
+
+    def test_get_timezone_is_cached(self):
+        self.assertIs(get_timezone('Asia/Tokyo'), get_timezone('Asia/Tokyo'))
+        with self.assertRaises(pytz.UnknownTimeZoneError):
+            get_timezone('Asia/Nowhere')
+
+    def test_offset_table_merges_same_offsets(self):
+        table = get_offset_table('US/Eastern')
+        self.assertEqual(table.transition_times[0], datetime.min)
+        self.assertEqual(len(table.transition_times), len(table.offsets))
+        for previous, offset in zip(table.offsets, table.offsets[1:]):
+            self.assertNotEqual(previous, offset)
+
+    def test_to_local_matches_pytz_across_years(self):
+        for timezone_id in self.timezone_ids:
+            tz = pytz.timezone(timezone_id)
+            for utc_datetime in utc_datetimes(datetime(2014, 1, 1),
+                                              datetime(2019, 1, 1)):
+                expected = (pytz.utc.localize(utc_datetime)
+                            .astimezone(tz)
+                            .replace(tzinfo=None))
+                self.assertEqual(to_local(timezone_id, utc_datetime), expected,
+                                 (timezone_id, utc_datetime))
+                self.assertEqual(local_date(timezone_id, utc_datetime),
+                                 expected.date())
+
+    def test_utc_offset_around_transitions(self):
+        # US/Eastern switched to EDT at 2017-03-12 07:00 UTC
+        # and back to EST at 2017-11-05 06:00 UTC.
+        self.assertEqual(
+            utc_offset('US/Eastern', datetime(2017, 3, 12, 6, 59)),
+            timedelta(hours=-5))
+        self.assertEqual(utc_offset('US/Eastern', datetime(2017, 3, 12, 7)),
+                         timedelta(hours=-4))
+        self.assertEqual(
+            utc_offset('US/Eastern', datetime(2017, 11, 5, 5, 59)),
+            timedelta(hours=-4))
+        self.assertEqual(utc_offset('US/Eastern', datetime(2017, 11, 5, 6)),
+                         timedelta(hours=-5))
+
+    def test_local_day_range_contains_the_day(self):
+        for timezone_id in self.timezone_ids:
+            day = date(2014, 1, 1)
+            while day < date(2019, 1, 1):
+                started_at, finished_at = local_day_range(timezone_id, day)
+                self.assertEqual(local_date(timezone_id, started_at), day)
+                last_moment = finished_at - timedelta(microseconds=1)
+                self.assertEqual(local_date(timezone_id, last_moment), day)
+                self.assertEqual(local_date(timezone_id, finished_at),
+                                 day + timedelta(days=1))
+                day += timedelta(days=1)
+
+    def test_local_day_range_on_dst_days(self):
+        self.assertEqual(local_day_range('US/Eastern', date(2017, 3, 12)),
+                         (datetime(2017, 3, 12, 5), datetime(2017, 3, 13, 4)))
+        self.assertEqual(local_day_range('Europe/London', date(2017, 10, 29)),
+                         (datetime(2017, 10, 28, 23), datetime(2017, 10, 30)))
+
+    def test_utc_offset_ranges(self):
+        ranges = utc_offset_ranges('Europe/London', datetime(2017, 1, 1),
+                                   datetime(2017, 12, 31))
+        self.assertEqual(ranges, [(None, 0),
+                                  (datetime(2017, 3, 26, 1), 3600),
+                                  (datetime(2017, 10, 29, 1), 0)])
+        self.assertEqual(utc_offset_ranges('Asia/Tokyo', datetime(2017, 1, 1),
+                                           datetime(2017, 12, 31)),
+                         [(None, 32400)])
+        self.assertEqual(utc_offset_ranges('UTC'), [(None, 0)])
@@ -0,0 +1,96 @@
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from io import StringIO
+import json
+import unittest
+from unittest.mock import patch
+
+from peewee import SqliteDatabase
+
+from timekeeper.models import Attendance, DailyAttendance, User
+from timekeeper.transfer import export_data, import_data
+
+MODELS = [User, Attendance, DailyAttendance]
+
+
+class TestTransfer(unittest.TestCase):
+    def setUp(self):
+        self.source = SqliteDatabase(':memory:')
+        self.destination = SqliteDatabase(':memory:')
+        for database in (self.source, self.destination):
+            database.connect()
+            with self.use_database(database):
+                database.create_tables(MODELS)
+        with self.use_database(self.source):
+            self.user = User.create(id='id', name='name', trackable=True,
+                                    timezone_id='Asia/Tokyo')
+            User.create(id='other_id', name=None)
+            started_at = datetime(2017, 1, 1, 9)
+            for days in range(20):
+                Attendance.create(
+                    started_at=started_at + timedelta(days=days),
+                    finished_at=started_at + timedelta(days=days, hours=8),
+                    user=self.user)
+            attendance = Attendance.create(started_at=datetime(2017, 2, 1, 9),
+                                           user=self.user)
+            self.user.open_attendance_id = attendance.id
+            self.user.save()
+
+    def tearDown(self):
+        self.source.close()
+        self.destination.close()
+
+    @contextmanager
+    def use_database(self, database):
+        with patch.object(User._meta, 'database', database), \
+                patch.object(Attendance._meta, 'database', database), \
+                patch.object(DailyAttendance._meta, 'database', database):
+            yield
+
+    def dump(self, database):
+        with database.transaction():
+            return {model: list(model.select()
+                                .order_by(model._meta.primary_key)
+                                .tuples())
+                    for model in (User, Attendance)}
+
+    def test_export_and_import_round_trip(self):
+        f = StringIO()
+        with self.use_database(self.source):
+            self.assertEqual(export_data(f), 23)
+            expected = self.dump(self.source)
+        lines = f.getvalue().splitlines()
+        self.assertEqual(json.loads(lines[0])['table'], 'user')
+        self.assertEqual(len(lines), 25)
+        f.seek(0)
+        with self.use_database(self.destination):
+            self.assertEqual(import_data(f, batch_size=7), 23)
+            self.assertEqual(self.dump(self.destination), expected)
+            self.assertEqual(DailyAttendance.select().count(), 20)
+            self.assertEqual(DailyAttendance.select()
+                             .order_by(DailyAttendance.date).first().date,
+                             date(2017, 1, 1))
+            user = User.get(User.id == 'id')
+            self.assertIsNone(user.open_attendance().finished_at)
+
+    def test_import_is_atomic(self):
+        f = StringIO()
+        with self.use_database(self.source):
+            export_data(f)
+        f.write('["broken"]\n')
+        f.seek(0)
+        with self.use_database(self.destination):
+            with self.assertRaises(Exception):
+                import_data(f)
+            self.assertFalse(User.select().exists())
+            self.assertFalse(Attendance.select().exists())
+
+    def test_import_rejects_row_without_header(self):
+        with self.use_database(self.destination):
+            with self.assertRaises(ValueError):
+                import_data(StringIO('["id"]\n'))
+            with self.assertRaises(ValueError):
+                import_data(StringIO('{"table": "unknown", "columns": []}\n'))
+            with self.assertRaises(ValueError):
+                import_data(
+                    StringIO('{"table": "user", "columns": ["unknown"]}\n'))
@@ -0,0 +1,100 @@
+from datetime import datetime
+import os
+import signal
+import time
+import unittest
+from unittest.mock import MagicMock, call, patch
+
+from peewee import SqliteDatabase
+
+from timekeeper.models import Attendance, DailyAttendance, User
+from timekeeper.plugins.utils import create_temp_dir
+from timekeeper.writer import (AttendanceEvent, AttendanceWriter,
+                               FINISH_WORKING, START_WORKING)
+
+
+class TestAttendanceWriter(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir_context = create_temp_dir()
+        temp_dir = self.temp_dir_context.__enter__()
+        # Use a file because the writer connects from another thread.
+        self.database = SqliteDatabase(os.path.join(temp_dir, 'db.sqlite3'))
+        self.patchers = []
+        self.patchers.append(
+            patch.object(User._meta, 'database', self.database))
+        self.patchers.append(
+            patch.object(Attendance._meta, 'database', self.database))
+        self.patchers.append(
+            patch.object(DailyAttendance._meta, 'database', self.database))
+        for patcher in self.patchers:
+            patcher.start()
+        self.database.create_tables(
+            [Attendance, DailyAttendance, User], safe=True)
+        self.user = User.create(id='id', name='name', trackable=True)
+        self.database.close()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        self.temp_dir_context.__exit__(None, None, None)
+
+    def test_stop_writes_queued_events(self):
+        on_applied = MagicMock()
+        callback = MagicMock()
+        writer = AttendanceWriter(batch_size=2, on_applied=on_applied)
+        events = [
+            AttendanceEvent(START_WORKING, 'id', datetime(2017, 1, 1, 9)),
+            AttendanceEvent(FINISH_WORKING, 'id', datetime(2017, 1, 1, 12)),
+            AttendanceEvent(START_WORKING, 'id', datetime(2017, 1, 1, 13)),
+            AttendanceEvent(START_WORKING, 'id', datetime(2017, 1, 1, 14)),
+        ]
+        for event in events:
+            writer.submit(event, callback=callback)
+        writer.start()
+        writer.stop()
+        self.assertEqual(writer.qsize(), 0)
+        on_applied.assert_has_calls([call(event) for event in events])
+        self.assertEqual([is_inconsistent for (_, is_inconsistent), _
+                          in callback.call_args_list],
+                         [False, False, False, True])
+        attendances = list(Attendance.select().order_by(Attendance.id))
+        self.assertEqual(len(attendances), 3)
+        self.assertTrue(attendances[0].is_complete)
+        user = User.get(User.id == 'id')
+        self.assertEqual(user.open_attendance_id, attendances[-1].id)
+        self.assertEqual(DailyAttendance.select().count(), 1)
+
+    def test_failing_event_does_not_discard_batch(self):
+        callback = MagicMock()
+        writer = AttendanceWriter(batch_size=10)
+        writer.submit(AttendanceEvent(START_WORKING, 'nonexistent',
+                                      datetime(2017, 1, 1, 9)),
+                      callback=callback)
+        writer.submit(AttendanceEvent(START_WORKING, 'id',
+                                      datetime(2017, 1, 1, 9)),
+                      callback=callback)
+        with self.assertLogs('timekeeper.writer', level='ERROR'):
+            writer.start()
+            writer.stop()
+        self.assertEqual(callback.call_count, 1)
+        self.assertEqual(Attendance.select().count(), 1)
+
+    def test_stop_on_signal_writes_queued_events_and_exits(self):
+        self.addCleanup(signal.signal, signal.SIGTERM,
+                        signal.getsignal(signal.SIGTERM))
+        writer = AttendanceWriter()
+        writer.submit(AttendanceEvent(START_WORKING, 'id',
+                                      datetime(2017, 1, 1, 9)))
+        writer.stop_on_signal()
+        writer.start()
+        with self.assertRaises(SystemExit) as cm:
+            os.kill(os.getpid(), signal.SIGTERM)
+            # The handler runs in the main thread as soon as it checks.
+            time.sleep(5)
+        self.assertEqual(cm.exception.code, 128 + signal.SIGTERM)
+        self.assertEqual(writer.qsize(), 0)
+        self.assertEqual(Attendance.select().count(), 1)
+
+    def test_apply_raises_value_error_with_unknown_kind(self):
+        event = AttendanceEvent('unknown', 'id', datetime(2017, 1, 1))
+        self.assertRaises(ValueError, event.apply, self.user)
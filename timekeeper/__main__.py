@@ -0,0 +1,123 @@
+"""
+Maintenance commands for the timekeeper database.
+
+Run `python -m timekeeper --help` for usage.
+"""
+
+import argparse
+import logging
+
+from timekeeper.database import connection, setup_db
+
+
+def rebuild_daily_attendances(args):
+    from timekeeper.models import DailyAttendance
+    logging.info('Rebuilding daily attendances.')
+    DailyAttendance.rebuild()
+    logging.info('Rebuilt %d daily attendances.',
+                 DailyAttendance.select().count())
+
+
+def export_data(args):
+    from timekeeper.transfer import export_data
+    with args.file as f:
+        count = export_data(f)
+    logging.info('Exported %d rows.', count)
+
+
+def import_data(args):
+    from timekeeper.transfer import import_data
+    with args.file as f:
+        count = import_data(f)
+    logging.info('Imported %d rows.', count)
+
+
+def archive_attendances(args):
+    from timekeeper.archive import archive_attendances
+    if args.file is None:
+        count = archive_attendances(args.horizon_days)
+    else:
+        with args.file as f:
+            count = archive_attendances(args.horizon_days, f)
+    logging.info('Archived %d attendances.', count)
+
+
+def run_job_workers(args):
+    from timekeeper.cluster import start_job_workers
+    workers = start_job_workers(args.threads)
+    logging.info('Started %d job workers.', len(workers))
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.join()
+
+
+def run_nightly_tasks(args):
+    from timekeeper.plugins.reports import run_nightly_tasks
+    closed_count, prepared_count = run_nightly_tasks()
+    logging.info('Closed %d attendances and prepared reports of %d users.',
+                 closed_count, prepared_count)
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog='python -m timekeeper',
+                                     description=__doc__.strip().split('\n')[0])
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    rebuild_parser = subparsers.add_parser(
+        'rebuild-daily',
+        help='recompute the daily_attendance table from attendances')
+    rebuild_parser.set_defaults(func=rebuild_daily_attendances)
+
+    export_parser = subparsers.add_parser(
+        'export', help='dump users and attendances as JSON lines')
+    export_parser.add_argument('file', nargs='?', default='-',
+                               type=argparse.FileType('w'),
+                               help='a file to write, or - for stdout')
+    export_parser.set_defaults(func=export_data)
+
+    import_parser = subparsers.add_parser(
+        'import', help='load users and attendances dumped by export')
+    import_parser.add_argument('file', nargs='?', default='-',
+                               type=argparse.FileType('r'),
+                               help='a file to read, or - for stdin')
+    import_parser.set_defaults(func=import_data)
+
+    archive_parser = subparsers.add_parser(
+        'archive',
+        help='fold old attendances into archived daily summaries')
+    archive_parser.add_argument('--horizon-days', type=int,
+                                help='days of attendances to keep, which '
+                                     'defaults to TIMEKEEPER_ARCHIVE_HORIZON_DAYS')
+    archive_parser.add_argument('--file', type=argparse.FileType('a'),
+                                help='a file to append archived attendances')
+    archive_parser.set_defaults(func=archive_attendances)
+
+    worker_parser = subparsers.add_parser(
+        'worker', help='run queued timesheets and contributions in cluster mode')
+    worker_parser.add_argument('--threads', type=int, default=1,
+                               help='the number of jobs to run at once')
+    worker_parser.set_defaults(func=run_job_workers)
+
+    nightly_parser = subparsers.add_parser(
+        'nightly',
+        help='close attendances left open and prepare reports now')
+    nightly_parser.set_defaults(func=run_nightly_tasks)
+    return parser
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    args = create_parser().parse_args(argv)
+    setup_db()
+    with connection():
+        args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Archival of old attendances.
+
+Attendances started before a horizon are folded into archived daily
+summaries and deleted, so the attendance table keeps only recent history
+while the daily timesheet and contributions, which read daily summaries,
+stay the same. Deleted attendances can be appended to a file in the format
+of :mod:`timekeeper.transfer` to import them again later.
+"""
+
+from datetime import datetime, timedelta
+import logging
+
+from slackbot import settings
+
+from timekeeper.database import write_transaction
+from timekeeper.models import Attendance, DailyAttendance, User
+from timekeeper.timezones import local_date, local_day_range
+from timekeeper.transfer import export_table
+
+logger = logging.getLogger(__name__)
+
+
+def archive_attendances(horizon_days=None, f=None):
+    """
+    Archives attendances of all users older than the horizon.
+
+    :param horizon_days: the number of days to keep in the attendance table,
+                         which defaults to TIMEKEEPER_ARCHIVE_HORIZON_DAYS
+    :param f: a text file to append archived attendances, or None
+    :return: the number of archived attendances
+    """
+    if horizon_days is None:
+        horizon_days = settings.TIMEKEEPER_ARCHIVE_HORIZON_DAYS
+    now = datetime.utcnow()
+    total = 0
+    for user in User.select():
+        date = local_date(user.timezone_id, now) - timedelta(days=horizon_days)
+        total += archive_user(user, date, f)
+    return total
+
+
+def archive_user(user, date, f=None):
+    """
+    Archives attendances of the user started before the date.
+
+    Days since the unfinished attendance, if any, are kept so that archived
+    days never change. Attendances which have only a start or a finish are
+    archived by whichever they have.
+
+    :param user: a User object
+    :param date: a date in the timezone of the user, which is exclusive
+    :param f: a text file to append archived attendances, or None
+    :return: the number of archived attendances
+    """
+    with write_transaction(Attendance._meta.database):
+        user = User.get(User.id == user.id)
+        open_attendance = user.open_attendance()
+        if open_attendance is not None:
+            date = min(date, local_date(user.timezone_id,
+                                        open_attendance.started_at))
+        cutoff, _ = local_day_range(user.timezone_id, date)
+        where = ((Attendance.user == user) &
+                 ((Attendance.started_at < cutoff) |
+                  (Attendance.started_at.is_null() &
+                   (Attendance.finished_at < cutoff))))
+        if not Attendance.select().where(where).exists():
+            return 0
+        if f is not None:
+            export_table(f, Attendance, where)
+        days = DailyAttendance.archive(user, date)
+        count = Attendance.delete().where(where).execute()
+    logger.info('Archived %d attendances of %s into %d days before %s.',
+                count, user.id, days, date)
+    return count
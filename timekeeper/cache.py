@@ -0,0 +1,163 @@
+from collections import OrderedDict, namedtuple
+from hashlib import sha1
+import os
+from shutil import copyfile
+from tempfile import mkstemp
+from threading import RLock
+import time
+
+CacheInfo = namedtuple('CacheInfo',
+                       ['hits', 'misses', 'maxsize', 'currsize', 'evictions'])
+
+
+class TTLCache(object):
+    """
+    A thread-safe LRU mapping whose entries expire after `ttl` seconds.
+
+    :param maxsize: the maximum number of entries
+    :param ttl: seconds to keep each entry
+    :param timer: a function returning the current time in seconds
+    """
+
+    def __init__(self, maxsize, ttl, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._timer = timer
+        self._entries = OrderedDict()
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires_at <= self._timer():
+                del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, self._timer() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def cache_info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize,
+                             len(self._entries), self.evictions)
+
+
+class FileCache(object):
+    """
+    A size-bounded cache of files in a directory.
+
+    Each entry has a name and a version given by arbitrary parts such as
+    timestamps. Only the latest version of a name is kept, and the least
+    recently used files are removed when the total size exceeds `max_bytes`.
+
+    :param directory: the path of the directory to store files
+    :param max_bytes: the maximum total size of the files
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = RLock()
+
+    def get(self, name, parts):
+        """
+        Returns the path of the cached file of the version or None.
+        """
+        path = self._get_path(name, parts)
+        with self._lock:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return path
+
+    def put(self, name, parts, source_path):
+        """
+        Copies the file into the cache, replacing older versions of the name.
+
+        :return: the path of the cached file
+        """
+        path = self._get_path(name, parts)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, temp_path = mkstemp(dir=self.directory, prefix='.')
+            os.close(fd)
+            copyfile(source_path, temp_path)
+            os.replace(temp_path, path)
+            self.invalidate(name, keep=path)
+            self._evict()
+        return path
+
+    def invalidate(self, name, keep=None):
+        """
+        Removes all versions of the name except `keep`.
+        """
+        prefix = name + '.'
+        with self._lock:
+            for entry in self._scan():
+                if entry.name.startswith(prefix) and entry.path != keep:
+                    os.unlink(entry.path)
+
+    def cache_info(self):
+        with self._lock:
+            entries = list(self._scan())
+            return CacheInfo(self.hits, self.misses, self.max_bytes,
+                             sum(entry.stat().st_size for entry in entries),
+                             self.evictions)
+
+    def _get_path(self, name, parts):
+        digest = sha1(repr(tuple(parts)).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, '{}.{}'.format(name, digest))
+
+    def _scan(self):
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return []
+        return [entry for entry in entries
+                if entry.is_file() and not entry.name.startswith('.')]
+
+    def _evict(self):
+        entries = sorted(self._scan(), key=lambda entry: entry.stat().st_mtime)
+        total_bytes = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            total_bytes -= entry.stat().st_size
+            os.unlink(entry.path)
+            self.evictions += 1
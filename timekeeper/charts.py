@@ -0,0 +1,42 @@
+"""
+Charts rendered with the object-oriented matplotlib API.
+
+Functions in this module do not touch the global pyplot state, so they are
+safe to call from threads and worker processes. The plotting stack is
+imported on first use to keep importing this module cheap.
+"""
+
+
+def warm_up():
+    """
+    Imports the plotting stack ahead of the first chart.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import calmap  # noqa
+    from matplotlib.backends.backend_agg import FigureCanvasAgg  # noqa
+
+
+def render_contribution_figure(series):
+    warm_up()
+    import calmap
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(8, 2), dpi=72)
+    FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1])
+    calmap.yearplot(series, ax=ax)
+    return fig
+
+
+def save_contribution_figure(series, path):
+    """
+    Renders the contribution figure of the series into a PNG file.
+
+    :param series: a WorkingTimeSeries object
+    :return: the path
+    """
+    figure = render_contribution_figure(series.to_pandas())
+    figure.savefig(path)
+    return path
@@ -0,0 +1,250 @@
+"""
+Running several bot processes against one database.
+
+The process which holds the lease of the Slack connection runs the bot and
+renews the lease as a heartbeat, while the others wait to take it over when
+it expires. Handlers marked with
+:func:`timekeeper.plugins.decorators.offloaded` are queued in the job table
+by the bot, and run by job workers in any process, including ones started by
+`python -m timekeeper worker`.
+
+Processes on several hosts need a shared database such as MySQL, and ones
+on a host can share a SQLite database as well.
+"""
+
+from datetime import datetime
+import logging
+import os
+import socket
+from threading import Event, Thread
+import time
+import traceback
+
+from slackbot import settings
+from slackbot.dispatcher import Message
+from slackbot.slackclient import Channel, SlackClient
+
+from timekeeper.database import connection
+from timekeeper.metrics import registry
+from timekeeper.models import Job, Lease
+
+logger = logging.getLogger(__name__)
+
+SLACK_CONNECTION_LEASE = 'slack-connection'
+
+
+def worker_id():
+    """
+    Returns a name which identifies the current process in the cluster.
+    """
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+class LeaseKeeper(object):
+    """
+    Acquires a lease and renews it in a background thread.
+
+    :param name: the name of the lease
+    :param holder: a name of the current process
+    :param ttl: seconds until the lease expires unless renewed
+    :param on_lost: a function called in the thread when the lease is lost,
+                    which happens when another process takes it or it is not
+                    renewed before expiry, e.g. because the database is down
+    """
+
+    def __init__(self, name, holder, ttl, on_lost=None):
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        self.on_lost = on_lost
+        self.expires_at = None
+        self._stopped = Event()
+        self._thread = None
+
+    def try_acquire(self):
+        """
+        Acquires or renews the lease once.
+
+        :return: whether the current process holds the lease
+        """
+        with connection(Lease._meta.database):
+            self.expires_at = Lease.acquire(self.name, self.holder, self.ttl)
+        return self.expires_at is not None
+
+    def wait(self, interval=None):
+        """
+        Blocks until the lease is acquired, then starts renewing it.
+
+        :param interval: seconds between attempts, which defaults to a third
+                         of the time to live
+        """
+        if interval is None:
+            interval = self.ttl / 3
+        while not self.try_acquire():
+            time.sleep(interval)
+        self._stopped.clear()
+        self._thread = Thread(target=self._renew, name='timekeeper-lease',
+                              daemon=True)
+        self._thread.start()
+
+    def release(self):
+        """
+        Stops renewing the lease and gives it up.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with connection(Lease._meta.database):
+            Lease.release(self.name, self.holder)
+        self.expires_at = None
+
+    def _renew(self):
+        while not self._stopped.wait(self.ttl / 3):
+            try:
+                if self.try_acquire():
+                    continue
+            except Exception:
+                logger.exception('Failed to renew the lease %s.', self.name)
+                if datetime.utcnow() < self.expires_at:
+                    continue
+            logger.error('Lost the lease %s.', self.name)
+            if self.on_lost is not None:
+                self.on_lost()
+            return
+
+
+class WebAPIMessage(Message):
+    """
+    A Message which replies through the Web API, for job workers which are
+    not connected to the RTM API.
+    """
+
+    def send(self, text, thread_ts=None):
+        self._client.webapi.chat.post_message(self._body['channel'], text,
+                                              as_user=True,
+                                              thread_ts=thread_ts)
+
+    @property
+    def channel(self):
+        return Channel(self._client, {'id': self._body['channel']})
+
+
+class JobWorker(object):
+    """
+    Claims jobs from the job table and runs them on a thread.
+
+    :param client: a SlackClient, which does not have to be connected
+    :param handlers: a dict from kinds of jobs to handlers
+    :param name: a name of the worker
+    :param timeout: seconds until another worker may claim a running job
+    :param poll_interval: seconds to wait when there are no jobs
+    """
+
+    def __init__(self, client, handlers, name, timeout=300, poll_interval=1):
+        self.client = client
+        self.handlers = handlers
+        self.name = name
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._stopped = Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = Thread(target=self.run, name='timekeeper-' + self.name,
+                              daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops after the running job.
+        """
+        self._stopped.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                has_run = self.run_once()
+            except Exception:
+                logger.exception('Failed to claim a job.')
+                has_run = False
+            if not has_run:
+                self._stopped.wait(self.poll_interval)
+
+    def run_once(self):
+        """
+        Runs a job if any.
+
+        :return: whether a job was run
+        """
+        with connection(Job._meta.database):
+            job = Job.claim(self.name, self.timeout)
+        if job is None:
+            return False
+        registry.observe('timekeeper_job_wait_seconds',
+                         (datetime.utcnow() - job.created_at).total_seconds(),
+                         kind=job.kind)
+        data = job.data
+        message = WebAPIMessage(self.client, data['body'])
+        status = 'error'
+        try:
+            handler = self.handlers.get(job.kind)
+            if handler is None:
+                raise LookupError('Unknown kind of job {!r}.'.format(job.kind))
+            handler(message, *data['args'])
+            status = 'ok'
+        except Exception:
+            logger.exception('Failed to run job %d of %s.', job.id, job.kind)
+            with connection(Job._meta.database):
+                job.fail(traceback.format_exc())
+            try:
+                message.reply('I had a problem handling "{}"'.format(
+                    data['body'].get('text')))
+            except Exception:
+                logger.exception('Failed to report the failure of job %d.',
+                                 job.id)
+        else:
+            with connection(Job._meta.database):
+                job.complete()
+        finally:
+            registry.increment('timekeeper_jobs_total', kind=job.kind,
+                               status=status)
+        return True
+
+
+def start_job_workers(count, client=None):
+    """
+    Starts job workers which run offloaded handlers of timekeeper.plugins.
+
+    Only the handlers are loaded, not the services started by the bot, so
+    that workers can run next to it.
+
+    :param count: the number of workers
+    :param client: a SlackClient to upload files and reply, which defaults
+                   to one with SLACK_API_TOKEN
+    :return: a list of started JobWorker objects
+    """
+    import timekeeper.plugins  # registers handlers
+    from timekeeper.plugins.decorators import offloaded_handlers
+
+    # Uploads and replies of jobs are rate limited like those of the bot.
+    timekeeper.plugins.slack_api.install()
+
+    if client is None:
+        client = SlackClient(settings.API_TOKEN,
+                             timeout=getattr(settings, 'TIMEOUT', None),
+                             connect=False)
+    workers = []
+    for i in range(count):
+        worker = JobWorker(client, offloaded_handlers,
+                           '{}:job-worker-{}'.format(worker_id(), i),
+                           timeout=settings.TIMEKEEPER_CLUSTER_JOB_TIMEOUT,
+                           poll_interval=settings.TIMEKEEPER_CLUSTER_POLL_INTERVAL)
+        worker.start()
+        workers.append(worker)
+    return workers
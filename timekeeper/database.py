@@ -1,6 +1,10 @@
-from peewee import OperationalError, SqliteDatabase
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from peewee import SqliteDatabase
 from playhouse.db_url import connect
-from playhouse.migrate import SqliteMigrator, migrate
+from playhouse.migrate import SchemaMigrator, migrate
+from playhouse.pool import PooledDatabase
 from slackbot import settings
 
 _db = None
@@ -9,19 +13,160 @@ _db = None
 def get_db():
     global _db
     if _db is None:
-        _db = connect(settings.TIMEKEEPER_DATABASE_URI)
+        _db = create_db(settings.TIMEKEEPER_DATABASE_URI)
     return _db
 
 
+def create_db(uri):
+    """
+    Creates a database from the URI.
+
+    SQLite databases are tuned with TIMEKEEPER_SQLITE_PRAGMAS, which are
+    applied to every new connection.
+    """
+    connect_params = {}
+    if urlparse(uri).scheme.startswith('sqlite'):
+        connect_params['pragmas'] = list(settings.TIMEKEEPER_SQLITE_PRAGMAS)
+    return connect(uri, **connect_params)
+
+
+@contextmanager
+def connection(db=None):
+    """
+    Holds a connection of the current thread during the block.
+
+    The connection is closed, or returned to the pool in pooled mode, on exit
+    unless it was already open, so it can be nested safely. Wrap each unit of
+    work such as handling a message with it to avoid keeping connections
+    which the server may have timed out.
+    """
+    if db is None:
+        db = get_db()
+    is_opened = db.is_closed()
+    if is_opened:
+        db.connect()
+    try:
+        yield db
+    finally:
+        if is_opened and not db.is_closed():
+            db.close()
+
+
+def write_transaction(db=None):
+    """
+    Returns a context manager of a transaction which writes to the database.
+
+    On SQLite the write lock is taken up front, so concurrent writers wait
+    for busy_timeout instead of failing to upgrade their read locks.
+    """
+    if db is None:
+        db = get_db()
+    if isinstance(db, SqliteDatabase):
+        return db.atomic('IMMEDIATE')
+    return db.atomic()
+
+
+def pool_stats(db=None):
+    """
+    Returns usage of the connection pool.
+
+    :return: a dict with `max_connections`, `in_use` and `available` keys,
+             or None if the database is not pooled
+    """
+    if db is None:
+        db = get_db()
+    if not isinstance(db, PooledDatabase):
+        return None
+    return {
+        'max_connections': db.max_connections,
+        'in_use': len(db._in_use),
+        'available': len(db._connections),
+    }
+
+
+def setup_db():
+    """
+    Connects to the database and brings its schema up to date.
+    """
+    from timekeeper.models import Attendance, DailyAttendance, Job, Lease, User
+    with connection() as db:
+        db.create_tables([User, Attendance, DailyAttendance, Lease, Job],
+                         safe=True)
+        migrate_db()
+
+
 def migrate_db():
+    from timekeeper.models import Attendance, DailyAttendance, User
+    added_columns = migrate_columns(User, [User.name, User.open_attendance_id])
+    if User.open_attendance_id.db_column in added_columns:
+        migrate_open_attendances()
+    migrate_indexes([Attendance])
+    migrate_daily_attendances()
+    migrate_columns(DailyAttendance, [DailyAttendance.archived])
+
+
+def migrate_columns(model, fields):
+    """
+    Adds columns of fields which are missing in the table of the model.
+
+    :param model: a Model class
+    :param fields: a list of Field objects of the model
+    :return: a list of added column names
+    """
+    db = model._meta.database
+    table = model._meta.db_table
+    existing_columns = {column.name for column in db.get_columns(table)}
+    added_fields = [field for field in fields
+                    if field.db_column not in existing_columns]
+    if added_fields:
+        migrator = SchemaMigrator.from_database(db)
+        with db.transaction():
+            migrate(*[migrator.add_column(table, field.db_column, field)
+                      for field in added_fields])
+    return [field.db_column for field in added_fields]
+
+
+def migrate_open_attendances():
+    """
+    Initializes User.open_attendance_id from the last attendance of each user.
+    """
+    from timekeeper.models import User
     db = get_db()
-    if isinstance(db, SqliteDatabase):
-        from timekeeper.models import User
-        migrator = SqliteMigrator(db)
-        try:
-            with db.transaction():
-                migrate(migrator.add_column('user', 'name', User.name))
-        except OperationalError as e:
-            message, *_ = e.args
-            if 'duplicate column name: name' not in message:
-                raise
+    with db.transaction():
+        for user in User.select():
+            attendance = user.last_attendance()
+            if attendance and not attendance.finished_at:
+                user.open_attendance_id = attendance.id
+                user.save(only=[User.open_attendance_id])
+
+
+def migrate_indexes(models):
+    """
+    Creates indexes declared in `Meta.indexes` which are missing in the
+    database, e.g. because the table was created by an older version.
+
+    :param models: a list of Model classes
+    """
+    for model in models:
+        db = model._meta.database
+        table = model._meta.db_table
+        existing_columns = {tuple(index.columns)
+                            for index in db.get_indexes(table)}
+        for field_names, unique in model._meta.indexes:
+            fields = [model._meta.fields[name] for name in field_names]
+            columns = tuple(field.db_column for field in fields)
+            if columns not in existing_columns:
+                db.create_index(model, fields, unique=unique)
+
+
+def migrate_daily_attendances():
+    """
+    Replaces the legacy `dailyattendance` view with the materialized
+    `daily_attendance` table, backfilling it on the first run.
+    """
+    from timekeeper.models import Attendance, DailyAttendance
+    db = get_db()
+    with db.transaction():
+        db.execute_sql('drop view if exists dailyattendance')
+        if not DailyAttendance.select().exists() and Attendance.select().exists():
+            DailyAttendance.rebuild()
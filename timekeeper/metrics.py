@@ -0,0 +1,451 @@
+"""
+In-process metrics of handlers, SQL queries, Slack Web API calls, uploads
+and rendering, which can be dumped in the Prometheus text format.
+
+Handlers are measured by wrapping them with :func:`instrumented`, and SQL
+queries and Web API calls by hooking peewee and slacker with
+:func:`instrument_database` and :func:`instrument_slack_api`. Caches are
+read when metrics are read, after :func:`instrument_cache`.
+"""
+
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import os
+import sys
+from threading import Lock, Thread, Event, get_ident, local
+import time
+
+from timekeeper.database import pool_stats
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    """
+    Counts observed values in cumulative buckets like Prometheus does.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.bucket_counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Returns the upper bound of the bucket where the quantile falls in,
+        or the maximum if it is beyond the last bucket.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative_count = 0
+        for bound, count in zip(self.buckets, self.bucket_counts):
+            cumulative_count += count
+            if cumulative_count >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Registry:
+    """
+    A thread-safe collection of counters, gauges and histograms with labels.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._families = {}
+        self._collectors = []
+
+    def describe(self, name, kind, help_text, buckets=None):
+        """
+        Declares a metric.
+
+        :param kind: 'counter', 'gauge' or 'histogram'
+        :param buckets: upper bounds of buckets of a histogram
+        """
+        with self._lock:
+            self._families[name] = (kind, help_text, buckets, {})
+
+    def increment(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            samples = self._families[name][3]
+            samples[key] = samples.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        """
+        Sets the value of a gauge, or of a counter kept by someone else.
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._families[name][3][key] = value
+
+    def add_collector(self, collector):
+        """
+        Registers a function to call with no arguments before metrics are
+        read, which updates metrics kept elsewhere with :meth:`set`.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            _, _, buckets, samples = self._families[name]
+            histogram = samples.get(key)
+            if histogram is None:
+                histogram = samples[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Observes seconds spent in the block.
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started_at, **labels)
+
+    def samples(self, name):
+        """
+        Returns a copy of values of the metric.
+
+        :return: a dict from tuples of label pairs to numbers for a counter,
+                 or Histogram objects for a histogram
+        """
+        self._collect()
+        with self._lock:
+            samples = self._families[name][3]
+            return {key: _copy_sample(value) for key, value in samples.items()}
+
+    def clear(self):
+        with self._lock:
+            for _, _, _, samples in self._families.values():
+                samples.clear()
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        self._collect()
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, _, samples) in sorted(self._families.items()):
+                lines.append('# HELP {} {}'.format(name, help_text))
+                lines.append('# TYPE {} {}'.format(name, kind))
+                for key, sample in sorted(samples.items()):
+                    if kind != 'histogram':
+                        lines.append(_render_sample(name, key, sample))
+                        continue
+                    cumulative_count = 0
+                    for bound, count in zip(sample.buckets + ('+Inf',),
+                                            sample.bucket_counts):
+                        cumulative_count += count
+                        lines.append(_render_sample(
+                            name + '_bucket', key + (('le', bound),),
+                            cumulative_count))
+                    lines.append(_render_sample(name + '_sum', key, sample.sum))
+                    lines.append(_render_sample(name + '_count', key, sample.count))
+        return '\n'.join(lines) + '\n'
+
+    def _collect(self):
+        with self._lock:
+            collectors = list(self._collectors)
+        for collector in collectors:
+            collector()
+
+
+def _copy_sample(sample):
+    if not isinstance(sample, Histogram):
+        return sample
+    histogram = Histogram(sample.buckets)
+    histogram.__dict__.update(sample.__dict__,
+                              bucket_counts=list(sample.bucket_counts))
+    return histogram
+
+
+def _render_sample(name, key, value):
+    if key:
+        labels = ','.join('{}="{}"'.format(label, _escape(label_value))
+                          for label, label_value in key)
+        name = '{}{{{}}}'.format(name, labels)
+    return '{} {}'.format(name, value)
+
+
+def _escape(value):
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+registry = Registry()
+registry.describe('timekeeper_handler_requests_total', 'counter',
+                  'Messages handled by each handler.')
+registry.describe('timekeeper_handler_seconds', 'histogram',
+                  'Time to handle a message.', SECONDS_BUCKETS)
+registry.describe('timekeeper_handler_queries', 'histogram',
+                  'SQL queries executed to handle a message.', COUNT_BUCKETS)
+registry.describe('timekeeper_handler_sql_seconds', 'histogram',
+                  'Time spent in SQL queries to handle a message.',
+                  SECONDS_BUCKETS)
+registry.describe('timekeeper_sql_seconds', 'histogram',
+                  'Time to execute an SQL query.', SECONDS_BUCKETS)
+registry.describe('timekeeper_slack_api_requests_total', 'counter',
+                  'Calls of the Slack Web API.')
+registry.describe('timekeeper_slack_api_seconds', 'histogram',
+                  'Time to call the Slack Web API.', SECONDS_BUCKETS)
+registry.describe('timekeeper_slack_api_throttled_seconds', 'histogram',
+                  'Time to wait for the rate limit of a Slack Web API method.',
+                  SECONDS_BUCKETS)
+registry.describe('timekeeper_slack_api_rate_limited_total', 'counter',
+                  'Responses of HTTP 429 from the Slack Web API.')
+registry.describe('timekeeper_slack_outbox_calls_total', 'counter',
+                  'Calls made, retried, coalesced or dropped by the outbox.')
+registry.describe('timekeeper_upload_bytes', 'histogram',
+                  'Size of uploaded files.', BYTES_BUCKETS)
+registry.describe('timekeeper_render_seconds', 'histogram',
+                  'Time to render a figure including waiting for a worker.',
+                  SECONDS_BUCKETS)
+registry.describe('timekeeper_runtime_queue_seconds', 'histogram',
+                  'Time for a message to wait for a thread in the asyncio runtime.',
+                  SECONDS_BUCKETS)
+registry.describe('timekeeper_runtime_declined_total', 'counter',
+                  'Messages declined because the queue of the asyncio runtime was full.')
+registry.describe('timekeeper_jobs_total', 'counter',
+                  'Jobs run by job workers in cluster mode.')
+registry.describe('timekeeper_job_wait_seconds', 'histogram',
+                  'Time from queueing a job to claiming it.', SECONDS_BUCKETS)
+registry.describe('timekeeper_db_connections', 'gauge',
+                  'Connections of the database pool in use or available.')
+registry.describe('timekeeper_cache_hits_total', 'counter',
+                  'Lookups of each cache which found an entry.')
+registry.describe('timekeeper_cache_misses_total', 'counter',
+                  'Lookups of each cache which found no entry.')
+registry.describe('timekeeper_cache_evictions_total', 'counter',
+                  'Entries removed from each cache to make room.')
+
+_local = local()
+
+
+class _Request:
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0
+
+
+def instrumented(func):
+    """
+    Records the time and SQL queries of a handler.
+
+    Put it outside of `with_user` to include looking up the user.
+    """
+    handler = func.__name__
+
+    @wraps(func)
+    def decorated(*args, **kwargs):
+        previous_request = getattr(_local, 'request', None)
+        request = _local.request = _Request()
+        status = 'error'
+        started_at = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+            status = 'ok'
+            return result
+        finally:
+            elapsed = time.perf_counter() - started_at
+            _local.request = previous_request
+            registry.increment('timekeeper_handler_requests_total',
+                               handler=handler, status=status)
+            registry.observe('timekeeper_handler_seconds', elapsed,
+                             handler=handler)
+            registry.observe('timekeeper_handler_queries', request.queries,
+                             handler=handler)
+            registry.observe('timekeeper_handler_sql_seconds',
+                             request.sql_seconds, handler=handler)
+    return decorated
+
+
+def instrument_database(db):
+    """
+    Records the time of every SQL query executed on the database, and
+    attributes it to the handler running in the current thread.
+
+    The connections of a pooled database are exposed as gauges.
+    """
+    execute_sql = db.execute_sql
+    if getattr(execute_sql, 'is_instrumented', False):
+        return
+
+    @wraps(execute_sql)
+    def instrumented_execute_sql(*args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return execute_sql(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started_at
+            registry.observe('timekeeper_sql_seconds', elapsed)
+            request = getattr(_local, 'request', None)
+            if request is not None:
+                request.queries += 1
+                request.sql_seconds += elapsed
+
+    instrumented_execute_sql.is_instrumented = True
+    db.execute_sql = instrumented_execute_sql
+
+    def collect():
+        stats = pool_stats(db)
+        if stats is None:
+            return
+        for state in ('in_use', 'available'):
+            registry.set('timekeeper_db_connections', stats[state],
+                         state=state)
+
+    registry.add_collector(collect)
+
+
+def instrument_cache(cache, name):
+    """
+    Exposes hits, misses and evictions of a TTLCache or a FileCache as
+    counters labeled with the name.
+    """
+    def collect():
+        info = cache.cache_info()
+        registry.set('timekeeper_cache_hits_total', info.hits, cache=name)
+        registry.set('timekeeper_cache_misses_total', info.misses, cache=name)
+        registry.set('timekeeper_cache_evictions_total', info.evictions,
+                     cache=name)
+
+    registry.add_collector(collect)
+
+
+def instrument_slack_api():
+    """
+    Records the latency of every Slack Web API call made through slacker,
+    which slackbot uses for uploads, reactions and the user list.
+    """
+    import slacker
+
+    request = slacker.BaseAPI._request
+    if getattr(request, 'is_instrumented', False):
+        return
+
+    @wraps(request)
+    def instrumented_request(self, request_method, method, **kwargs):
+        status = 'error'
+        started_at = time.perf_counter()
+        try:
+            response = request(self, request_method, method, **kwargs)
+            status = 'ok'
+            return response
+        finally:
+            registry.increment('timekeeper_slack_api_requests_total',
+                               method=method, status=status)
+            registry.observe('timekeeper_slack_api_seconds',
+                             time.perf_counter() - started_at, method=method)
+
+    instrumented_request.is_instrumented = True
+    slacker.BaseAPI._request = instrumented_request
+
+
+def serve_metrics(port, host=''):
+    """
+    Serves `registry.render()` over HTTP in a daemon thread for Prometheus.
+
+    :return: the HTTPServer object
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer((host, port), MetricsHandler)
+    Thread(target=server.serve_forever, name='timekeeper-metrics',
+           daemon=True).start()
+    return server
+
+
+class SamplingProfiler:
+    """
+    Samples stacks of all other threads periodically while it is running.
+
+    The result is in the collapsed stack format, which flame graph tools
+    read, with one `frame;frame;frame count` line per distinct stack.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._lock = Lock()
+        self._stacks = Counter()
+        self._stopped = Event()
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._stacks = Counter()
+            self._stopped.clear()
+            self._thread = Thread(target=self._run,
+                                  name='timekeeper-profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """
+        Stops sampling.
+
+        :return: the collapsed stacks, or None if it was not running
+        """
+        with self._lock:
+            if self._thread is None:
+                return None
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+            return ''.join('{} {}\n'.format(stack, count)
+                           for stack, count in self._stacks.most_common())
+
+    def _run(self):
+        own_thread_id = get_ident()
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_thread_id:
+                    self._stacks[_collapse_stack(frame)] += 1
+
+
+def _collapse_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{}:{}'.format(os.path.basename(code.co_filename),
+                                    code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
@@ -1,12 +1,15 @@
 from datetime import datetime, timedelta
+import json
 
-from peewee import (BooleanField, CharField, CompositeKey, DateTimeField,
-                    ForeignKeyField, IntegerField, Model, MySQLDatabase,
-                    SqliteDatabase)
-import pytz
+from peewee import (BooleanField, CharField, CompositeKey, DateField,
+                    DateTimeField, ForeignKeyField, IntegerField,
+                    IntegrityError, Model, MySQLDatabase, SQL,
+                    SqliteDatabase, TextField, fn)
 from slackbot import settings
 
-from timekeeper.database import get_db
+from timekeeper.database import get_db, write_transaction
+from timekeeper.timezones import (get_timezone, local_date, local_day_range,
+                                  to_local, utc_offset_ranges)
 from timekeeper.utils import format_timedelta
 
 
@@ -23,6 +26,8 @@ class User(BaseModel):
     timezone_id = CharField(null=False,
                             default=settings.TIMEKEEPER_DEFAULT_TIMEZONE)
     trackable = BooleanField(default=False)
+    # Points to the unfinished Attendance to avoid sorting attendances.
+    open_attendance_id = IntegerField(null=True)
 
     def last_attendance(self):
         """
@@ -32,9 +37,114 @@ class User(BaseModel):
         """
         return self.attendances.order_by(Attendance.started_at.desc()).first()
 
+    def open_attendance(self):
+        """
+        Returns the unfinished attendance of the user.
+
+        :return: an Attendance object if the user is working else None
+        """
+        if self.open_attendance_id is None:
+            return None
+        return Attendance.select().where(Attendance.id == self.open_attendance_id).first()
+
+    def start_working(self, started_at):
+        """
+        Records that the user started working.
+
+        The open attendance is replaced only if it is empty in the database,
+        because this object may be cached and another process may have
+        changed it. This costs an insert and an update in one transaction,
+        and one more update if the user had left an unfinished attendance.
+
+        :param started_at: a datetime in UTC
+        :return: a tuple of the created Attendance object and whether
+                 the user had left an unfinished attendance
+        """
+        with write_transaction(self._meta.database):
+            attendance = Attendance.create(started_at=started_at, user=self)
+            has_unfinished_work = not (
+                User.update(open_attendance_id=attendance.id)
+                .where((User.id == self.id) &
+                       (User.open_attendance_id >> None))
+                .execute())
+            if has_unfinished_work:
+                self._set_open_attendance_id(attendance.id)
+        self.open_attendance_id = attendance.id
+        return attendance, has_unfinished_work
+
+    def finish_working(self, finished_at):
+        """
+        Records that the user finished working.
+
+        The open attendance is read again in the transaction, because this
+        object may be cached. Finishing it costs a read and two updates in
+        one transaction, plus a delete and an insert of the daily summary.
+
+        :param finished_at: a datetime in UTC
+        :return: a tuple of the finished Attendance object and whether
+                 the user had not started it
+        """
+        with write_transaction(self._meta.database):
+            attendance = (Attendance
+                          .select()
+                          .join(User, on=(User.open_attendance_id == Attendance.id))
+                          .where(User.id == self.id)
+                          .first())
+            has_unstarted_work = attendance is None
+            if has_unstarted_work:
+                attendance = Attendance.create(finished_at=finished_at,
+                                               user=self)
+            else:
+                attendance.finished_at = finished_at
+                attendance.save()
+                self._set_open_attendance_id(None)
+            if attendance.is_complete:
+                DailyAttendance._refresh(
+                    self, local_date(self.timezone_id, attendance.started_at))
+        self.open_attendance_id = None
+        return attendance, has_unstarted_work
+
+    def _set_open_attendance_id(self, open_attendance_id):
+        # Updates the row only, so that this object changes after commit.
+        (User.update(open_attendance_id=open_attendance_id)
+            .where(User.id == self.id)
+            .execute())
+
+    @classmethod
+    def close_stale_attendances(cls, started_before):
+        """
+        Forgets unfinished attendances started before the time, like
+        :meth:`start_working` does when the user missed to inform finishing,
+        so that finishing days later does not record one long attendance.
+
+        The attendances are left unfinished, which daily summaries ignore.
+
+        :param started_before: a naive datetime in UTC
+        :return: a list of ids of the users whose attendances were closed
+        """
+        with write_transaction(cls._meta.database):
+            rows = list(cls
+                        .select(cls.id, cls.open_attendance_id)
+                        .join(Attendance, on=(cls.open_attendance_id == Attendance.id))
+                        .where(Attendance.started_at < started_before)
+                        .tuples())
+            if rows:
+                # The condition is evaluated again on each row instead of
+                # listing the ids, so users who started working again in the
+                # meantime are kept, as reads may not lock the rows, e.g. on
+                # MySQL.
+                stale = (Attendance
+                         .select(SQL('1'))
+                         .where((Attendance.id == cls.open_attendance_id) &
+                                (Attendance.started_at < started_before)))
+                (cls.update(open_attendance_id=None)
+                    .where(fn.EXISTS(stale))
+                    .execute())
+        return [user_id for user_id, _ in rows]
+
     @property
     def timezone(self):
-        return pytz.timezone(self.timezone_id)
+        return get_timezone(self.timezone_id)
 
     @timezone.setter
     def timezone(self, new_timezone):
@@ -42,11 +152,87 @@ class User(BaseModel):
 
 
 class Attendance(BaseModel):
+    class Meta:
+        indexes = (
+            (('user', 'started_at'), False),
+            (('user', 'finished_at'), False),
+        )
+
     started_at = DateTimeField(null=True)  # read/write as UTC
     finished_at = DateTimeField(null=True)  # read/write as UTC
     user = ForeignKeyField(User, null=False, related_name='attendances',
                            on_delete='CASCADE')
 
+    @classmethod
+    def recent(cls, user, limit=30):
+        """
+        Returns the last attendances of the user.
+
+        The user is joined so that rendering them does not query it per row.
+
+        :param user: a User object
+        :param limit: the maximum number of attendances
+        :return: a SelectQuery of Attendance objects
+        """
+        return (cls
+                .select(cls, User)
+                .join(User)
+                .where(cls.user == user)
+                .order_by(cls.started_at.desc())
+                .limit(limit))
+
+    @classmethod
+    def iterate_between(cls, user, started_at, finished_at, page_size=500):
+        """
+        Iterates attendances of the user started in the range in order.
+
+        Rows are fetched page by page by keyset pagination on
+        (started_at, id), so neither memory nor the cost of each page grows
+        with the length of the range.
+
+        :param user: a User object
+        :param started_at: a naive datetime in UTC
+        :param finished_at: a naive datetime in UTC, which is exclusive
+        :param page_size: the number of rows fetched at once
+        :return: a generator of Attendance objects
+        """
+        query = (Attendance
+                 .select(Attendance, User)
+                 .join(User)
+                 .where((Attendance.user == user) &
+                        (Attendance.started_at >= started_at) &
+                        (Attendance.started_at < finished_at))
+                 .order_by(Attendance.started_at, Attendance.id)
+                 .limit(page_size))
+        page_query = query
+        while True:
+            page = list(page_query)
+            yield from page
+            if len(page) < page_size:
+                return
+            last = page[-1]
+            page_query = query.where(
+                (Attendance.started_at > last.started_at) |
+                ((Attendance.started_at == last.started_at) &
+                 (Attendance.id > last.id)))
+
+    @classmethod
+    def fingerprint(cls, user):
+        """
+        Returns a value which changes whenever attendances of the user are
+        added, finished or deleted.
+
+        :param user: a User object
+        :return: a tuple of the number of attendances, the last id,
+                 the number of finished ones and the last finish
+        """
+        return (cls
+                .select(fn.COUNT(cls.id), fn.MAX(cls.id),
+                        fn.COUNT(cls.finished_at), fn.MAX(cls.finished_at))
+                .where(cls.user == user)
+                .tuples()
+                .get())
+
     @property
     def is_complete(self):
         return bool(self.started_at and self.finished_at)
@@ -60,16 +246,14 @@ class Attendance(BaseModel):
     def started_at_display(self):
         started_at = self.started_at
         if started_at:
-            utc_started_at = pytz.utc.localize(started_at)
-            local_started_at = utc_started_at.astimezone(self.user.timezone)
+            local_started_at = to_local(self.user.timezone_id, started_at)
             return local_started_at.strftime('%Y-%m-%d %H:%M:%S')
 
     @property
     def finished_at_display(self):
         finished_at = self.finished_at
         if finished_at:
-            utc_finished_at = pytz.utc.localize(finished_at)
-            local_finished_at = utc_finished_at.astimezone(self.user.timezone)
+            local_finished_at = to_local(self.user.timezone_id, finished_at)
             return local_finished_at.strftime('%Y-%m-%d %H:%M:%S')
 
     @property
@@ -80,65 +264,447 @@ class Attendance(BaseModel):
 
 
 class DailyAttendance(Attendance):
+    """
+    A materialized daily summary of attendances per user.
+
+    Attendances are bucketed by the date when they started in the timezone
+    of the user. Rows are maintained incrementally by :meth:`refresh` whenever
+    an attendance is finished, and can be recomputed at once by
+    :meth:`rebuild`.
+
+    Rows moved by :meth:`archive` summarize attendances which no longer
+    exist, so they are never recomputed.
+    """
+
     class Meta:
-        primary_key = CompositeKey('date', 'user_id')
+        db_table = 'daily_attendance'
+        indexes = ()
+        primary_key = CompositeKey('user', 'date')
 
+    date = DateField(null=False)
     break_count = IntegerField(null=False)
     working_time_seconds = IntegerField(null=False)
     user = ForeignKeyField(User, null=False, related_name='daily_attendances',
                            on_delete='CASCADE')
+    archived = BooleanField(default=False)
+
+    aggregate_columns = ('date', 'started_at', 'finished_at', 'break_count',
+                         'working_time_seconds', 'created_at', 'user_id',
+                         'archived')
 
-    create_view_statement_mysql = """\
-            create or replace view dailyattendance as
-            select min(started_at)
-                as started_at,
-                    max(finished_at)
-                as finished_at,
-                    count(*) - 1
-                as break_count,
-                    sum(unix_timestamp(finished_at) - unix_timestamp(started_at))
-                as working_time_seconds,
-                    min(created_at)
-                as created_at,
-                    user_id
+    aggregate_statement_mysql = """\
+            select {date},
+                    min(started_at),
+                    max(finished_at),
+                    count(*) - 1,
+                    sum(unix_timestamp(finished_at) - unix_timestamp(started_at)),
+                    min(created_at),
+                    user_id,
+                    {archived:d}
                 from attendance
             where started_at is not null
                 and finished_at is not null
-            group by date(started_at), user_id
-            order by started_at"""
-
-    create_view_statement_sqlite = """\
-            create view if not exists dailyattendance as
-            select min(started_at)
-                as started_at,
-                    max(finished_at)
-                as finished_at,
-                    count(*) - 1
-                as break_count,
+                {conditions}
+            group by {group_by}user_id"""
+
+    aggregate_statement_sqlite = """\
+            select {date},
+                    min(started_at),
+                    max(finished_at),
+                    count(*) - 1,
                     sum(cast(strftime('%s', finished_at)
                             as integer)
                         - cast(strftime('%s', started_at)
-                                as integer))
-                as working_time_seconds,
-                    min(created_at)
-                as created_at,
-                    user_id
+                                as integer)),
+                    min(created_at),
+                    user_id,
+                    {archived:d}
                 from attendance
             where started_at is not null
                 and finished_at is not null
-            group by date(started_at), user_id
-            order by started_at"""
+                {conditions}
+            group by {group_by}user_id"""
+
+    # Keeps attendances off archived days, which they can fall on only after
+    # the timezone of the user is changed, until they are archived as well.
+    unarchived_condition = """\
+            not exists (
+                select 1 from daily_attendance archived_day
+                where archived_day.user_id = attendance.user_id
+                    and archived_day.archived
+                    and archived_day.date = {date})"""
+
+    @classmethod
+    def refresh(cls, user, date):
+        """
+        Recomputes the summary of the user on the date.
+
+        Only attendances started on the date are read, so the cost does not
+        depend on the length of the user's history. An archived summary is
+        left as it is.
+
+        :param user: a User object
+        :param date: a date in the timezone of the user
+        """
+        with write_transaction(cls._meta.database):
+            cls._refresh(user, date)
+
+    @classmethod
+    def _refresh(cls, user, date):
+        # Recomputes the summary in the transaction of the caller, without
+        # the savepoint of a nested transaction.
+        started_at, finished_at = local_day_range(user.timezone_id, date)
+        (cls.delete()
+            .where((cls.user == user) & (cls.date == date) &
+                   (cls.archived == False))  # noqa: E712
+            .execute())
+        cls._aggregate(
+            '{0}', [date],
+            ['user_id = {0}', 'started_at >= {0}', 'started_at < {0}'],
+            [user.id, started_at, finished_at],
+            group_by_date=False, exclude_archived=True)
+
+    @classmethod
+    def recent(cls, user, limit=30):
+        """
+        Returns the last daily summaries of the user.
+
+        :param user: a User object
+        :param limit: the maximum number of days
+        :return: a SelectQuery of DailyAttendance objects
+        """
+        return (cls
+                .select(cls, User)
+                .join(User)
+                .where(cls.user == user)
+                .order_by(cls.date.desc())
+                .limit(limit))
+
+    @classmethod
+    def fingerprint(cls, user):
+        """
+        Returns a value which changes whenever summaries of the user change.
+
+        :param user: a User object
+        :return: a tuple of the number of summaries, the last date,
+                 the total break count and the total working time in seconds
+        """
+        return (cls
+                .select(fn.COUNT(cls.date), fn.MAX(cls.date),
+                        fn.SUM(cls.break_count),
+                        fn.SUM(cls.working_time_seconds))
+                .where(cls.user == user)
+                .tuples()
+                .get())
 
     @classmethod
-    def create_view(cls):
-        if isinstance(cls._meta.database, MySQLDatabase):
-            statement = cls.create_view_statement_mysql
-        elif isinstance(cls._meta.database, SqliteDatabase):
-            statement = cls.create_view_statement_sqlite
+    def rebuild(cls, user=None):
+        """
+        Recomputes summaries from the attendance table.
+
+        Attendances of users in the same timezone are aggregated at once
+        by shifting them with the UTC offsets in effect, which are found in
+        the offset table of the timezone. Archived summaries are kept.
+
+        :param user: a User object to recompute only its summaries, e.g.
+                     after its timezone is changed, or None for all users
+        """
+        with write_transaction(cls._meta.database):
+            query = cls.delete().where(cls.archived == False)  # noqa: E712
+            archived_query = cls.select().where(cls.archived == True)  # noqa: E712
+            if user is not None:
+                query = query.where(cls.user == user)
+                archived_query = archived_query.where(cls.user == user)
+            query.execute()
+            exclude_archived = archived_query.exists()
+            if user is None:
+                timezone_ids = [timezone_id for timezone_id, in User
+                                .select(User.timezone_id)
+                                .distinct()
+                                .tuples()]
+                condition = 'user_id in (select id from user where timezone_id = {0})'
+            else:
+                timezone_ids = [user.timezone_id]
+                condition = 'user_id = {0}'
+            for timezone_id in timezone_ids:
+                param = timezone_id if user is None else user.id
+                cls._aggregate_in_timezone(timezone_id, condition, param,
+                                           exclude_archived)
+
+    @classmethod
+    def archive(cls, user, date):
+        """
+        Freezes summaries of the user before the date, so that attendances
+        started before the date can be deleted.
+
+        Summaries are recomputed from the attendances first, and merged into
+        archived summaries of the same days if any.
+
+        :param user: a User object
+        :param date: a date in the timezone of the user, which is exclusive
+        :return: the number of archived days
+        """
+        database = cls._meta.database
+        cutoff, _ = local_day_range(user.timezone_id, date)
+        with write_transaction(database):
+            first_started_at, = database.execute_sql(
+                'select min(started_at) from attendance '
+                'where user_id = {0} and started_at < {0}'
+                .format(database.interpolation),
+                [user.id, cutoff]).fetchone()
+            rows = []
+            if first_started_at is not None:
+                local_date, date_params = cls._local_date_expression(
+                    database, user.timezone_id,
+                    Attendance.started_at.python_value(first_started_at),
+                    cutoff)
+                statement, params = cls._aggregate_query(
+                    local_date, date_params,
+                    ['user_id = {0}', 'started_at < {0}'], [user.id, cutoff],
+                    archived=True)
+                fields = [cls._meta.columns[column]
+                          for column in cls.aggregate_columns]
+                rows = [{field.name: field.python_value(value)
+                         for field, value in zip(fields, row)}
+                        for row in database.execute_sql(statement, params)]
+            archived_days = {}
+            if rows:
+                archived_days = {day.date: day for day in cls.select().where(
+                    (cls.user == user) & (cls.archived == True) &  # noqa: E712
+                    (cls.date >= min(row['date'] for row in rows)) &
+                    (cls.date < date))}
+            (cls.delete()
+                .where((cls.user == user) & (cls.date < date) &
+                       (cls.archived == False))  # noqa: E712
+                .execute())
+            for row in rows:
+                day = archived_days.get(row['date'])
+                if day is None:
+                    cls.insert(**row).execute()
+                    continue
+                (cls.update(started_at=min(day.started_at, row['started_at']),
+                            finished_at=max(day.finished_at, row['finished_at']),
+                            break_count=day.break_count + row['break_count'] + 1,
+                            working_time_seconds=(day.working_time_seconds +
+                                                  row['working_time_seconds']),
+                            created_at=min(day.created_at, row['created_at']))
+                    .where((cls.user == user) & (cls.date == day.date))
+                    .execute())
+        return len(rows)
+
+    @classmethod
+    def _aggregate_in_timezone(cls, timezone_id, condition, param,
+                               exclude_archived=False):
+        database = cls._meta.database
+        first_started_at, last_started_at = database.execute_sql(
+            'select min(started_at), max(started_at) from attendance '
+            'where ' + condition.format(database.interpolation),
+            [param]).fetchone()
+        if first_started_at is None:
+            return
+        date, date_params = cls._local_date_expression(
+            database, timezone_id,
+            Attendance.started_at.python_value(first_started_at),
+            Attendance.started_at.python_value(last_started_at))
+        cls._aggregate(date, date_params, [condition], [param],
+                       exclude_archived=exclude_archived)
+
+    @staticmethod
+    def _local_date_expression(database, timezone_id, first_started_at,
+                               last_started_at):
+        ranges = utc_offset_ranges(timezone_id, first_started_at,
+                                   last_started_at)
+        if isinstance(database, MySQLDatabase):
+            template = 'date(attendance.started_at + interval ({}) second)'
+            shift = int
+        else:
+            template = 'date(attendance.started_at, {})'
+            shift = '{:+d} seconds'.format
+        (_, first_offset), *transitions = ranges
+        offset_expression = '{0}'
+        offset_params = [shift(first_offset)]
+        if transitions:
+            offset_expression = 'case {} else {{0}} end'.format(
+                ' '.join('when attendance.started_at < {0} then {0}'
+                         for _ in transitions))
+            offset_params = []
+            for (_, offset), (since, _) in zip(ranges, transitions):
+                offset_params += [since, shift(offset)]
+            offset_params.append(shift(ranges[-1][1]))
+        return template.format(offset_expression), offset_params
+
+    @classmethod
+    def _aggregate(cls, date, date_params, conditions, params,
+                   group_by_date=True, exclude_archived=False):
+        database = cls._meta.database
+        statement, params = cls._aggregate_query(
+            date, date_params, conditions, params, group_by_date,
+            exclude_archived=exclude_archived)
+        database.execute_sql(
+            'insert into daily_attendance ({}) {}'.format(
+                ', '.join(cls.aggregate_columns), statement),
+            params)
+
+    @classmethod
+    def _aggregate_query(cls, date, date_params, conditions, params,
+                         group_by_date=True, archived=False,
+                         exclude_archived=False):
+        database = cls._meta.database
+        if isinstance(database, MySQLDatabase):
+            statement = cls.aggregate_statement_mysql
+        elif isinstance(database, SqliteDatabase):
+            statement = cls.aggregate_statement_sqlite
         else:
-            raise NotImplementedError('An SQL statement for the current database {} is not implemented.'.format(cls._meta.database))
-        cls._meta.database.execute_sql(statement)
+            raise NotImplementedError('An SQL statement for the current database {} is not implemented.'.format(database))
+        params = list(params)
+        if exclude_archived:
+            conditions = list(conditions) + [cls.unarchived_condition.replace('{date}', date)]
+            params += date_params
+        date = date.format(database.interpolation)
+        conditions = ''.join(' and ' + condition.format(database.interpolation)
+                             for condition in conditions)
+        group_by = date + ', ' if group_by_date else ''
+        params = date_params + params + (date_params if group_by_date else [])
+        return statement.format(date=date, conditions=conditions,
+                                group_by=group_by, archived=archived), params
 
     @property
     def working_time(self):
         return timedelta(seconds=self.working_time_seconds)
+
+
+class Lease(BaseModel):
+    """
+    A named lock held by one process until it expires unless renewed.
+
+    Expiry is compared with the clock of each process, so clocks of hosts
+    sharing a lease must be synchronized well within its time to live.
+    """
+
+    name = CharField(primary_key=True)
+    holder = CharField(null=False)
+    expires_at = DateTimeField(null=False)  # read/write as UTC
+
+    @classmethod
+    def acquire(cls, name, holder, ttl, now=None):
+        """
+        Takes the lease if it is free or expired, or renews it if the holder
+        already has it.
+
+        :param ttl: seconds until the lease expires
+        :param now: a datetime in UTC, which defaults to the current time
+        :return: when the lease expires, or None if another holder has it
+        """
+        if now is None:
+            now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=ttl)
+        try:
+            with write_transaction(cls._meta.database):
+                is_updated = (cls.update(holder=holder, expires_at=expires_at)
+                              .where((cls.name == name) &
+                                     ((cls.holder == holder) |
+                                      (cls.expires_at < now)))
+                              .execute())
+                if not is_updated:
+                    if cls.select().where(cls.name == name).exists():
+                        return None
+                    cls.create(name=name, holder=holder, expires_at=expires_at)
+        except IntegrityError:
+            # Another holder created it at the same time.
+            return None
+        return expires_at
+
+    @classmethod
+    def release(cls, name, holder):
+        """
+        Gives up the lease if the holder has it.
+        """
+        (cls.delete()
+            .where((cls.name == name) & (cls.holder == holder))
+            .execute())
+
+
+class Job(BaseModel):
+    """
+    A unit of work queued in the database for any worker to run.
+
+    A worker claims a job for a limited time, so a job of a worker which
+    died is claimed again by another after it expires. Finished jobs are
+    deleted and failed ones are kept for inspection.
+    """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+
+    class Meta:
+        indexes = (
+            (('status', 'lease_until'), False),
+        )
+
+    kind = CharField(null=False)
+    payload = TextField(null=False)  # JSON
+    status = CharField(null=False, default=PENDING)
+    attempts = IntegerField(null=False, default=0)
+    worker = CharField(null=True)
+    lease_until = DateTimeField(null=True)  # read/write as UTC
+    error = TextField(null=True)
+
+    @classmethod
+    def enqueue(cls, kind, data):
+        """
+        :param kind: a name to find how to run the job
+        :param data: a value which can be serialized as JSON
+        :return: the created Job object
+        """
+        return cls.create(kind=kind, payload=json.dumps(data))
+
+    @classmethod
+    def claim(cls, worker, timeout, max_attempts=3, now=None):
+        """
+        Takes the oldest pending or expired job.
+
+        A candidate is taken by an UPDATE conditioned on it being still
+        claimable, so a job is never taken by two workers at once.
+        Jobs which have been claimed too many times are failed instead.
+
+        :param worker: a name of the worker
+        :param timeout: seconds until the claim expires
+        :param now: a datetime in UTC, which defaults to the current time
+        :return: a Job object or None if there are no jobs to run
+        """
+        if now is None:
+            now = datetime.utcnow()
+        lease_until = now + timedelta(seconds=timeout)
+        claimable = ((cls.status == cls.PENDING) |
+                     ((cls.status == cls.RUNNING) & (cls.lease_until < now)))
+        while True:
+            job = cls.select().where(claimable).order_by(cls.id).first()
+            if job is None:
+                return None
+            is_claimed = (cls.update(status=cls.RUNNING, worker=worker,
+                                     lease_until=lease_until,
+                                     attempts=cls.attempts + 1)
+                          .where((cls.id == job.id) & claimable)
+                          .execute())
+            if not is_claimed:
+                continue
+            job.status = cls.RUNNING
+            job.worker = worker
+            job.lease_until = lease_until
+            job.attempts += 1
+            if job.attempts <= max_attempts:
+                return job
+            job.fail('Gave up after {} attempts.'.format(max_attempts))
+
+    @property
+    def data(self):
+        return json.loads(self.payload)
+
+    def complete(self):
+        self.delete_instance()
+
+    def fail(self, error):
+        self.status = self.FAILED
+        self.error = error
+        self.save(only=[Job.status, Job.error])
@@ -12,42 +12,125 @@ I can understand the following words and something like them;
 `@timekeeper contributions`
 `@timekeeper help`
 `@timekeeper timesheet`
+`@timekeeper timesheet from 2017-01-01 to 2017-03-31 csv`
 `@timekeeper track me`
 `@timekeeper do not track me`
 `@timekeeper set my timezone as Europe/London`
+`@timekeeper stats` (admins only)
+`@timekeeper profile start` and `@timekeeper profile stop` (admins only)
 
 Again, I won't track you until you say `@timekeeper track me`!
 """
 
+from concurrent.futures import TimeoutError
 from datetime import datetime
+from itertools import chain
 import re
 import os
 from textwrap import dedent
+from threading import Thread, current_thread, main_thread
 
 import pytz
 from slackbot import settings
 from slackbot.bot import respond_to, listen_to
 from slackbot.utils import create_tmp_file
 
-from timekeeper.database import get_db, migrate_db
+from timekeeper.database import get_db, setup_db
+from timekeeper.metrics import (SamplingProfiler, instrument_cache,
+                                instrument_database, instrument_slack_api,
+                                instrumented, registry, serve_metrics)
 from timekeeper.models import Attendance, DailyAttendance, User
-from timekeeper.plugins.decorators import with_user
-from timekeeper.plugins.utils import create_temp_dir, safe_upload_file
-from timekeeper.plugins.views import (render_contribution_figure,
-                                      render_daily_timesheet,
-                                      render_timesheet)
-from timekeeper.stats import working_time_ratio_series
-
-
-def on_start_listening():
-    db = get_db()
-    db.connect()
-    db.create_tables([User, Attendance], safe=True)
-    DailyAttendance.create_view()
-    migrate_db()
-
-
-on_start_listening()
+from timekeeper.plugins.decorators import (offloaded, urgent, user_cache,
+                                           with_trackable_user, with_user)
+from timekeeper.plugins.utils import (create_temp_dir, safe_upload_file,
+                                      triple_backquoted)
+from timekeeper.plugins.rendering import RenderQueueFullError
+from timekeeper.plugins.reports import (contribution_figure_key, figure_cache,
+                                        get_timesheet,
+                                        render_contribution_figure,
+                                        render_pool,
+                                        run_scheduled_nightly_tasks)
+from timekeeper.plugins.router import install_router
+from timekeeper.plugins.views import (iter_timesheet_csv_lines,
+                                      iter_timesheet_markdown_lines,
+                                      render_daily_timesheet, render_stats)
+from timekeeper.scheduler import DailyScheduler
+from timekeeper.slackapi import Outbox, SlackAPI
+from timekeeper.timezones import get_timezone, local_day_range
+from timekeeper.writer import (AttendanceEvent, AttendanceWriter,
+                               FINISH_WORKING, START_WORKING)
+
+attendance_writer = None
+profiler = SamplingProfiler()
+slack_api = SlackAPI(max_retries=settings.TIMEKEEPER_SLACK_API_MAX_RETRIES,
+                     pool_size=settings.TIMEKEEPER_SLACK_API_POOL_SIZE)
+outbox = Outbox(settings.TIMEKEEPER_SLACK_OUTBOX_SIZE)
+# Replies go over the RTM API, and do not wait for throttled reactions.
+reply_outbox = Outbox(settings.TIMEKEEPER_SLACK_OUTBOX_SIZE,
+                      name='timekeeper-reply-outbox')
+nightly_scheduler = None
+_started = False
+
+
+def start():
+    """
+    Starts the services of the bot, such as the metrics server, the
+    attendance writer and the nightly scheduler.
+
+    Only the process connected to Slack calls it, so that job workers and
+    maintenance commands can import the handlers next to the bot.
+    """
+    global attendance_writer, nightly_scheduler, _started
+    if _started:
+        return
+    _started = True
+    instrument_database(get_db())
+    slack_api.install()
+    instrument_slack_api()
+    instrument_cache(user_cache, 'user')
+    instrument_cache(figure_cache, 'figure')
+    install_router()
+    if settings.TIMEKEEPER_METRICS_PORT:
+        serve_metrics(settings.TIMEKEEPER_METRICS_PORT)
+    setup_db()
+    if settings.TIMEKEEPER_WRITE_BEHIND:
+        attendance_writer = AttendanceWriter(
+            maxsize=settings.TIMEKEEPER_WRITE_BEHIND_QUEUE_SIZE,
+            on_applied=lambda event: user_cache.invalidate(event.user_id))
+        attendance_writer.start()
+        if current_thread() is main_thread():
+            attendance_writer.stop_on_signal()
+    if settings.TIMEKEEPER_WARM_UP_ANALYTICS:
+        Thread(target=warm_up_analytics, name='timekeeper-warm-up',
+               daemon=True).start()
+    if settings.TIMEKEEPER_NIGHTLY_HOUR is not None:
+        nightly_scheduler = DailyScheduler(
+            run_scheduled_nightly_tasks, settings.TIMEKEEPER_NIGHTLY_HOUR,
+            timezone_id=settings.TIMEKEEPER_NIGHTLY_TIMEZONE,
+            name='timekeeper-nightly')
+        nightly_scheduler.start()
+
+
+def stop(timeout=None):
+    """
+    Writes queued clock events and sends queued reactions and replies,
+    e.g. before exiting.
+
+    :param timeout: seconds to wait for each of them
+    """
+    if attendance_writer is not None:
+        attendance_writer.stop(timeout)
+    outbox.flush(timeout)
+    reply_outbox.flush(timeout)
+
+
+def warm_up_analytics():
+    """
+    Loads the analytics stack, which is otherwise loaded on the first
+    contributions request.
+    """
+    import numpy  # noqa
+    render_pool.start()
 
 
 @listen_to('作業を開始します')
@@ -55,19 +138,14 @@ on_start_listening()
 @listen_to('start(ed)? working', re.IGNORECASE)
 @listen_to('continued? working', re.IGNORECASE)
 @listen_to('resumed? working', re.IGNORECASE)
-@with_user
+@urgent
+@instrumented
+@with_trackable_user
 def on_start_working(message, user, *args):
-    if not user.trackable:
-        return
-    last_attendance = user.last_attendance()
-    has_unfinished_work = last_attendance and not last_attendance.finished_at
-    attendance = Attendance.create(started_at=datetime.utcnow(), user=user)
-    attendance.save()
-    message.react('stopwatch')
-    if has_unfinished_work:
-        message.reply(dedent("""\
-            I think you missed to inform finishing the last one.
-            However I'll record you start your work now."""))
+    event = AttendanceEvent(START_WORKING, user.id, datetime.utcnow())
+    _record_attendance_event(message, user, event, dedent("""\
+        I think you missed to inform finishing the last one.
+        However I'll record you start your work now."""))
 
 
 @listen_to('作業を終了します')
@@ -75,81 +153,148 @@ def on_start_working(message, user, *args):
 @listen_to('finish(ed)? working', re.IGNORECASE)
 @listen_to('report working', re.IGNORECASE)
 @listen_to('stop(ped)? working', re.IGNORECASE)
-@with_user
+@urgent
+@instrumented
+@with_trackable_user
 def on_finish_working(message, user, *args):
-    if not user.trackable:
-        return
-    attendance = user.last_attendance()
-    if not attendance or attendance.finished_at:
-        attendance = Attendance.create(user=user)
-    attendance.finished_at = datetime.utcnow()
-    has_unstarted_work = not attendance.started_at and attendance.finished_at
-    attendance.save()
-    message.react('stopwatch')
-    if has_unstarted_work:
-        message.reply(dedent("""\
-            I think you missed to inform starting this work.
-            However I'll record you finish your work now."""))
+    event = AttendanceEvent(FINISH_WORKING, user.id, datetime.utcnow())
+    _record_attendance_event(message, user, event, dedent("""\
+        I think you missed to inform starting this work.
+        However I'll record you finish your work now."""))
+
+
+def _record_attendance_event(message, user, event, warning):
+    """
+    Records the event and reacts to the message.
+    The warning is replied if the event does not match the last one.
+
+    In write-behind mode, it reacts immediately and the attendance writer
+    replies after recording.
+
+    Both are sent through outboxes, which do not keep the handler waiting
+    at the start of a shift, and send the same warning to a user once
+    until it is sent.
+    """
+    channel = message.body['channel']
+
+    def reply_warning(attendance, is_inconsistent):
+        if is_inconsistent:
+            reply_outbox.submit(message.reply, warning,
+                                key=('reply', channel, user.id, warning))
+
+    if attendance_writer is None:
+        result = event.apply(user)
+        outbox.submit(message.react, 'stopwatch',
+                      key=('react', channel, message.body.get('ts')))
+        reply_warning(*result)
+    else:
+        attendance_writer.submit(event, callback=reply_warning)
+        outbox.submit(message.react, 'stopwatch',
+                      key=('react', channel, message.body.get('ts')))
 
 
 @respond_to('^introduce yourself$', re.IGNORECASE)
 @respond_to('^help$')
+@instrumented
 def help(message):
     message.reply(__doc__)
 
 
 @respond_to('^track me$', re.IGNORECASE)
+@instrumented
 @with_user
 def set_trackable(message, user):
     if user.trackable:
         return message.reply("I'm already tracking you.")
     user.trackable = True
-    user.save()
+    user.save(only=[User.trackable])
+    user_cache.invalidate(user.id)
     message.reply('OK, I will track you.')
 
 
 @respond_to('^do not track me$', re.IGNORECASE)
 @respond_to("^don'?t track me$", re.IGNORECASE)
+@instrumented
 @with_user
 def set_untrackable(message, user):
     if not user.trackable:
         return message.reply("I didn't track you.")
     user.trackable = False
-    user.save()
+    user.save(only=[User.trackable])
+    user_cache.invalidate(user.id)
     message.reply("OK, I won't track you any more.")
 
 
 @respond_to('set my time ?zone as (.*)$', re.IGNORECASE)
 @respond_to('my time ?zone is (.*)$', re.IGNORECASE)
+@instrumented
 @with_user
 def set_timezone(message, user, timezone_id):
     try:
-        user.timezone = pytz.timezone(timezone_id)
+        user.timezone = get_timezone(timezone_id)
     except pytz.UnknownTimeZoneError:
         message.reply("Sorry but I can't recognize it. Maybe a typo?")
     else:
-        user.save()
+        user.save(only=[User.timezone_id])
+        user_cache.invalidate(user.id)
+        DailyAttendance.rebuild(user)
         message.reply('OK, I updated your timezone.')
 
 
 @respond_to('^(show )?(m[ey] )?timesheet$')
+@offloaded
+@instrumented
 @with_user
 def show_timesheet(message, user, *args):
-    attendances = user.attendances.order_by(Attendance.started_at.desc()).limit(30)
-    if not attendances:
+    path = get_timesheet(user)
+    if path is None:
         return message.reply("Sorry but I don't have your timesheet.")
-    timesheet = render_timesheet(attendances)
-    filename = 'timesheet.md'
-    with create_tmp_file(bytes(timesheet, 'utf-8')) as path:
+    safe_upload_file(message, 'timesheet.md', path, 'Here is your timesheet.',
+                     is_text_file=True)
+
+
+@respond_to(r'^(?:show )?(?:m[ey] )?timesheet from (\S+) to (\S+?)( (?:as |in )?csv)?$',
+            re.IGNORECASE)
+@offloaded
+@instrumented
+@with_user
+def export_timesheet(message, user, first_date, last_date, as_csv):
+    try:
+        first_date = datetime.strptime(first_date, '%Y-%m-%d').date()
+        last_date = datetime.strptime(last_date, '%Y-%m-%d').date()
+    except ValueError:
+        return message.reply("Sorry but I can't recognize the dates. "
+                             'Please write them like 2017-01-31.')
+    if first_date > last_date:
+        return message.reply('Sorry but the first date is after the last date.')
+    started_at, _ = local_day_range(user.timezone_id, first_date)
+    _, finished_at = local_day_range(user.timezone_id, last_date)
+    attendances = Attendance.iterate_between(user, started_at, finished_at)
+    first_attendance = next(attendances, None)
+    if first_attendance is None:
+        return message.reply("Sorry but I don't have your timesheet in the period.")
+    attendances = chain([first_attendance], attendances)
+    if as_csv:
+        filename = 'timesheet.csv'
+        lines = iter_timesheet_csv_lines(attendances)
+    else:
+        filename = 'timesheet.md'
+        lines = iter_timesheet_markdown_lines(attendances)
+    with create_temp_dir() as temp_dir:
+        path = os.path.join(temp_dir, filename)
+        with open(path, 'w', newline='') as f:
+            f.writelines(lines)
         safe_upload_file(message, filename, path, 'Here is your timesheet.',
                          is_text_file=True)
 
 
 @respond_to('^(show )?(m[ey] )?daily timesheet$')
 @respond_to('^(show )?(m[ey] )?timesheet by day$')
+@offloaded
+@instrumented
 @with_user
 def show_daily_timesheet(message, user, *args):
-    daily_attendances = user.daily_attendances.order_by(DailyAttendance.started_at.desc()).limit(30)
+    daily_attendances = DailyAttendance.recent(user)
     if not daily_attendances:
         return message.reply("Sorry but I don't have your daily timesheet.")
     daily_timesheet = render_daily_timesheet(daily_attendances)
@@ -160,32 +305,78 @@ def show_daily_timesheet(message, user, *args):
 
 
 @respond_to('contributions')
+@offloaded
+@instrumented
 @with_user
 def show_contributions(message, user):
-    if not user.attendances:
+    fingerprint = DailyAttendance.fingerprint(user)
+    summary_count, *_ = fingerprint
+    if not summary_count:
         return message.reply("Sorry but I don't have your timesheet.")
-    message.reply('OK, wait a moment...')
-    series = working_time_ratio_series(user)
-    figure = render_contribution_figure(series)
     filename = 'contributions.png'
+    comment = 'Here. Each day is plotted in your timezone.'
+    name, parts = contribution_figure_key(user, fingerprint)
+    path = figure_cache.get(name, parts)
+    if path is not None:
+        return safe_upload_file(message, filename, path, comment)
+    message.reply('OK, wait a moment...')
     with create_temp_dir() as temp_dir:
         path = os.path.join(temp_dir, filename)
-        figure.savefig(path)
-        safe_upload_file(
-            message,
-            filename,
-            path,
-            'Here. Regardless of your timezone, each days are plotted in UTC.'
-        )
+        try:
+            render_contribution_figure(user, path)
+        except RenderQueueFullError:
+            return message.reply("Sorry but I'm busy drawing. Please ask me again later.")
+        except TimeoutError:
+            return message.reply('Sorry but it took too long to draw.')
+        figure_cache.put(name, parts, path)
+        safe_upload_file(message, filename, path, comment)
+
+
+@respond_to('^stats$')
+@instrumented
+def show_stats(message):
+    if message.body.get('user') not in settings.TIMEKEEPER_ADMINS:
+        return message.reply(settings.DEFAULT_REPLY)
+    message.reply(triple_backquoted(render_stats(registry)))
+
+
+@respond_to('^stats prometheus$')
+@instrumented
+def dump_stats(message):
+    if message.body.get('user') not in settings.TIMEKEEPER_ADMINS:
+        return message.reply(settings.DEFAULT_REPLY)
+    with create_tmp_file(bytes(registry.render(), 'utf-8')) as path:
+        safe_upload_file(message, 'metrics.prom', path,
+                         'Here are the metrics.', is_text_file=True)
+
+
+@respond_to('^profile (start|stop)$')
+@instrumented
+def toggle_profiler(message, action):
+    if message.body.get('user') not in settings.TIMEKEEPER_ADMINS:
+        return message.reply(settings.DEFAULT_REPLY)
+    if action == 'start':
+        if not profiler.start():
+            return message.reply("I'm already profiling.")
+        return message.reply('OK, I started profiling. '
+                             'Say `@timekeeper profile stop` to see the result.')
+    stacks = profiler.stop()
+    if stacks is None:
+        return message.reply("I'm not profiling.")
+    with create_tmp_file(bytes(stacks, 'utf-8')) as path:
+        safe_upload_file(message, 'profile.txt', path,
+                         'Here are the sampled stacks.', is_text_file=True)
 
 
 @respond_to('^debug (.*)$')
+@instrumented
 def debug(message, script):
     is_debug = os.getenv('TIMEKEEPER_DEBUG') not in (None, '', '0')
     message.reply(repr(eval(script)) if is_debug else settings.DEFAULT_REPLY)
 
 
 @respond_to('quine')
+@instrumented
 def quine(message):
     with open(__file__, 'r') as f:
         safe_upload_file(message, f.name, f.name, '', is_text_file=True)
@@ -1,24 +1,90 @@
+from contextlib import ExitStack
 from functools import wraps
 
-from timekeeper.models import User
+from slackbot import settings
+
+from timekeeper.cache import TTLCache
+from timekeeper.database import connection
+from timekeeper.models import Job, User
+from timekeeper.plugins.names import NameResolver
+
+user_cache = TTLCache(maxsize=settings.TIMEKEEPER_USER_CACHE_SIZE,
+                      ttl=settings.TIMEKEEPER_USER_CACHE_TTL)
+name_resolver = NameResolver(on_resolved=user_cache.invalidate)
+offloaded_handlers = {}
+
+
+def urgent(func):
+    """
+    Marks a handler which must not wait for other handlers, such as
+    clock-ins, so that the asyncio runtime runs it on reserved threads.
+    """
+    func.is_urgent = True
+    return func
+
+
+def offloaded(func):
+    """
+    Queues a heavy handler in the job table in cluster mode, so that
+    a job worker in any process runs it instead of the process connected
+    to Slack.
+
+    Jobs load the user from the database, since changes such as
+    `set my timezone as` invalidate the cache of the bot only.
+    """
+    def run_job(message, *args):
+        user_cache.invalidate(message.body.get('user'))
+        return func(message, *args)
+
+    offloaded_handlers[func.__name__] = run_job
+
+    @wraps(func)
+    def decorated(message, *args):
+        if not settings.TIMEKEEPER_CLUSTER:
+            return func(message, *args)
+        with connection():
+            Job.enqueue(func.__name__, {'body': message.body, 'args': args})
+    return decorated
 
 
 def with_user(func):
+    """
+    Passes the User who sent the message to the handler.
+
+    The user is loaded from the cache, and a connection is held only on a
+    cache miss and while the handler runs.
+    """
+    return _with_user(func, trackable_only=False)
+
+
+def with_trackable_user(func):
+    """
+    Like :func:`with_user`, but ignores messages of users who are not
+    tracked, without touching the database if they are cached.
+    """
+    return _with_user(func, trackable_only=True)
+
+
+def _with_user(func, trackable_only):
     @wraps(func)
     def decorated(message, *args, **kwargs):
         user_id = message.body.get('user')
         if user_id is None:
             # maybe a bot
             return
-        user, is_created = User.get_or_create(id=user_id)
-        if is_created:
-            user.save()
-        if user.name is None:
-            user_info = message._client.webapi.users.info(user_id)
-            if not user_info.successful:
-                raise RuntimeError(user_info.error)
-            name = user_info.body['user']['name']
-            user.name = name
-            user.save()
-        return func(message, user, *args, **kwargs)
+        with ExitStack() as stack:
+            user = user_cache.get(user_id)
+            if user is None:
+                stack.enter_context(connection())
+                user, is_created = User.get_or_create(id=user_id)
+                if is_created:
+                    user.save()
+                user_cache.set(user_id, user)
+            if user.name is None:
+                name_resolver.request(message._client.webapi, user_id)
+            if trackable_only and not user.trackable:
+                return
+            # It is a no-op if the connection is already held.
+            stack.enter_context(connection())
+            return func(message, user, *args, **kwargs)
     return decorated
@@ -0,0 +1,142 @@
+import logging
+from threading import Event, Lock, Thread
+import time
+
+from peewee import IntegrityError
+
+from timekeeper.cache import TTLCache
+from timekeeper.database import connection
+from timekeeper.models import User
+
+logger = logging.getLogger(__name__)
+
+
+class NameResolutionError(Exception):
+    pass
+
+
+class NameResolver(object):
+    """
+    Resolves missing `User.name` values off the message path.
+
+    Requested user ids are collected and resolved in batches by a background
+    thread with as few `users.list` pages as possible, instead of one
+    `users.info` call per user.
+
+    :param on_resolved: a function called with the id of each resolved user
+    :param page_size: the number of members to fetch per page
+    :param max_retries: how many times to retry a failed batch
+    :param backoff: seconds to wait before the first retry, doubled each time
+    :param cooldown: seconds to ignore requests for an already requested user
+    """
+
+    def __init__(self, on_resolved=None, page_size=200, max_retries=5,
+                 backoff=1.0, cooldown=600, sleep=time.sleep):
+        self.on_resolved = on_resolved
+        self.page_size = page_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._sleep = sleep
+        self._webapi = None
+        self._pending = set()
+        self._requested = TTLCache(maxsize=10000, ttl=cooldown)
+        self._lock = Lock()
+        self._wakeup = Event()
+        self._thread = None
+
+    def request(self, webapi, user_id):
+        """
+        Schedules resolution of the name of the user and returns immediately.
+        """
+        with self._lock:
+            if self._requested.get(user_id):
+                return
+            self._requested.set(user_id, True)
+            self._webapi = webapi
+            self._pending.add(user_id)
+            if self._thread is None:
+                self._thread = Thread(target=self._run,
+                                      name='timekeeper-name-resolver',
+                                      daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def resolve_pending(self):
+        """
+        Resolves and saves names of all pending users.
+
+        :return: a dict mapping user ids to resolved names
+        """
+        with self._lock:
+            user_ids, self._pending = self._pending, set()
+            webapi = self._webapi
+        if not user_ids:
+            return {}
+        for retry_count in range(self.max_retries + 1):
+            try:
+                names = self._fetch_names(webapi, user_ids)
+            except Exception as e:
+                if retry_count == self.max_retries:
+                    logger.error('Gave up resolving names of %d users: %s',
+                                 len(user_ids), e)
+                    with self._lock:
+                        for user_id in user_ids:
+                            self._requested.invalidate(user_id)
+                    return {}
+                delay = self.backoff * 2 ** retry_count
+                logger.warning('Failed to resolve names, retrying in %.1f '
+                               'seconds: %s', delay, e)
+                self._sleep(delay)
+            else:
+                break
+        for user_id in user_ids - set(names):
+            logger.warning('Cannot find user %s in the member list.', user_id)
+        self._save_names(names)
+        return names
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                self.resolve_pending()
+            except Exception:
+                logger.exception('Failed to save resolved names.')
+
+    def _fetch_names(self, webapi, user_ids):
+        names = {}
+        remaining_user_ids = set(user_ids)
+        cursor = ''
+        while remaining_user_ids:
+            response = webapi.users.get('users.list', params={
+                'limit': self.page_size,
+                'cursor': cursor,
+            })
+            if not response.successful:
+                raise NameResolutionError(response.error)
+            for member in response.body['members']:
+                if member['id'] in remaining_user_ids:
+                    names[member['id']] = member['name']
+                    remaining_user_ids.discard(member['id'])
+            metadata = response.body.get('response_metadata') or {}
+            cursor = metadata.get('next_cursor')
+            if not cursor:
+                break
+        return names
+
+    def _save_names(self, names):
+        with connection():
+            for user_id, name in names.items():
+                self._save_name(user_id, name)
+
+    def _save_name(self, user_id, name):
+        try:
+            (User.update(name=name)
+                .where((User.id == user_id) & User.name.is_null())
+                .execute())
+        except IntegrityError as e:
+            logger.warning('Cannot save name %r of user %s: %s',
+                           name, user_id, e)
+            return
+        if self.on_resolved is not None:
+            self.on_resolved(user_id)
@@ -0,0 +1,57 @@
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+from timekeeper.charts import warm_up
+
+
+class RenderQueueFullError(Exception):
+    pass
+
+
+class RenderPool(object):
+    """
+    A bounded pool of worker processes to render charts off the bot process.
+
+    Workers are started and warmed up with the plotting stack on first use.
+
+    :param max_workers: the number of worker processes
+    :param max_pending: the maximum number of running and queued jobs
+    """
+
+    def __init__(self, max_workers, max_pending):
+        self.max_workers = max_workers
+        self._pending = BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = Lock()
+
+    def start(self):
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._executor = ProcessPoolExecutor(self.max_workers)
+            for _ in range(self.max_workers):
+                self._executor.submit(warm_up)
+
+    def submit(self, func, *args):
+        """
+        Schedules func(*args) on a worker.
+
+        :return: a Future object
+        :raise RenderQueueFullError: if too many jobs are pending
+        """
+        self.start()
+        if not self._pending.acquire(blocking=False):
+            raise RenderQueueFullError('Too many charts are being rendered.')
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+        return future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait)
+                self._executor = None
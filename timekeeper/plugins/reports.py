@@ -0,0 +1,151 @@
+"""
+Rendering timesheets and contributions into the figure cache, and the
+nightly tasks which prepare them ahead of requests.
+
+Importing this module has no side effects, so that
+`python -m timekeeper nightly` can run next to the bot.
+"""
+
+from datetime import datetime, timedelta
+import logging
+import os
+
+from slackbot import settings
+from slackbot.utils import create_tmp_file
+
+from timekeeper.cache import FileCache
+from timekeeper.charts import save_contribution_figure
+from timekeeper.cluster import worker_id
+from timekeeper.database import connection
+from timekeeper.metrics import registry
+from timekeeper.models import Attendance, DailyAttendance, Lease, User
+from timekeeper.plugins.decorators import user_cache
+from timekeeper.plugins.rendering import RenderPool
+from timekeeper.plugins.utils import create_temp_dir
+from timekeeper.plugins.views import render_timesheet
+from timekeeper.stats import working_time_ratio_series
+from timekeeper.timezones import local_date
+
+logger = logging.getLogger(__name__)
+
+NIGHTLY_LEASE = 'nightly-tasks'
+
+figure_cache = FileCache(settings.TIMEKEEPER_FIGURE_CACHE_DIR,
+                         settings.TIMEKEEPER_FIGURE_CACHE_MAX_BYTES)
+render_pool = RenderPool(settings.TIMEKEEPER_RENDER_WORKERS,
+                         settings.TIMEKEEPER_RENDER_QUEUE_SIZE)
+
+
+def get_timesheet(user):
+    """
+    Returns the path of the Markdown timesheet of recent attendances of the
+    user in the cache, rendering it if the attendances have changed.
+
+    :return: a path or None if the user does not have attendances
+    """
+    fingerprint = Attendance.fingerprint(user)
+    attendance_count, *_ = fingerprint
+    if not attendance_count:
+        return None
+    name = 'timesheet-{}'.format(user.id)
+    parts = (fingerprint, user.timezone_id)
+    path = figure_cache.get(name, parts)
+    if path is None:
+        timesheet = render_timesheet(Attendance.recent(user))
+        with create_tmp_file(bytes(timesheet, 'utf-8')) as temp_path:
+            path = figure_cache.put(name, parts, temp_path)
+    return path
+
+
+def render_contribution_figure(user, path):
+    """
+    Renders the contributions of the user on the render pool.
+
+    calmap plots the first year of the series, with colors scaled over the
+    whole series, so every summary is fetched.
+
+    :param path: the path of a PNG file to write
+    :raise RenderQueueFullError: if too many figures are being rendered
+    :raise concurrent.futures.TimeoutError: if it takes too long
+    """
+    series = working_time_ratio_series(user)
+    with registry.timer('timekeeper_render_seconds'):
+        future = render_pool.submit(save_contribution_figure, series, path)
+        future.result(timeout=settings.TIMEKEEPER_RENDER_TIMEOUT)
+
+
+def contribution_figure_key(user, fingerprint):
+    """
+    Returns the name and the parts of the contributions of the user in
+    the figure cache.
+    """
+    return 'contributions-{}'.format(user.id), (fingerprint, user.timezone_id)
+
+
+def run_scheduled_nightly_tasks():
+    """
+    Runs the nightly tasks unless another process in the cluster has
+    already run them tonight.
+    """
+    with connection():
+        acquired = Lease.acquire(NIGHTLY_LEASE, worker_id(), 12 * 60 * 60)
+    if acquired is None:
+        logger.info('Skipped the nightly tasks run by another process.')
+        return
+    run_nightly_tasks()
+
+
+def run_nightly_tasks(now=None):
+    """
+    Closes attendances left open longer than TIMEKEEPER_AUTO_CLOSE_HOURS,
+    and prepares daily summaries, timesheets and contributions of trackable
+    users, so that requests in the morning hit the cache.
+
+    :param now: a naive datetime in UTC, which defaults to the current time
+    :return: a tuple of the number of closed attendances and the number of
+             users whose reports were prepared
+    """
+    if now is None:
+        now = datetime.utcnow()
+    with connection():
+        user_ids = User.close_stale_attendances(
+            now - timedelta(hours=settings.TIMEKEEPER_AUTO_CLOSE_HOURS))
+        users = list(User.select().where(User.trackable == True))  # noqa: E712
+    for user_id in user_ids:
+        user_cache.invalidate(user_id)
+    logger.info('Closed attendances of %d users left open.', len(user_ids))
+    prepared_count = 0
+    for user in users:
+        try:
+            with connection():
+                prepare_reports(user, now)
+        except Exception:
+            logger.exception('Failed to prepare reports of %s.', user.id)
+        else:
+            prepared_count += 1
+    logger.info('Prepared reports of %d users.', prepared_count)
+    return len(user_ids), prepared_count
+
+
+def prepare_reports(user, now):
+    """
+    Refreshes the summary of the last day of the user and renders the
+    timesheet and the contributions into the cache unless cached.
+
+    :param user: a User object
+    :param now: a naive datetime in UTC
+    """
+    DailyAttendance.refresh(user,
+                            local_date(user.timezone_id, now) - timedelta(days=1))
+    get_timesheet(user)
+    fingerprint = DailyAttendance.fingerprint(user)
+    summary_count, *_ = fingerprint
+    if not summary_count:
+        return
+    name, parts = contribution_figure_key(user, fingerprint)
+    if figure_cache.get(name, parts) is not None:
+        return
+    with create_temp_dir() as temp_dir:
+        path = os.path.join(temp_dir, 'contributions.png')
+        render_contribution_figure(user, path)
+        figure_cache.put(name, parts, path)
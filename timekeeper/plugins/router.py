@@ -0,0 +1,136 @@
+"""
+Routing messages to handlers.
+
+slackbot searches a message with every pattern registered by `listen_to`
+or `respond_to` one by one, and runs every handler whose pattern matches,
+so `finished working, started working again` used to run both clock
+handlers, and a handler with several matching patterns ran once per pattern.
+Here a message runs at most one handler, and only patterns whose literals
+occur in the message are searched, e.g. ` working` for `started working`,
+so most chatter in channels is dropped after a few substring tests.
+Python finds a literal much faster than it runs a pattern, or an
+alternation of them.
+"""
+
+from functools import wraps
+import re
+from threading import Lock
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+from slackbot.manager import PluginsManager
+from slackbot.utils import to_utf8
+
+
+def _required_literal(pattern):
+    """
+    Returns the longest literal which every match of pattern contains,
+    or an empty string if it is unknown.
+    """
+    longest = ''
+    literal = ''
+    for op, value in sre_parse.parse(pattern.pattern, pattern.flags):
+        if op == sre_parse.LITERAL:
+            literal += chr(value)
+            if len(literal) > len(longest):
+                longest = literal
+        else:
+            literal = ''
+    return longest
+
+
+class Router(object):
+    """
+    Routes text to at most one of the handlers of a category.
+
+    When several patterns match, the one which matches earliest in the text
+    wins, and ties go to the pattern which comes first in commands, as
+    slackbot would have run it first.
+
+    :param commands: a dict from compiled patterns to handlers
+    """
+
+    def __init__(self, commands):
+        self.routes = list(commands.items())
+        # Dicts from literals to the indices of routes which require them.
+        self._keywords = {}
+        self._folded_keywords = {}
+        self._unconditional = []
+        for index, (pattern, _) in enumerate(self.routes):
+            keyword = _required_literal(pattern)
+            if not keyword:
+                self._unconditional.append(index)
+            elif pattern.flags & re.IGNORECASE:
+                self._folded_keywords.setdefault(keyword.casefold(), []).append(index)
+            else:
+                self._keywords.setdefault(keyword, []).append(index)
+
+    def match(self, text):
+        """
+        Finds the handler for text.
+
+        :param text: a message
+        :return: a tuple of the handler and the groups of its pattern, or
+                 (None, None) if no pattern matches
+        """
+        best = None
+        for index in self._candidates(text):
+            m = self.routes[index][0].search(text)
+            if m is not None and (best is None or (m.start(), index) < best[0]):
+                best = ((m.start(), index), m)
+        if best is None:
+            return None, None
+        (_, index), m = best
+        return self.routes[index][1], to_utf8(m.groups())
+
+    def _candidates(self, text):
+        candidates = list(self._unconditional)
+        for keyword, indices in self._keywords.items():
+            if keyword in text:
+                candidates.extend(indices)
+        if self._folded_keywords:
+            folded_text = text.casefold()
+            for keyword, indices in self._folded_keywords.items():
+                if keyword in folded_text:
+                    candidates.extend(indices)
+        return candidates
+
+
+_routers = {}
+_routers_lock = Lock()
+
+
+def get_router(commands):
+    """
+    Returns a Router for commands, which is built again only when handlers
+    are added.
+
+    :param commands: a dict from compiled patterns to handlers
+    """
+    key = id(commands)
+    with _routers_lock:
+        entry = _routers.get(key)
+        if entry is None or entry[0] is not commands or entry[1] != len(commands):
+            entry = (commands, len(commands), Router(commands))
+            _routers[key] = entry
+        return entry[2]
+
+
+def install_router():
+    """
+    Makes every PluginsManager find handlers with a Router, so a message
+    runs at most one handler.
+    """
+    get_plugins = PluginsManager.get_plugins
+    if getattr(get_plugins, 'is_routed', False):
+        return
+
+    @wraps(get_plugins)
+    def routed_get_plugins(self, category, text):
+        yield get_router(self.commands[category]).match(text or '')
+
+    routed_get_plugins.is_routed = True
+    PluginsManager.get_plugins = routed_get_plugins
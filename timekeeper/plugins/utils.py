@@ -1,7 +1,13 @@
 from contextlib import contextmanager
+import os
 from shutil import rmtree
 from tempfile import mkdtemp
 
+from timekeeper.metrics import registry
+
+# Slack recommends messages up to this many characters.
+MAX_MESSAGE_LENGTH = 4000
+
 
 @contextmanager
 def create_temp_dir():
@@ -19,14 +25,38 @@ def is_direct_message(channel_id):
 def safe_upload_file(message, filename, path, comment, is_text_file=False):
     channel_id = message.body['channel']
     if not is_direct_message(channel_id):
+        registry.observe('timekeeper_upload_bytes', os.path.getsize(path),
+                         filename=filename)
         return message.channel.upload_file(filename, path, comment)
     if not is_text_file:
         return message.reply(
             'Sorry, I cannot upload a file in the private channel.'
         )
+    # Large files such as exported timesheets are read and sent in pieces.
+    size = MAX_MESSAGE_LENGTH - len(triple_backquoted(''))
     with open(path) as f:
-        text = f.read()
-        message.reply(triple_backquoted(text))
+        for text in iter_chunks(f, size):
+            message.reply(triple_backquoted(text))
+
+
+def iter_chunks(lines, size):
+    """
+    Joins lines into strings of at most size characters, splitting only
+    lines which are longer than that.
+    """
+    chunk = []
+    length = 0
+    for line in lines:
+        while line:
+            if chunk and length + len(line) > size:
+                yield ''.join(chunk)
+                chunk = []
+                length = 0
+            piece, line = line[:size], line[size:]
+            chunk.append(piece)
+            length += len(piece)
+    if chunk:
+        yield ''.join(chunk)
 
 
 def triple_backquoted(text):
@@ -1,16 +1,13 @@
-import matplotlib
-matplotlib.use('Agg')  # noqa
-
-import calmap
-import matplotlib.pyplot as plt
+import csv
 
 from tabulate import tabulate
 
+TIMESHEET_HEADERS = ['start', 'finish', 'working time']
+
 
 def render_timesheet(attendances):
     table = map(_render_timesheet_entry, attendances)
-    headers = ['start', 'finish', 'working time']
-    return tabulate(table, headers=headers)
+    return tabulate(table, headers=TIMESHEET_HEADERS)
 
 
 def render_daily_timesheet(daily_attendances):
@@ -19,11 +16,46 @@ def render_daily_timesheet(daily_attendances):
     return tabulate(table, headers=headers)
 
 
-def render_contribution_figure(series):
-    fig = plt.figure(figsize=(8, 2), dpi=72)
-    ax = fig.add_axes([0, 0, 1, 1])
-    ax = calmap.yearplot(series, ax=ax)
-    return fig
+def render_stats(registry):
+    """
+    Renders tables of handlers and Slack Web API calls.
+
+    Percentiles are upper bounds of histogram buckets.
+
+    :param registry: a timekeeper.metrics.Registry object
+    """
+    requests = registry.samples('timekeeper_handler_requests_total')
+    seconds = registry.samples('timekeeper_handler_seconds')
+    queries = registry.samples('timekeeper_handler_queries')
+    sql_seconds = registry.samples('timekeeper_handler_sql_seconds')
+    handler_table = []
+    for key, histogram in sorted(seconds.items()):
+        handler = dict(key)['handler']
+        errors = requests.get((('handler', handler), ('status', 'error')), 0)
+        handler_table.append((handler, histogram.count, errors,
+                              histogram.quantile(0.5) * 1000,
+                              histogram.quantile(0.95) * 1000,
+                              histogram.max * 1000,
+                              queries[key].sum / queries[key].count,
+                              sql_seconds[key].sum / sql_seconds[key].count * 1000))
+    api_requests = registry.samples('timekeeper_slack_api_requests_total')
+    api_table = []
+    for key, histogram in sorted(registry.samples('timekeeper_slack_api_seconds').items()):
+        method = dict(key)['method']
+        errors = api_requests.get((('method', method), ('status', 'error')), 0)
+        api_table.append((method, histogram.count, errors,
+                          histogram.quantile(0.5) * 1000,
+                          histogram.quantile(0.95) * 1000,
+                          histogram.max * 1000))
+    tables = [
+        tabulate(handler_table, floatfmt='.1f',
+                 headers=['handler', 'count', 'errors', 'p50 (ms)', 'p95 (ms)',
+                          'max (ms)', 'queries', 'SQL (ms)']),
+        tabulate(api_table, floatfmt='.1f',
+                 headers=['Web API', 'count', 'errors', 'p50 (ms)',
+                          'p95 (ms)', 'max (ms)']),
+    ]
+    return '\n\n'.join(tables)
 
 
 def _render_timesheet_entry(attendance):
@@ -39,3 +71,42 @@ def _render_daily_timesheet_entry(daily_attendance):
             d.finished_at_display,
             d.break_count,
             d.working_time_display)
+
+
+def iter_timesheet_csv_lines(attendances):
+    """
+    Formats attendances as lines of CSV one by one.
+
+    :param attendances: an iterable of Attendance objects
+    :return: a generator of lines including line terminators
+    """
+    writer = csv.writer(_LineEcho())
+    yield writer.writerow(TIMESHEET_HEADERS)
+    for attendance in attendances:
+        yield writer.writerow(_render_timesheet_entry(attendance))
+
+
+def iter_timesheet_markdown_lines(attendances):
+    """
+    Formats attendances as lines of a Markdown table one by one.
+
+    Unlike render_timesheet(), columns are not aligned because the widths
+    would not be known until all rows are read.
+
+    :param attendances: an iterable of Attendance objects
+    :return: a generator of lines including line terminators
+    """
+    yield _render_markdown_row(TIMESHEET_HEADERS)
+    yield _render_markdown_row(['---'] * len(TIMESHEET_HEADERS))
+    for attendance in attendances:
+        yield _render_markdown_row(_render_timesheet_entry(attendance))
+
+
+def _render_markdown_row(values):
+    return '| {} |\n'.format(' | '.join('' if value is None else str(value)
+                                        for value in values))
+
+
+class _LineEcho:
+    def write(self, line):
+        return line
@@ -0,0 +1,240 @@
+"""
+An asyncio runtime which dispatches Slack RTM events to slackbot plugins.
+
+slackbot polls the RTM websocket every second and runs every handler on one
+pool of threads, so clock-ins wait behind reports which render charts or
+upload files. Here the websocket is read as soon as its socket becomes
+readable, and handlers run on thread pools in two lanes. Handlers marked
+with :func:`timekeeper.plugins.decorators.urgent` have their own queue and
+threads, so they never wait for other handlers. Renders are still offloaded
+to the processes of the render pool by the handlers.
+
+Set TIMEKEEPER_RUNTIME to 'asyncio' to run the bot on it.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import ssl
+import time
+
+from slackbot import settings
+from slackbot.dispatcher import Message, MessageDispatcher
+from slackbot.manager import PluginsManager
+from slackbot.slackclient import SlackClient
+from websocket import WebSocketException
+
+from timekeeper.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+URGENT = 'urgent'
+NORMAL = 'normal'
+
+BUSY_REPLY = "Sorry but I'm busy. Please ask me again later."
+
+
+class _Lane:
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(workers)
+        self.queue = None
+        self.tasks = []
+
+
+class _Dispatcher(MessageDispatcher):
+    """
+    A MessageDispatcher which hands messages over to the runtime instead of
+    its own pool of threads.
+    """
+
+    def __init__(self, runtime, client, plugins, errors_to):
+        super().__init__(client, plugins, errors_to)
+        self._pool = runtime
+
+    def on_event(self, event):
+        event_type = event.get('type')
+        if event_type == 'message':
+            self._on_new_message(event)
+        elif event_type in ['channel_created', 'channel_rename',
+                            'group_joined', 'group_rename', 'im_created']:
+            self._client.parse_channel_data([event['channel']])
+        elif event_type in ['team_join', 'user_change']:
+            self._client.parse_user_data([event['user']])
+
+
+class Runtime:
+    """
+    Reads events from the RTM websocket of the client and dispatches them
+    until :meth:`stop` is called.
+
+    :param client: a connected SlackClient
+    :param plugins: a PluginsManager
+    :param errors_to: a channel name to report errors of handlers, or None
+    :param workers: the number of threads for handlers except urgent ones
+    :param urgent_workers: the number of threads for urgent handlers
+    :param queue_size: the maximum number of messages waiting for
+                       a thread in the normal lane, beyond which messages
+                       are declined
+    :param ping_interval: seconds between pings to keep the connection
+    """
+
+    def __init__(self, client, plugins, errors_to=None, workers=4,
+                 urgent_workers=2, queue_size=100, ping_interval=30 * 60):
+        self._client = client
+        self._plugins = plugins
+        self._dispatcher = _Dispatcher(self, client, plugins, errors_to)
+        self._lanes = {URGENT: _Lane(urgent_workers, 0),
+                       NORMAL: _Lane(workers, queue_size)}
+        self._ping_interval = ping_interval
+        self._loop = asyncio.new_event_loop()
+        self._stopped = self._loop.create_future()
+        self._watched_fd = None
+        self._ping_handle = None
+
+    def run(self):
+        """
+        Runs the event loop in the current thread until stopped.
+        """
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._run())
+        finally:
+            for lane in self._lanes.values():
+                lane.executor.shutdown(wait=True)
+            self._loop.close()
+
+    def stop(self):
+        """
+        Stops reading events and waits for running handlers.
+        It can be called from any thread.
+        """
+        def set_stopped():
+            if not self._stopped.done():
+                self._stopped.set_result(None)
+        self._loop.call_soon_threadsafe(set_stopped)
+
+    def add_task(self, task):
+        """
+        Queues a message accepted by the dispatcher.
+
+        Messages which nobody listens to are dropped here, so chatter in
+        channels does not occupy any thread.
+
+        :param task: a tuple of the category of handlers and the message
+        """
+        category, msg = task
+        handlers = [func for func, _
+                    in self._plugins.get_plugins(category, msg.get('text'))
+                    if func is not None]
+        if not handlers and category == 'listen_to':
+            return
+        is_urgent = any(getattr(func, 'is_urgent', False) for func in handlers)
+        name = URGENT if is_urgent else NORMAL
+        try:
+            self._lanes[name].queue.put_nowait((time.perf_counter(), task))
+        except asyncio.QueueFull:
+            logger.warning('Declined a message because the queue is full.')
+            registry.increment('timekeeper_runtime_declined_total')
+            if category == 'respond_to':
+                reply = Message(self._client, msg).reply
+                self._loop.run_in_executor(self._lanes[URGENT].executor,
+                                           reply, BUSY_REPLY)
+
+    async def _run(self):
+        for name, lane in self._lanes.items():
+            lane.queue = asyncio.Queue(lane.queue_size)
+            lane.tasks = [self._loop.create_task(self._work(name, lane))
+                          for _ in range(lane.workers)]
+        self._watch()
+        self._ping_handle = self._loop.call_later(self._ping_interval,
+                                                  self._ping)
+        try:
+            await self._stopped
+        finally:
+            self._ping_handle.cancel()
+            self._unwatch()
+            tasks = [task for lane in self._lanes.values()
+                     for task in lane.tasks]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _work(self, name, lane):
+        while True:
+            queued_at, task = await lane.queue.get()
+            registry.observe('timekeeper_runtime_queue_seconds',
+                             time.perf_counter() - queued_at, lane=name)
+            try:
+                await self._loop.run_in_executor(
+                    lane.executor, self._dispatcher.dispatch_msg, task)
+            except Exception:
+                logger.exception('Failed to dispatch a message.')
+
+    def _watch(self):
+        self._watched_fd = self._client.websocket.sock.fileno()
+        self._loop.add_reader(self._watched_fd, self._on_readable)
+        # Frames may have arrived before watching the socket.
+        self._loop.call_soon(self._on_readable)
+
+    def _unwatch(self):
+        if self._watched_fd is not None:
+            self._loop.remove_reader(self._watched_fd)
+            self._watched_fd = None
+
+    def _on_readable(self):
+        if self._watched_fd is None:
+            return
+        websocket = self._client.websocket
+        while True:
+            try:
+                data = websocket.recv()
+            except (BlockingIOError, ssl.SSLWantReadError):
+                return
+            except (WebSocketException, OSError) as e:
+                logger.warning('Lost the RTM connection: %s', e)
+                self._unwatch()
+                self._loop.create_task(self._reconnect())
+                return
+            if not data:
+                continue
+            try:
+                self._dispatcher.on_event(json.loads(data))
+            except Exception:
+                logger.exception('Failed to handle an event %r.', data)
+
+    async def _reconnect(self):
+        await self._loop.run_in_executor(None, self._client.ensure_connection)
+        if not self._stopped.done():
+            self._watch()
+
+    def _ping(self):
+        self._loop.run_in_executor(self._lanes[URGENT].executor,
+                                   self._client.ping)
+        self._ping_handle = self._loop.call_later(self._ping_interval,
+                                                  self._ping)
+
+
+class AsyncBot:
+    """
+    A replacement of slackbot.bot.Bot which runs plugins on Runtime.
+    """
+
+    def __init__(self):
+        self._client = SlackClient(
+            settings.API_TOKEN,
+            timeout=getattr(settings, 'TIMEOUT', None),
+            bot_icon=getattr(settings, 'BOT_ICON', None),
+            bot_emoji=getattr(settings, 'BOT_EMOJI', None))
+        self._plugins = PluginsManager()
+
+    def run(self):
+        self._plugins.init_plugins()
+        runtime = Runtime(self._client, self._plugins, settings.ERRORS_TO,
+                          workers=settings.TIMEKEEPER_RUNTIME_WORKERS,
+                          urgent_workers=settings.TIMEKEEPER_RUNTIME_URGENT_WORKERS,
+                          queue_size=settings.TIMEKEEPER_RUNTIME_QUEUE_SIZE)
+        logger.info('connected to slack RTM api')
+        runtime.run()
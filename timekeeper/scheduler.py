@@ -0,0 +1,88 @@
+"""
+Running tasks at a time of day, such as the nightly tasks of
+:func:`timekeeper.plugins.reports.run_nightly_tasks`.
+"""
+
+from datetime import datetime, time, timedelta
+import logging
+from threading import Event, Thread
+
+import pytz
+
+from timekeeper.timezones import get_timezone, local_date
+
+logger = logging.getLogger(__name__)
+
+
+class DailyScheduler(object):
+    """
+    Calls a function every day at a time in a timezone on a thread.
+
+    :param func: a function without arguments
+    :param hour: the hour of the day
+    :param minute: the minute of the hour
+    :param timezone_id: the name of the timezone of the time
+    :param name: the name of the thread
+    :param check_interval: the maximum seconds to sleep at once, so that
+                           changes of the system clock are caught up with
+    """
+
+    def __init__(self, func, hour, minute=0, timezone_id='UTC',
+                 name='timekeeper-scheduler', check_interval=600):
+        self.func = func
+        self.hour = hour
+        self.minute = minute
+        self.timezone_id = timezone_id
+        self.name = name
+        self.check_interval = check_interval
+        self._stopped = Event()
+        self._thread = None
+
+    def next_run(self, now):
+        """
+        Returns when the function runs next after now.
+
+        A time which does not exist or occurs twice because of DST is
+        resolved to the standard time.
+
+        :param now: a naive datetime in UTC
+        :return: a naive datetime in UTC
+        """
+        tz = get_timezone(self.timezone_id)
+        date = local_date(self.timezone_id, now)
+        while True:
+            local_run = tz.localize(
+                datetime.combine(date, time(self.hour, self.minute)),
+                is_dst=False)
+            run = local_run.astimezone(pytz.utc).replace(tzinfo=None)
+            if run > now:
+                return run
+            date += timedelta(days=1)
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            run = self.next_run(datetime.utcnow())
+            logger.info('Scheduled %s at %s UTC.', self.name, run)
+            while True:
+                delay = (run - datetime.utcnow()).total_seconds()
+                if delay <= 0:
+                    break
+                if self._stopped.wait(min(delay, self.check_interval)):
+                    return
+            if self._stopped.is_set():
+                return
+            try:
+                self.func()
+            except Exception:
+                logger.exception('Failed to run %s.', self.name)
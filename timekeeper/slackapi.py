@@ -0,0 +1,328 @@
+"""
+Calling the Slack Web API within its rate limits.
+
+slacker opens a connection for every call, and sleeps in the calling thread
+on HTTP 429 as many times as slackbot allows, so a burst of reactions at the
+start of a shift keeps handlers waiting, and calls which run out of retries
+fail. Here calls share a keep-alive session, and take a token from the
+bucket of their method, which is sized by the tier of the method in the
+rate limits of Slack. HTTP 429 pauses the bucket for Retry-After seconds,
+so that other calls of the method wait as well.
+
+Calls whose results nobody waits for, such as reactions to clock-ins, can be
+queued in an :class:`Outbox` instead, which makes them on a thread, retries
+them and coalesces duplicates. Calls which are not rate limited together,
+such as replies over the RTM API, should go to another Outbox, so that they
+do not wait behind throttled ones.
+"""
+
+from functools import partial
+import heapq
+import itertools
+import logging
+from threading import Condition, Lock, Thread
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+import slacker
+
+from timekeeper.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+API_URL = 'https://slack.com/api/'
+
+# Requests per minute and bursts of the tiers in
+# https://api.slack.com/docs/rate-limits
+TIERS = {
+    1: (1, 1),
+    2: (20, 3),
+    3: (50, 5),
+    4: (100, 10),
+}
+METHOD_TIERS = {
+    'rtm.connect': 1,
+    'rtm.start': 1,
+    'conversations.list': 2,
+    'files.upload': 2,
+    'users.list': 2,
+    'chat.postMessage': 3,
+    'conversations.open': 3,
+    'reactions.add': 3,
+    'users.info': 4,
+}
+DEFAULT_TIER = 3
+# Seconds to wait after HTTP 429 without Retry-After, as slacker does.
+DEFAULT_RETRY_AFTER = 20
+
+
+class TokenBucket:
+    """
+    Hands out tokens at a steady rate with bursts up to its capacity.
+
+    Tokens are reserved rather than waited for, so that callers can sleep
+    without holding the lock.
+
+    :param rate: tokens per second
+    :param capacity: the maximum number of saved tokens
+    :param clock: a function which returns monotonic seconds
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._lock = Lock()
+        self._tokens = capacity
+        self._updated_at = clock()
+        self._paused_until = self._updated_at
+
+    def reserve(self):
+        """
+        Takes a token, which may be one to be added in future.
+
+        :return: seconds to wait before using the token
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._tokens -= 1
+            return (max(0, self._paused_until - now) +
+                    max(0, -self._tokens / self.rate))
+
+    def pause(self, seconds):
+        """
+        Adds no tokens for seconds, e.g. as asked by Retry-After.
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = min(self._tokens, 1)
+
+    def _refill(self, now):
+        elapsed = now - max(self._updated_at, self._paused_until)
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+
+class SlackAPI:
+    """
+    Sends requests of the Slack Web API through a keep-alive session within
+    the rate limit of each method.
+
+    :param base_url: the URL which names of methods are appended to
+    :param max_retries: how many times to retry a request on HTTP 429
+    :param pool_size: the maximum number of connections kept alive
+    :param clock: a function which returns monotonic seconds
+    :param sleep: a function which sleeps for seconds
+    """
+
+    def __init__(self, base_url=API_URL, max_retries=3, pool_size=10,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets = {}
+        self._lock = Lock()
+
+    def bucket(self, method):
+        """
+        Returns the token bucket of a method.
+        """
+        with self._lock:
+            bucket = self._buckets.get(method)
+            if bucket is None:
+                per_minute, burst = TIERS[METHOD_TIERS.get(method, DEFAULT_TIER)]
+                bucket = TokenBucket(per_minute / 60, burst, self._clock)
+                self._buckets[method] = bucket
+            return bucket
+
+    def request(self, http_method, url, **kwargs):
+        """
+        Sends a request, waiting for the rate limit of its method.
+
+        :param http_method: 'get' or 'post'
+        :param url: the URL of a method under API_URL or base_url
+        :param kwargs: arguments of requests.Session.request
+        :return: a requests.Response
+        :raise requests.HTTPError: if Slack keeps answering with HTTP 429
+        """
+        if url.startswith(API_URL):
+            url = self.base_url + url[len(API_URL):]
+        method = url.rsplit('/', 1)[-1]
+        bucket = self.bucket(method)
+        for retry_count in range(self.max_retries + 1):
+            wait = bucket.reserve()
+            registry.observe('timekeeper_slack_api_throttled_seconds', wait,
+                             method=method)
+            if wait > 0:
+                self._sleep(wait)
+            response = self.session.request(http_method, url, **kwargs)
+            if response.status_code != requests.codes.too_many:
+                return response
+            registry.increment('timekeeper_slack_api_rate_limited_total',
+                               method=method)
+            retry_after = retry_after_seconds(response)
+            logger.warning('Slack rate limited %s for %d seconds.',
+                           method, retry_after)
+            bucket.pause(retry_after)
+        response.raise_for_status()
+
+    def install(self):
+        """
+        Makes slacker send requests through this object.
+
+        slacker retries HTTP 429 itself only when it gets the response,
+        which never happens because :meth:`request` raises for it.
+        """
+        def get(api, method, **kwargs):
+            return api._request(partial(self.request, 'get'), method, **kwargs)
+
+        def post(api, method, **kwargs):
+            return api._request(partial(self.request, 'post'), method, **kwargs)
+
+        slacker.BaseAPI.get = get
+        slacker.BaseAPI.post = post
+
+
+def retry_after_seconds(response):
+    try:
+        return int(response.headers['Retry-After'])
+    except (KeyError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class Outbox:
+    """
+    Makes calls on a thread, such as reactions and replies which handlers
+    do not have to wait for.
+
+    A failed call is retried after Retry-After for HTTP 429, or with
+    exponential backoff otherwise. A call submitted with the key of a call
+    which has not finished yet is coalesced into it.
+
+    :param maxsize: the maximum number of pending calls, beyond which calls
+                    are dropped
+    :param max_retries: how many times to retry a failed call
+    :param backoff: seconds to wait before the first retry, doubled each time
+    :param clock: a function which returns monotonic seconds
+    :param name: the name of the thread
+    """
+
+    def __init__(self, maxsize=1000, max_retries=3, backoff=1.0,
+                 clock=time.monotonic, name='timekeeper-outbox'):
+        self.maxsize = maxsize
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.name = name
+        self._clock = clock
+        # A heap of tuples of (due, sequence, key, func, args, retry_count).
+        self._calls = []
+        self._keys = set()
+        self._running = 0
+        self._sequence = itertools.count()
+        self._condition = Condition()
+        self._thread = None
+
+    def submit(self, func, *args, key=None):
+        """
+        Queues a call of func with args and returns immediately.
+
+        :param key: a hashable which identifies duplicate calls, or None
+        :return: False if the call was dropped because the outbox is full
+        """
+        with self._condition:
+            if key is not None and key in self._keys:
+                registry.increment('timekeeper_slack_outbox_calls_total',
+                                   status='coalesced')
+                return True
+            if len(self._calls) >= self.maxsize:
+                registry.increment('timekeeper_slack_outbox_calls_total',
+                                   status='dropped')
+                logger.warning('Dropped a call of %s because the outbox is '
+                               'full.', _name(func))
+                return False
+            if key is not None:
+                self._keys.add(key)
+            self._push(self._clock(), key, func, args, 0)
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name=self.name,
+                                      daemon=True)
+                self._thread.start()
+        return True
+
+    def qsize(self):
+        with self._condition:
+            return len(self._calls)
+
+    def flush(self, timeout=None):
+        """
+        Waits until all calls including retries have finished.
+
+        :return: False if timed out
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._calls and not self._running, timeout)
+
+    def _push(self, due, key, func, args, retry_count):
+        heapq.heappush(self._calls, (due, next(self._sequence), key, func,
+                                     args, retry_count))
+        self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = self._clock()
+                    if self._calls and self._calls[0][0] <= now:
+                        break
+                    timeout = self._calls[0][0] - now if self._calls else None
+                    self._condition.wait(timeout)
+                _, _, key, func, args, retry_count = heapq.heappop(self._calls)
+                self._running += 1
+            retry_at = self._call(func, args, retry_count)
+            with self._condition:
+                self._running -= 1
+                if retry_at is not None:
+                    self._push(retry_at, key, func, args, retry_count + 1)
+                else:
+                    self._keys.discard(key)
+                self._condition.notify_all()
+
+    def _call(self, func, args, retry_count):
+        """
+        :return: when to retry the call, or None if it is done
+        """
+        try:
+            func(*args)
+        except Exception as e:
+            if retry_count == self.max_retries:
+                registry.increment('timekeeper_slack_outbox_calls_total',
+                                   status='failed')
+                logger.exception('Gave up calling %s.', _name(func))
+                return None
+            response = getattr(e, 'response', None)
+            if getattr(response, 'status_code', None) == requests.codes.too_many:
+                delay = retry_after_seconds(response)
+            else:
+                delay = self.backoff * 2 ** retry_count
+            registry.increment('timekeeper_slack_outbox_calls_total',
+                               status='retried')
+            logger.warning('Failed to call %s, retrying in %.1f seconds: %s',
+                           _name(func), delay, e)
+            return self._clock() + delay
+        registry.increment('timekeeper_slack_outbox_calls_total', status='ok')
+        return None
+
+
+def _name(func):
+    return getattr(func, '__name__', repr(func))
@@ -1,23 +1,208 @@
-import pandas as pd
-from peewee import MySQLDatabase, SqliteDatabase
-
-from timekeeper.database import get_db
-
-
-def working_time_ratio_series(user):
-    db = get_db()
-    if isinstance(db, SqliteDatabase):
-        statement = """select date(started_at) as `date`,
-                            working_time_seconds
-                        from dailyattendance
-                        where user_id = ?"""
-    elif isinstance(db, MySQLDatabase):
-        statement = """select date(started_at) as `date`,
-                            working_time_seconds
-                        from dailyattendance
-                        where user_id = %s"""
+from collections import namedtuple
+
+from timekeeper.models import DailyAttendance, User
+
+
+class WorkingTimeSeries(namedtuple('WorkingTimeSeries', ['dates', 'values'])):
+    """
+    Daily values of a user.
+
+    :param dates: a numpy array of datetime64[D]
+    :param values: a numpy array of floats of the same length
+    """
+
+    def to_pandas(self):
+        import pandas as pd
+        return pd.Series(self.values, index=pd.DatetimeIndex(self.dates),
+                         name='working_time_seconds')
+
+
+class TeamStats(namedtuple('TeamStats', ['user_ids', 'dates',
+                                         'working_time_seconds',
+                                         'break_counts', 'recorded'])):
+    """
+    Daily values of users as a matrix whose rows are users and whose
+    columns are consecutive dates.
+
+    :param user_ids: a list of user IDs of each row
+    :param dates: a numpy array of datetime64[D] of each column
+    :param working_time_seconds: a numpy array of int64 of working time
+    :param break_counts: a numpy array of int64 of break counts
+    :param recorded: a numpy array of bool which is True where the user
+                     has a daily summary, since missing days are zeros
+    """
+
+    def weekly_working_time_seconds(self):
+        """
+        Returns total working time of each week, which starts on Monday.
+
+        :return: a tuple of a numpy array of datetime64[D] of Mondays and
+                 a numpy array of int64 whose rows are users and whose
+                 columns are weeks
+        """
+        import numpy as np
+
+        if not len(self.dates):
+            return (np.empty(0, dtype='datetime64[D]'),
+                    np.zeros((len(self.user_ids), 0), dtype=np.int64))
+        # 1970-01-01 was a Thursday.
+        first_weekday = (self.dates[0].astype(np.int64) + 3) % 7
+        week_indices = (np.arange(len(self.dates)) + first_weekday) // 7
+        weeks = self.dates[0] - first_weekday + 7 * np.arange(week_indices[-1] + 1)
+        totals = np.zeros((len(self.user_ids), len(weeks)), dtype=np.int64)
+        np.add.at(totals.T, week_indices, self.working_time_seconds.T)
+        return weeks, totals
+
+    def working_time_ratios(self):
+        """
+        Returns daily working time divided by its standard deviation of
+        each user, in the same way as working_time_ratio_series().
+
+        :return: a numpy array of floats which is NaN where the user has no
+                 summary or fewer than two summaries in total
+        """
+        import numpy as np
+
+        counts = self.recorded.sum(axis=1)
+        seconds = self.working_time_seconds.astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = seconds.sum(axis=1) / counts
+            deviations = np.where(self.recorded, seconds - means[:, None], 0)
+            stds = np.sqrt((deviations ** 2).sum(axis=1) / (counts - 1))
+            stds[counts < 2] = np.nan
+            ratios = seconds / stds[:, None]
+        ratios[~self.recorded] = np.nan
+        return ratios
+
+
+def team_stats(users=None, start=None, end=None, chunk_size=1024):
+    """
+    Returns daily statistics of the users in a single query.
+
+    :param users: a list of User objects or user IDs, or None for all
+                  trackable users
+    :param start: the first date to include or None
+    :param end: the date after the last date to include or None
+    :return: a TeamStats object; the rows are the given users in order,
+             or trackable users with summaries sorted by ID, and the
+             columns span from the first date to the last date found
+    """
+    import numpy as np
+
+    query = DailyAttendance.select(DailyAttendance.user,
+                                   DailyAttendance.date,
+                                   DailyAttendance.working_time_seconds,
+                                   DailyAttendance.break_count)
+    if users is None:
+        query = query.join(User).where(User.trackable == True)  # noqa: E712
+    else:
+        user_ids = [getattr(user, 'id', user) for user in users]
+        # Avoid `in ()`, which is a syntax error on MySQL.
+        query = query.where(DailyAttendance.user << (user_ids or [None]))
+    if start is not None:
+        query = query.where(DailyAttendance.date >= start)
+    if end is not None:
+        query = query.where(DailyAttendance.date < end)
+    row_user_ids, dates, seconds, break_counts = _fetch_columns(
+        query, [object, 'datetime64[D]', np.int64, np.int64], chunk_size)
+    if users is None:
+        user_ids, rows = np.unique(row_user_ids.astype(str),
+                                   return_inverse=True)
+        user_ids = user_ids.tolist()
+    else:
+        row_indices = {user_id: i for i, user_id in enumerate(user_ids)}
+        rows = np.fromiter((row_indices[user_id] for user_id in row_user_ids),
+                           dtype=np.intp, count=len(row_user_ids))
+    if len(dates):
+        first_date = dates.min()
+        columns = (dates - first_date).astype(np.intp)
+        all_dates = first_date + np.arange(columns.max() + 1)
     else:
-        raise NotImplementedError('An SQL statement for the current database {} is not implemented.'.format(db))
-    df = pd.read_sql_query(statement, db.get_conn(), index_col='date',
-                           parse_dates=['date'], params=[user.id])
-    return df.working_time_seconds / df.working_time_seconds.std()
+        columns = np.empty(0, dtype=np.intp)
+        all_dates = np.empty(0, dtype='datetime64[D]')
+    shape = (len(user_ids), len(all_dates))
+    stats = TeamStats(user_ids, all_dates,
+                      np.zeros(shape, dtype=np.int64),
+                      np.zeros(shape, dtype=np.int64),
+                      np.zeros(shape, dtype=bool))
+    stats.working_time_seconds[rows, columns] = seconds
+    stats.break_counts[rows, columns] = break_counts
+    stats.recorded[rows, columns] = True
+    return stats
+
+
+def daily_working_time_seconds(user, start=None, end=None, chunk_size=1024):
+    """
+    Returns daily working time of the user in seconds.
+
+    Rows are streamed from the cursor into preallocated arrays without
+    building model instances. numpy is imported lazily like the rest of the
+    analytics stack.
+
+    :param user: a User object
+    :param start: the first date to include or None
+    :param end: the date after the last date to include or None
+    :return: a tuple of numpy arrays of dates and seconds sorted by date
+    """
+    import numpy as np
+
+    query = (DailyAttendance
+             .select(DailyAttendance.date,
+                     DailyAttendance.working_time_seconds)
+             .where(DailyAttendance.user == user))
+    if start is not None:
+        query = query.where(DailyAttendance.date >= start)
+    if end is not None:
+        query = query.where(DailyAttendance.date < end)
+    query = query.order_by(DailyAttendance.date)
+    return _fetch_columns(query, ['datetime64[D]', np.int64], chunk_size)
+
+
+def _fetch_columns(query, dtypes, chunk_size=1024):
+    """
+    Streams rows of the query into preallocated numpy arrays.
+
+    The arrays start with room for a chunk and double when full, so the
+    rows are read in a single query without counting them first.
+
+    :param query: a SelectQuery
+    :param dtypes: a list of dtypes of each selected column
+    :return: a tuple of numpy arrays, one for each column
+    """
+    import numpy as np
+
+    size = chunk_size
+    columns = [np.empty(size, dtype=dtype) for dtype in dtypes]
+    db = query.model_class._meta.database
+    cursor = db.execute_sql(*query.sql())
+    offset = 0
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        if offset + len(rows) > size:
+            size = max(size * 2, offset + len(rows))
+            columns = [np.resize(column, size) for column in columns]
+        for i, row in enumerate(rows, offset):
+            for column, value in zip(columns, row):
+                column[i] = value
+        offset += len(rows)
+    return tuple(column[:offset] for column in columns)
+
+
+def working_time_ratio_series(user, start=None, end=None):
+    """
+    Returns daily working time of the user divided by its standard deviation.
+
+    :param user: a User object
+    :param start: the first date to include or None
+    :param end: the date after the last date to include or None
+    :return: a WorkingTimeSeries object
+    """
+    import numpy as np
+
+    dates, seconds = daily_working_time_seconds(user, start, end)
+    std = seconds.std(ddof=1) if len(seconds) > 1 else np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = seconds / std
+    return WorkingTimeSeries(dates, values)
@@ -0,0 +1,122 @@
+"""
+Conversion between UTC and local time with precomputed tables of UTC offsets.
+
+Looking up an offset in the table of a timezone is a binary search, so local
+times of many rows are computed without localizing each of them with pytz,
+and the tables can be turned into ranges of UTC time for SQL.
+"""
+
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+
+import pytz
+
+OffsetTable = namedtuple('OffsetTable', ['transition_times', 'offsets'])
+
+
+@lru_cache(maxsize=None)
+def get_timezone(timezone_id):
+    """
+    Returns a cached pytz timezone.
+
+    :raise pytz.UnknownTimeZoneError: if the timezone does not exist
+    """
+    return pytz.timezone(timezone_id)
+
+
+@lru_cache(maxsize=None)
+def get_offset_table(timezone_id):
+    """
+    Returns the UTC offsets of the timezone and when they take effect.
+
+    Adjacent entries with the same offset, e.g. where only the abbreviation
+    changes, are merged.
+
+    :return: an OffsetTable of a tuple of naive datetimes in UTC, the first of
+             which is datetime.min, and a tuple of timedeltas of the same length
+    """
+    tz = get_timezone(timezone_id)
+    transition_times = getattr(tz, '_utc_transition_times', None)
+    if transition_times is None:
+        return OffsetTable((datetime.min,), (tz.utcoffset(None),))
+    times = [datetime.min]
+    offsets = [tz._transition_info[0][0]]
+    for transition_time, (offset, _, _) in zip(transition_times[1:],
+                                               tz._transition_info[1:]):
+        if offset != offsets[-1]:
+            times.append(transition_time)
+            offsets.append(offset)
+    return OffsetTable(tuple(times), tuple(offsets))
+
+
+def utc_offset(timezone_id, utc_datetime):
+    """
+    Returns the UTC offset of the timezone at the time.
+
+    :param utc_datetime: a naive datetime in UTC
+    :return: a timedelta
+    """
+    table = get_offset_table(timezone_id)
+    return table.offsets[bisect_right(table.transition_times, utc_datetime) - 1]
+
+
+def to_local(timezone_id, utc_datetime):
+    """
+    Converts a naive datetime in UTC to a naive datetime in the timezone.
+    """
+    return utc_datetime + utc_offset(timezone_id, utc_datetime)
+
+
+def local_date(timezone_id, utc_datetime):
+    """
+    Returns the date in the timezone at the time.
+
+    :param utc_datetime: a naive datetime in UTC
+    """
+    return to_local(timezone_id, utc_datetime).date()
+
+
+def local_day_range(timezone_id, date):
+    """
+    Returns when the date starts and ends in the timezone.
+
+    A midnight which does not exist or occurs twice because of DST is
+    resolved to the standard time like pytz does with `is_dst=False`.
+
+    :return: a tuple of naive datetimes in UTC; the end is exclusive
+    """
+    tz = get_timezone(timezone_id)
+
+    def midnight(day):
+        local_midnight = tz.localize(datetime.combine(day, time.min),
+                                     is_dst=False)
+        return local_midnight.astimezone(pytz.utc).replace(tzinfo=None)
+
+    return midnight(date), midnight(date + timedelta(days=1))
+
+
+def utc_offset_ranges(timezone_id, start=None, end=None):
+    """
+    Returns the UTC offsets of the timezone which take effect between
+    the times.
+
+    :param start: a naive datetime in UTC or None
+    :param end: a naive datetime in UTC or None, which is inclusive
+    :return: a list of tuples of a naive datetime in UTC since when the offset
+             takes effect, which is None for the first one, and the offset
+             in seconds
+    """
+    table = get_offset_table(timezone_id)
+    first = 0
+    if start is not None:
+        first = bisect_right(table.transition_times, start) - 1
+    last = len(table.offsets)
+    if end is not None:
+        last = bisect_right(table.transition_times, end)
+    ranges = []
+    for i in range(first, last):
+        since = table.transition_times[i] if ranges else None
+        ranges.append((since, int(table.offsets[i].total_seconds())))
+    return ranges
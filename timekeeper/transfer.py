@@ -0,0 +1,204 @@
+"""
+Bulk export and import of users and attendances as JSON lines.
+
+A file consists of a section for each table. A section starts with a header
+object, which is followed by rows as arrays in the order of its columns::
+
+    {"table":"user","columns":["id","created_at","name",...]}
+    ["U12345678","2017-01-01 00:00:00","manicmaniac",...]
+    {"table":"attendance","columns":["id","created_at",...]}
+    [1,"2017-01-01 00:00:00",...]
+
+Daily summaries are not exported because they are rebuilt after importing.
+Archived days are restored only if the archive file written by
+:mod:`timekeeper.archive` is imported as well.
+"""
+
+from datetime import date, datetime
+from functools import lru_cache
+import json
+import logging
+import time
+
+from peewee import SqliteDatabase
+
+from timekeeper.database import write_transaction
+from timekeeper.models import Attendance, DailyAttendance, User
+
+logger = logging.getLogger(__name__)
+
+MODELS = [User, Attendance]
+
+# The default SQLITE_MAX_VARIABLE_NUMBER before SQLite 3.32.0.
+SQLITE_MAX_VARIABLES = 999
+
+
+def export_data(f, models=MODELS, chunk_size=10000, progress_interval=100000):
+    """
+    Writes all rows of the models to the file.
+
+    Rows are read from the cursor in chunks without building model instances.
+
+    :param f: a text file
+    :param models: a list of Model classes
+    :return: the number of exported rows
+    """
+    return sum(export_table(f, model, chunk_size=chunk_size,
+                            progress_interval=progress_interval)
+               for model in models)
+
+
+def export_table(f, model, where=None, chunk_size=10000,
+                 progress_interval=100000):
+    """
+    Writes a section of rows of the model to the file.
+
+    :param f: a text file
+    :param model: a Model class
+    :param where: an expression to filter rows, or None for all rows
+    :return: the number of exported rows
+    """
+    fields = model._meta.sorted_fields
+    header = {'table': model._meta.db_table,
+              'columns': [field.db_column for field in fields]}
+    f.write(_encoder.encode(header) + '\n')
+    query = model.select(*fields).order_by(model._meta.primary_key)
+    if where is not None:
+        query = query.where(where)
+    cursor = model._meta.database.execute_sql(*query.sql())
+    progress = _Progress('Exported', model, progress_interval)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        f.writelines(_encoder.encode(row) + '\n' for row in rows)
+        progress.update(len(rows))
+    return progress.finish()
+
+
+def import_data(f, batch_size=None, progress_interval=100000):
+    """
+    Inserts rows in the file written by export_data().
+
+    Rows are inserted in batches with a multi-row INSERT statement like
+    insert_many() generates, but the statement is built once per batch size
+    because compiling it with peewee takes longer than executing it.
+    Everything is inserted in a single transaction, so nothing is imported
+    if any row fails. Daily summaries are rebuilt afterwards.
+
+    :param f: a text file
+    :param batch_size: the number of rows inserted at once, which defaults
+                       to as many as SQLite can bind
+    :return: the number of imported rows
+    :raise ValueError: if the file is malformed
+    """
+    models = {model._meta.db_table: model for model in MODELS}
+    database = User._meta.database
+    total = 0
+    with write_transaction(database):
+        model = fields = progress = None
+        rows = []
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            value = json.loads(line)
+            if isinstance(value, dict):
+                if model is not None:
+                    _insert_rows(model, fields, rows, progress)
+                    total += progress.finish()
+                model = models.get(value.get('table'))
+                if model is None:
+                    raise ValueError('Unknown table at line {}: {!r}'.format(line_number, value.get('table')))
+                fields = _find_fields(model, value['columns'], line_number)
+                limit = batch_size or _max_batch_size(model, len(fields))
+                progress = _Progress('Imported', model, progress_interval)
+                rows = []
+            elif model is None:
+                raise ValueError('A row appeared before a header at line {}.'.format(line_number))
+            else:
+                rows.append(value)
+                if len(rows) >= limit:
+                    _insert_rows(model, fields, rows, progress)
+                    rows = []
+        if model is not None:
+            _insert_rows(model, fields, rows, progress)
+            total += progress.finish()
+    logger.info('Rebuilding daily attendances.')
+    DailyAttendance.rebuild()
+    return total
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+_encoder = json.JSONEncoder(separators=(',', ':'), default=_encode)
+
+
+def _find_fields(model, columns, line_number):
+    fields_by_column = {field.db_column: field
+                        for field in model._meta.sorted_fields}
+    try:
+        return [fields_by_column[column] for column in columns]
+    except KeyError as e:
+        raise ValueError('Unknown column of {} at line {}: {}'.format(model._meta.db_table, line_number, e))
+
+
+def _max_batch_size(model, column_count):
+    if isinstance(model._meta.database, SqliteDatabase):
+        return max(1, SQLITE_MAX_VARIABLES // column_count)
+    return 1000
+
+
+def _insert_rows(model, fields, rows, progress):
+    if not rows:
+        return
+    database = model._meta.database
+    statement = _insert_statement(database, model._meta.db_table,
+                                  tuple(field.db_column for field in fields),
+                                  len(rows))
+    params = []
+    for row in rows:
+        if len(row) != len(fields):
+            raise ValueError('Expected {} values but got {!r}.'.format(len(fields), row))
+        params.extend(field.db_value(value) for field, value in zip(fields, row))
+    database.execute_sql(statement, params)
+    progress.update(len(rows))
+
+
+@lru_cache(maxsize=16)
+def _insert_statement(database, table, columns, row_count):
+    compiler = database.compiler()
+    placeholders = '({})'.format(', '.join([database.interpolation] * len(columns)))
+    return 'INSERT INTO {} ({}) VALUES {}'.format(
+        compiler.quote(table),
+        ', '.join(compiler.quote(column) for column in columns),
+        ', '.join([placeholders] * row_count))
+
+
+class _Progress:
+    def __init__(self, verb, model, interval):
+        self.verb = verb
+        self.table = model._meta.db_table
+        self.interval = interval
+        self.count = 0
+        self.started_at = time.monotonic()
+
+    def update(self, count):
+        previous_count = self.count
+        self.count += count
+        if self.count // self.interval > previous_count // self.interval:
+            self.log()
+
+    def finish(self):
+        self.log()
+        return self.count
+
+    def log(self):
+        elapsed = time.monotonic() - self.started_at
+        logger.info('%s %d rows of %s (%.0f rows/s).', self.verb, self.count,
+                    self.table, self.count / elapsed if elapsed else 0)
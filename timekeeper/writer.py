@@ -0,0 +1,163 @@
+import atexit
+from collections import namedtuple
+import logging
+from queue import Empty, Queue
+import signal
+import sys
+from threading import Thread
+
+from timekeeper.database import connection, write_transaction
+from timekeeper.models import User
+
+logger = logging.getLogger(__name__)
+
+START_WORKING = 'start_working'
+FINISH_WORKING = 'finish_working'
+
+
+class AttendanceEvent(namedtuple('AttendanceEvent',
+                                 ['kind', 'user_id', 'timestamp'])):
+    """
+    A clock-in or clock-out of a user.
+
+    :param kind: START_WORKING or FINISH_WORKING
+    :param user_id: the id of the User
+    :param timestamp: a datetime in UTC when the event happened
+    """
+
+    def apply(self, user):
+        """
+        Records the event to the database.
+
+        :return: the same tuple as User.start_working or User.finish_working
+        """
+        if self.kind == START_WORKING:
+            return user.start_working(self.timestamp)
+        elif self.kind == FINISH_WORKING:
+            return user.finish_working(self.timestamp)
+        raise ValueError('Unknown event kind {!r}.'.format(self.kind))
+
+
+class AttendanceWriter(object):
+    """
+    Applies attendance events in batched transactions on a single thread.
+
+    Producers are blocked while the queue is full, and :meth:`stop` writes
+    all queued events before returning.
+
+    :param maxsize: the maximum number of queued events
+    :param batch_size: the maximum number of events per transaction
+    :param on_applied: a function called with each applied event
+    """
+
+    _stop = object()
+
+    def __init__(self, maxsize=10000, batch_size=100, on_applied=None):
+        self.batch_size = batch_size
+        self.on_applied = on_applied
+        self._queue = Queue(maxsize)
+        self._thread = None
+
+    def start(self):
+        self._thread = Thread(target=self._run,
+                              name='timekeeper-attendance-writer',
+                              daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=None):
+        """
+        Writes queued events and stops the thread.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(self._stop)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stop_on_signal(self, signum=signal.SIGTERM):
+        """
+        Writes queued events and exits when the process receives the
+        signal, such as SIGTERM sent by `docker stop`, which kills the
+        process without running atexit otherwise.
+
+        A handler installed before is called after writing instead of
+        exiting. It must be called in the main thread.
+        """
+        previous_handler = signal.getsignal(signum)
+
+        def handle(signum, frame):
+            logger.info('Writing %d queued events before exiting.',
+                        self.qsize())
+            self.stop()
+            if callable(previous_handler):
+                previous_handler(signum, frame)
+            else:
+                sys.exit(128 + signum)
+
+        signal.signal(signum, handle)
+
+    def submit(self, event, callback=None):
+        """
+        Queues the event to be written.
+
+        :param event: an AttendanceEvent object
+        :param callback: a function called with the result of
+                         AttendanceEvent.apply after it is committed
+        """
+        self._queue.put((event, callback))
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is self._stop:
+                return
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except Empty:
+                    break
+                if item is self._stop:
+                    self._write(batch)
+                    return
+                batch.append(item)
+            self._write(batch)
+
+    def _write(self, batch):
+        db = User._meta.database
+        with connection(db):
+            try:
+                with write_transaction(db):
+                    results = self._apply(batch)
+            except Exception:
+                logger.exception('Failed to write %d events at once, '
+                                 'retrying one by one.', len(batch))
+                results = []
+                for item in batch:
+                    try:
+                        with write_transaction(db):
+                            results.extend(self._apply([item]))
+                    except Exception:
+                        logger.exception('Failed to write %r.', item[0])
+        for (event, callback), result in results:
+            if self.on_applied is not None:
+                self.on_applied(event)
+            if callback is not None:
+                try:
+                    callback(*result)
+                except Exception:
+                    logger.exception('Callback for %r failed.', event)
+
+    def _apply(self, batch):
+        users = {}
+        results = []
+        for event, callback in batch:
+            user = users.get(event.user_id)
+            if user is None:
+                user = users[event.user_id] = User.get(User.id == event.user_id)
+            results.append(((event, callback), event.apply(user)))
+        return results